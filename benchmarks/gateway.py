@@ -0,0 +1,296 @@
+"""
+End-to-end benchmark of the gateway hot path: requests go through the mounted main.app over ASGI
+(no sockets, no uvicorn) and the RPC layer talks to fake services on the in-process broker, so only
+gateway time (middlewares, auth, routing, RPC client, serialization) is measured.
+
+    python -m benchmarks.gateway                      # all scenarios
+    python -m benchmarks.gateway -s get_cart -n 2000 -c 64
+    python -m benchmarks.gateway --save before        # store baselines/before.json
+    python -m benchmarks.gateway --compare before     # print the change against it
+
+Run it from the repository root.
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BASELINES_DIR = os.path.join(ROOT, "benchmarks", "baselines")
+
+# settings are read on import, the gateway must come up without RabbitMQ, InfluxDB and services
+os.environ.setdefault("RPC_TRANSPORT", "memory")
+os.environ.setdefault("INFLUXDB_ENABLED", "0")
+os.environ.setdefault("RABBITMQ_HOST", "localhost")
+os.environ.setdefault("RABBITMQ_PORT", "5672")
+os.environ.setdefault("RABBITMQ_USER", "guest")
+os.environ.setdefault("RABBITMQ_PASS", "guest")
+os.environ.setdefault("SECRET_KEY", "benchmark-secret")
+os.environ.setdefault("DEBUG_MODE", "0")
+os.environ.setdefault("GALLERY_DIR", tempfile.mkdtemp(prefix="gallery-"))
+sys.path[:0] = [ROOT, os.path.join(ROOT, "source")]
+
+from source.message_broker.memory_broker import memory_broker, FakeService, lognormal  # noqa: E402
+from source.routers.customer.module.auth import AuthHandler  # noqa: E402
+from main import app  # noqa: E402
+
+SYSTEM_CODE = "1000010010010010010010001"
+STORAGE_ID = "1"
+USER = {"user_id": 20000, "phone_number": "09123456789", "customer_type": ["B2B"], "person_id": None}
+
+
+# ----------------------------------------- Fake services ---------------------------------------------------------- #
+
+def ok(message=None, **extra) -> dict:
+    return dict({"success": True, "status_code": 200, "message": message if message is not None else {}}, **extra)
+
+
+def storage(system_code: str) -> dict:
+    return {
+        "storage_id": STORAGE_ID, "quantity": 1000, "reserved": 10, "min_qty": 1, "max_qty": 100,
+        "regular": 1_250_000, "special": None, "warehouse_label": "Tehran", "warehouse_state": "Tehran",
+        "warehouse_city": "Tehran", "warehouse_state_id": 1, "warehouse_city_id": 1, "system_code": system_code
+    }
+
+
+def product(body: dict) -> dict:
+    system_code = body.get("system_code", SYSTEM_CODE)
+    return ok({
+        "system_code": system_code, "name": f"Product {system_code[-4:]}", "brand": "Brand", "visible_in_site": True,
+        "step": 5, "warehouse_details": {"B2B": {"storages": {STORAGE_ID: storage(system_code)}}}
+    })
+
+
+def mega_menu(body: dict) -> dict:
+    return ok([
+        {"name": f"Category {i}", "route": f"category-{i}", "children": [
+            {"name": f"Sub category {i}.{j}", "route": f"sub-category-{i}-{j}", "children": [
+                {"name": f"Brand {k}", "route": f"brand-{k}"} for k in range(8)
+            ]} for j in range(6)
+        ]} for i in range(8)
+    ])
+
+
+def cart(body: dict) -> dict:
+    return ok({
+        "user_id": body.get("user_id"),
+        "products": [
+            {"system_code": SYSTEM_CODE[:-2] + f"{i:02d}", "storage_id": STORAGE_ID, "count": 2, "name": f"Product {i}"}
+            for i in range(10)
+        ],
+        "credits": [], "baskets": {}, "shipment": {}, "coupon": None, "payment": {}
+    })
+
+
+def order(body: dict) -> dict:
+    # get_one_order answers with the order next to message, not in it
+    return ok(order_object={
+        "orderNumber": body.get("order_id"), "status": "pending_payment", "coupon": None,
+        "payment": {"paymentMethod": [{"walletConsume": None}]},
+        "customer": {"id": USER["user_id"], "mobile": USER["phone_number"], "fullName": "Benchmark User", "type": "B2B"}
+    })
+
+
+def callback_pay(body: dict) -> dict:
+    # a payment the customer cancelled in the bank page: no bank verification, straight to the service callback
+    service = "order" if "order" in body.get("request", "") else "wallet"
+    return {"success": False, "status_code": 400, "message": {
+        "service": service, "service_id": 1001, "customer_id": USER["user_id"], "is_paid": False
+    }}
+
+
+def setup_services(latency: float):
+    """the services every scenario talks to, each answering after a lognormal delay around latency"""
+    delay = lognormal(latency) if latency else None
+    services = {
+        "product": {
+            "get_product_by_system_code": product, "get_product_backoffice": product,
+            "get_mega_menu": mega_menu, "remove_from_reserve": ok()
+        },
+        "customer": {"check_is_registered": ok({"customerIsActive": True, "customerOfogh": True})},
+        "order": {
+            "customer_products_report": ok(customer_detail=[]), "get_one_order": order,
+            "order_bank_callback_cancel": ok()
+        },
+        "cart": {
+            "get_cart": cart, "add_and_edit_product_in_cart": lambda body: ok(body),
+            "remove_cart_bank_callback": ok()
+        },
+        "wallet": {
+            "get_wallet_by_customer_id": ok({"customerId": USER["user_id"], "remainingAmount": 5_000_000}),
+            "charge_wallet": ok({"customer_type": "B2B", "service_id": 1001})
+        },
+        "payment": {"callback_pay": callback_pay},
+    }
+    for name, handlers in services.items():
+        memory_broker.add_service(FakeService(name, handlers=handlers, latency=delay))
+
+
+# ----------------------------------------- Scenarios -------------------------------------------------------------- #
+
+def auth_headers() -> dict:
+    auth = AuthHandler()
+    return {"access": auth.encode_access_token(USER), "refresh": auth.encode_refresh_token(USER)}
+
+
+def scenarios() -> dict:
+    auth = auth_headers()
+    json_headers = dict(auth, **{"content-type": "application/json"})
+    return {
+        "put_cart": ("PUT", "/cart/api/v1/cart/", json_headers,
+                     json.dumps({"systemCode": SYSTEM_CODE, "storageId": STORAGE_ID, "count": 1}).encode()),
+        "get_cart": ("GET", "/cart/api/v1/cart/", auth, b""),
+        "get_mega_menu": ("GET", "/product/api/v1/get_mega_menu/?customer_type=B2B", {}, b""),
+        "get_customer_wallet": ("GET", "/wallet/api/v1/get-customer-wallet", auth, b""),
+        "order_payment_callback": ("POST", "/payment/api/v1/callback", {}, b"ResNum=order-1001&State=CanceledByUser"),
+        "wallet_payment_callback": ("POST", "/payment/api/v1/callback", {}, b"ResNum=wallet-1001&State=CanceledByUser"),
+    }
+
+
+# ----------------------------------------- ASGI driver ------------------------------------------------------------ #
+
+async def call(method: str, path: str, headers: dict, body: bytes) -> int:
+    path, _, query = path.partition("?")
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": method, "scheme": "http",
+        "path": path, "raw_path": path.encode(), "query_string": query.encode(), "root_path": "",
+        "headers": [(key.lower().encode(), value.encode()) for key, value in headers.items()]
+        + [(b"host", b"benchmark"), (b"content-length", str(len(body)).encode())],
+        "client": ("127.0.0.1", 50000), "server": ("benchmark", 80),
+    }
+    messages = [{"type": "http.request", "body": body, "more_body": False}]
+    status = 0
+
+    async def receive():
+        if messages:
+            return messages.pop()
+        await asyncio.Event().wait()
+
+    async def send(message):
+        nonlocal status
+        if message["type"] == "http.response.start":
+            status = message["status"]
+
+    await app(scope, receive, send)
+    return status
+
+
+async def run_load(request: tuple, total: int, concurrency: int) -> tuple:
+    latencies = list()
+    errors = 0
+    remaining = iter(range(total))
+
+    async def worker():
+        nonlocal errors
+        for _ in remaining:
+            started = time.perf_counter()
+            status = await call(*request)
+            latencies.append(time.perf_counter() - started)
+            errors += status >= 400 or status == 0
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return latencies, errors, time.perf_counter() - started
+
+
+async def measure_allocations(request: tuple, samples: int) -> float:
+    # peak KiB traced while one request is in flight, median over sequential requests
+    peaks = list()
+    tracemalloc.start()
+    try:
+        for _ in range(samples):
+            tracemalloc.reset_peak()
+            before = tracemalloc.get_traced_memory()[0]
+            await call(*request)
+            peaks.append((tracemalloc.get_traced_memory()[1] - before) / 1024)
+    finally:
+        tracemalloc.stop()
+    return statistics.median(peaks)
+
+
+def percentile(values: list, q: float) -> float:
+    values = sorted(values)
+    return values[min(int(len(values) * q), len(values) - 1)]
+
+
+async def bench(names: list, total: int, concurrency: int, warmup: int, alloc_samples: int) -> dict:
+    results = dict()
+    all_scenarios = scenarios()
+    for name in names:
+        request = all_scenarios[name]
+        await run_load(request, warmup, concurrency)
+        latencies, errors, elapsed = await run_load(request, total, concurrency)
+        results[name] = {
+            "requests": total,
+            "concurrency": concurrency,
+            "errors": errors,
+            "throughput": round(total / elapsed, 1),
+            "p50_ms": round(percentile(latencies, 0.50) * 1000, 2),
+            "p95_ms": round(percentile(latencies, 0.95) * 1000, 2),
+            "p99_ms": round(percentile(latencies, 0.99) * 1000, 2),
+            "alloc_kib": round(await measure_allocations(request, alloc_samples), 1),
+        }
+    return results
+
+
+# ----------------------------------------- Reporting -------------------------------------------------------------- #
+
+COLUMNS = ("throughput", "p50_ms", "p95_ms", "p99_ms", "alloc_kib", "errors")
+
+
+def report(results: dict, baseline: dict = None):
+    print(f"{'scenario':<26}" + "".join(f"{column:>20}" for column in COLUMNS))
+    for name, result in results.items():
+        row = f"{name:<26}"
+        for column in COLUMNS:
+            cell = f"{result[column]}"
+            old = (baseline or {}).get(name, {}).get(column)
+            if old:
+                cell += f" ({(result[column] - old) / old * 100:+.0f}%)"
+            row += f"{cell:>20}"
+        print(row)
+
+
+def save_baseline(name: str, results: dict, args: argparse.Namespace):
+    os.makedirs(BASELINES_DIR, exist_ok=True)
+    path = os.path.join(BASELINES_DIR, f"{name}.json")
+    with open(path, "w") as f:
+        json.dump({"created": time.strftime("%Y-%m-%d %H:%M:%S"), "python": sys.version.split()[0],
+                   "latency_ms": args.latency, "results": results}, f, indent=2)
+    print(f"baseline saved to {path}")
+
+
+def load_baseline(name: str) -> dict:
+    with open(os.path.join(BASELINES_DIR, f"{name}.json")) as f:
+        return json.load(f)["results"]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark gateway routes over ASGI against fake services")
+    parser.add_argument("-s", "--scenario", action="append", choices=list(scenarios()),
+                        help="scenario to run, repeatable (default: all)")
+    parser.add_argument("-n", "--requests", type=int, default=1000, help="measured requests per scenario")
+    parser.add_argument("-c", "--concurrency", type=int, default=32, help="requests in flight")
+    parser.add_argument("--warmup", type=int, default=100, help="unmeasured requests before each scenario")
+    parser.add_argument("--alloc-samples", type=int, default=50, help="sequential requests traced for allocations")
+    parser.add_argument("--latency", type=float, default=2, help="median fake service latency in milliseconds")
+    parser.add_argument("--save", metavar="NAME", help="save the results as baselines/NAME.json")
+    parser.add_argument("--compare", metavar="NAME", help="show the change against baselines/NAME.json")
+    args = parser.parse_args()
+
+    setup_services(args.latency / 1000)
+    results = asyncio.run(bench(
+        args.scenario or list(scenarios()), args.requests, args.concurrency, args.warmup, args.alloc_samples
+    ))
+    report(results, load_baseline(args.compare) if args.compare else None)
+    if args.save:
+        save_baseline(args.save, results, args)
+
+
+if __name__ == "__main__":
+    main()
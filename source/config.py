@@ -15,12 +15,107 @@ class Settings(BaseSettings):
     RABBITMQ_PORT: int = os.getenv("RABBITMQ_PORT")
     RABBITMQ_USER: str = os.getenv("RABBITMQ_USER")
     RABBITMQ_PASS: str = os.getenv("RABBITMQ_PASS")
+    RABBITMQ_POOL_SIZE: int = os.getenv("RABBITMQ_POOL_SIZE", 20)
+    RABBITMQ_POOL_TIMEOUT: float = os.getenv("RABBITMQ_POOL_TIMEOUT", 10)
+    RABBITMQ_DIRECT_REPLY_TO: bool = os.getenv("RABBITMQ_DIRECT_REPLY_TO", False)
+
+    # RPC
+    RPC_TRANSPORT: str = os.getenv("RPC_TRANSPORT", "amqp")
+    REQUEST_TIMEOUT: float = os.getenv("REQUEST_TIMEOUT", 30)
+    RPC_SERVICE_TIMEOUTS: dict = os.getenv("RPC_SERVICE_TIMEOUTS", {})
+    RPC_CODEC: str = os.getenv("RPC_CODEC", "json")
+    RPC_CODEC_SERVICES: list = os.getenv("RPC_CODEC_SERVICES", [])
+    RPC_COMPRESSION: str = os.getenv("RPC_COMPRESSION", "zlib")
+    RPC_COMPRESSION_THRESHOLD: int = os.getenv("RPC_COMPRESSION_THRESHOLD", 64 * 1024)
+    RPC_COMPRESSION_LEVEL: int = os.getenv("RPC_COMPRESSION_LEVEL", 3)
+    RPC_COMPRESSION_SERVICES: list = os.getenv("RPC_COMPRESSION_SERVICES", [])
+    RPC_NOTIFY_BATCH_SIZE: int = os.getenv("RPC_NOTIFY_BATCH_SIZE", 100)
+    RPC_NOTIFY_RETRIES: int = os.getenv("RPC_NOTIFY_RETRIES", 3)
+    RPC_QUERY_ACTIONS: list = os.getenv("RPC_QUERY_ACTIONS", [])
+    RPC_COALESCE_ACTIONS: list = os.getenv(
+        "RPC_COALESCE_ACTIONS", ["get_mega_menu", "get_main_menu", "get_category_list", "price_list"]
+    )
+    RPC_BATCH_SERVICES: list = os.getenv("RPC_BATCH_SERVICES", [])
+    RPC_BATCH_SIZE: int = os.getenv("RPC_BATCH_SIZE", 100)
+    RPC_BULK_ACTIONS: list = os.getenv("RPC_BULK_ACTIONS", [])
+    RPC_BULK_CONCURRENCY: int = os.getenv("RPC_BULK_CONCURRENCY", 4)
+    RPC_BULK_QUEUE_TIMEOUT: float = os.getenv("RPC_BULK_QUEUE_TIMEOUT", 10)
+    RPC_PRIORITY_INTERACTIVE: int = os.getenv("RPC_PRIORITY_INTERACTIVE", 5)
+    RPC_PRIORITY_BULK: int = os.getenv("RPC_PRIORITY_BULK", 1)
+    RPC_HEDGE_ACTIONS: list = os.getenv(
+        "RPC_HEDGE_ACTIONS", ["get_product_by_system_code", "get_stock", "get_default_address"]
+    )
+    RPC_HEDGE_PERCENTILE: float = os.getenv("RPC_HEDGE_PERCENTILE", 0.95)
+    RPC_HEDGE_MIN_DELAY: float = os.getenv("RPC_HEDGE_MIN_DELAY", 0.01)
+    RPC_HEDGE_MIN_SAMPLES: int = os.getenv("RPC_HEDGE_MIN_SAMPLES", 50)
+    RPC_HEDGE_BUDGET: float = os.getenv("RPC_HEDGE_BUDGET", 0.05)
+
+    # Circuit breaker
+    CIRCUIT_BREAKER_WINDOW: int = os.getenv("CIRCUIT_BREAKER_WINDOW", 20)
+    CIRCUIT_BREAKER_MIN_CALLS: int = os.getenv("CIRCUIT_BREAKER_MIN_CALLS", 10)
+    CIRCUIT_BREAKER_ERROR_RATE: float = os.getenv("CIRCUIT_BREAKER_ERROR_RATE", 0.5)
+    CIRCUIT_BREAKER_SLOW_CALL: float = os.getenv("CIRCUIT_BREAKER_SLOW_CALL", 3)
+    CIRCUIT_BREAKER_OPEN_SECONDS: float = os.getenv("CIRCUIT_BREAKER_OPEN_SECONDS", 15)
+
+    # Admission control
+    RPC_ADMISSION_INITIAL_LIMIT: int = os.getenv("RPC_ADMISSION_INITIAL_LIMIT", 20)
+    RPC_ADMISSION_MIN_LIMIT: int = os.getenv("RPC_ADMISSION_MIN_LIMIT", 2)
+    RPC_ADMISSION_MAX_LIMIT: int = os.getenv("RPC_ADMISSION_MAX_LIMIT", 200)
+    RPC_ADMISSION_LATENCY_TARGET: float = os.getenv("RPC_ADMISSION_LATENCY_TARGET", 1)
+    RPC_ADMISSION_BACKOFF: float = os.getenv("RPC_ADMISSION_BACKOFF", 0.9)
+    RPC_ADMISSION_QUEUE_SIZE: int = os.getenv("RPC_ADMISSION_QUEUE_SIZE", 50)
+    RPC_ADMISSION_QUEUE_TIMEOUT: float = os.getenv("RPC_ADMISSION_QUEUE_TIMEOUT", 1)
+    RPC_ADMISSION_RETRY_AFTER: int = os.getenv("RPC_ADMISSION_RETRY_AFTER", 1)
+
+    # MongoDB
+    MONGO_HOST: str = os.getenv("MONGO_HOST", "localhost")
+    MONGO_PORT: int = os.getenv("MONGO_PORT", 27017)
+    MONGO_USER: str = os.getenv("MONGO_USER")
+    MONGO_PASS: str = os.getenv("MONGO_PASS")
+    MONGO_POOL_SIZE: int = os.getenv("MONGO_POOL_SIZE", 20)
+    SAGA_FLUSH_INTERVAL: float = os.getenv("SAGA_FLUSH_INTERVAL", 0.5)
+    SAGA_FLUSH_BATCH_SIZE: int = os.getenv("SAGA_FLUSH_BATCH_SIZE", 100)
+    SAGA_RECOVERY_ON_STARTUP: bool = os.getenv("SAGA_RECOVERY_ON_STARTUP", False)
+    SAGA_RECOVERY_GRACE: float = os.getenv("SAGA_RECOVERY_GRACE", 300)
+    SAGA_RECOVERY_LEASE: float = os.getenv("SAGA_RECOVERY_LEASE", 600)
+    SAGA_RECOVERY_WORKERS: int = os.getenv("SAGA_RECOVERY_WORKERS", 16)
+    SAGA_RECOVERY_BATCH_SIZE: int = os.getenv("SAGA_RECOVERY_BATCH_SIZE", 500)
+    SAGA_RECOVERY_RATE: float = os.getenv("SAGA_RECOVERY_RATE", 50)
+    SAGA_RECOVERY_SERVICE_RATES: dict = os.getenv("SAGA_RECOVERY_SERVICE_RATES", {})
 
     # InfluxDB
 
     INFLUXDB_HOST: str = os.getenv("INFLUXDB_HOST")
     INFLUXDB_PORT: int = os.getenv("INFLUXDB_PORT")
     INFLUXDB_DB: str = os.getenv("INFLUXDB_DB")
+    INFLUXDB_ENABLED: bool = os.getenv("INFLUXDB_ENABLED", True)
+    INFLUXDB_BATCH_SIZE: int = os.getenv("INFLUXDB_BATCH_SIZE", 500)
+    INFLUXDB_FLUSH_INTERVAL: float = os.getenv("INFLUXDB_FLUSH_INTERVAL", 1)
+    INFLUXDB_QUEUE_SIZE: int = os.getenv("INFLUXDB_QUEUE_SIZE", 10000)
+
+    # Tracing
+    TRACING_SERVER_TIMING: bool = os.getenv("TRACING_SERVER_TIMING", False)
+    TRACING_EXPORTER: str = os.getenv("TRACING_EXPORTER", "none")
+    TRACING_FILE: str = os.getenv("TRACING_FILE", "log/traces.jsonl")
+    TRACING_OTLP_ENDPOINT: str = os.getenv("TRACING_OTLP_ENDPOINT", "http://localhost:4318/v1/traces")
+    TRACING_SERVICE_NAME: str = os.getenv("TRACING_SERVICE_NAME", "api-gateway")
+    TRACING_BATCH_SIZE: int = os.getenv("TRACING_BATCH_SIZE", 512)
+    TRACING_FLUSH_INTERVAL: float = os.getenv("TRACING_FLUSH_INTERVAL", 1)
+    TRACING_QUEUE_SIZE: int = os.getenv("TRACING_QUEUE_SIZE", 10000)
+
+    # Prometheus
+    PROMETHEUS_MULTIPROC_DIR: str = os.getenv("PROMETHEUS_MULTIPROC_DIR")
+
+    # Profiler
+    PROFILER_ENABLED: bool = os.getenv("PROFILER_ENABLED", False)
+    PROFILER_DIR: str = os.getenv("PROFILER_DIR", "log/profiles")
+    PROFILER_INTERVAL: float = os.getenv("PROFILER_INTERVAL", 0.01)
+    PROFILER_SLOW_THRESHOLD: float = os.getenv("PROFILER_SLOW_THRESHOLD", 1)
+    PROFILER_SAMPLE_RATE: int = os.getenv("PROFILER_SAMPLE_RATE", 100)
+    PROFILER_FLUSH_INTERVAL: float = os.getenv("PROFILER_FLUSH_INTERVAL", 10)
+    PROFILER_MAX_BYTES: int = os.getenv("PROFILER_MAX_BYTES", 10 * 1024 * 1024)
+    PROFILER_BACKUPS: int = os.getenv("PROFILER_BACKUPS", 5)
+    PROFILER_ADMIN_TOKEN: str = os.getenv("PROFILER_ADMIN_TOKEN")
 
     # Uvicorn
     UVICORN_HOST: str = os.getenv("UVICORN_HOST")
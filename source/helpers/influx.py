@@ -1,39 +1,96 @@
-from source.config import settings
-from influxdb import InfluxDBClient
+import logging
+import queue
+import threading
+import time
 from datetime import datetime
 
+from influxdb import InfluxDBClient
+
+from source.config import settings
+from source.helpers.metrics import INFLUX_POINTS
 
-class InfluxConnection:
-    __slots__ = ["client", "__db", "__instance"]
 
-    @classmethod
-    def __new__(cls, *args, **kwargs):
-        if not hasattr(cls, '__instance'):
-            cls.__instance = super(InfluxConnection, cls).__new__(cls)
-        return cls.__instance
+class InfluxWriter:
+    """
+    Background writer of the monitoring points. monitoring() only puts the point in a bounded
+    queue; a worker thread writes them in batches of INFLUXDB_BATCH_SIZE or every
+    INFLUXDB_FLUSH_INTERVAL seconds on one long-lived client. When Influx is slower than the
+    traffic the queue fills up and new points are dropped (and counted), requests never wait on it.
+    """
 
     def __init__(self):
-        self.client = InfluxDBClient(
-            host=settings.INFLUXDB_HOST,
-            port=settings.INFLUXDB_PORT,
-            database=settings.INFLUXDB_DB
-        )
-        self.client.create_database(settings.INFLUXDB_DB)
-
-    def __enter__(self):
-        return self
+        self.queue = queue.Queue(maxsize=settings.INFLUXDB_QUEUE_SIZE)
+        self.client = None
+        self.thread = None
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
 
-    def __exit__(self, exc_type, exc_val, exc_tb):
-        self.client.close()
+    def connect(self) -> InfluxDBClient:
+        if self.client is None:
+            client = InfluxDBClient(
+                host=settings.INFLUXDB_HOST,
+                port=settings.INFLUXDB_PORT,
+                database=settings.INFLUXDB_DB
+            )
+            client.create_database(settings.INFLUXDB_DB)
+            self.client = client
+        return self.client
 
     def monitoring(self, tags, fields):
-        self.client.write_points(
-            [
-                {
-                    "measurement": settings.INFLUXDB_DB,
-                    "tags": tags,
-                    "fields": fields,
-                    "time": datetime.now().strftime("%Y-%m-%d %H:%M:%S")}
-            ]
-        )
-        return
+        point = {
+            "measurement": settings.INFLUXDB_DB,
+            "tags": tags,
+            "fields": fields,
+            "time": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        }
+        if self.thread is None:
+            with self.lock:
+                if self.thread is None:
+                    self.thread = threading.Thread(target=self.run, name="influx-writer", daemon=True)
+                    self.thread.start()
+        try:
+            self.queue.put_nowait(point)
+        except queue.Full:
+            INFLUX_POINTS.labels(result="dropped").inc()
+
+    def batch(self, timeout: float) -> list:
+        points = list()
+        deadline = time.monotonic() + timeout
+        while len(points) < settings.INFLUXDB_BATCH_SIZE:
+            try:
+                points.append(self.queue.get(timeout=max(deadline - time.monotonic(), 0)))
+            except queue.Empty:
+                break
+        return points
+
+    def write(self, points: list):
+        try:
+            self.connect().write_points(points)
+            INFLUX_POINTS.labels(result="written").inc(len(points))
+        except Exception as e:
+            # the points are lost, a new client is made for the next batch
+            logging.error(f"Writing {len(points)} points to InfluxDB failed... {e}")
+            INFLUX_POINTS.labels(result="failed").inc(len(points))
+            self.client = None
+
+    def run(self):
+        while not self.stopped.is_set():
+            points = self.batch(settings.INFLUXDB_FLUSH_INTERVAL)
+            if points:
+                self.write(points)
+
+    def close(self):
+        """write what is still queued and stop the worker"""
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join(settings.INFLUXDB_FLUSH_INTERVAL + 1)
+        points = self.batch(0)
+        while points:
+            self.write(points)
+            points = self.batch(0)
+        if self.client is not None:
+            self.client.close()
+            self.client = None
+
+
+influx_writer = InfluxWriter()
@@ -0,0 +1,207 @@
+import os
+
+from source.config import settings
+
+# prometheus_client chooses multiprocess mode from the environment when it is imported: every worker
+# then writes its samples to files in PROMETHEUS_MULTIPROC_DIR and /metrics merges them.
+# Gauges are per worker (liveall: labelled by pid, dropped when the worker exits).
+if settings.PROMETHEUS_MULTIPROC_DIR:
+    os.environ.setdefault("PROMETHEUS_MULTIPROC_DIR", settings.PROMETHEUS_MULTIPROC_DIR)
+    os.makedirs(settings.PROMETHEUS_MULTIPROC_DIR, exist_ok=True)
+
+from prometheus_client import Counter, Gauge, Histogram, values  # noqa: E402
+
+if settings.PROMETHEUS_MULTIPROC_DIR and values.ValueClass is values.MutexValue:
+    raise RuntimeError(
+        "prometheus_client was imported before source.helpers.metrics set PROMETHEUS_MULTIPROC_DIR, "
+        "every worker would serve its own samples only; import source.helpers.metrics first"
+    )
+
+# ----------------------------------------- HTTP requests ---------------------------------------------------------- #
+
+HTTP_REQUESTS = Counter(
+    "gateway_http_requests_total",
+    "HTTP requests per sub-app, method, route template and status",
+    ["app", "method", "route", "status"]
+)
+HTTP_REQUEST_SECONDS = Histogram(
+    "gateway_http_request_seconds",
+    "Response time of HTTP requests per sub-app, method and route template",
+    ["app", "method", "route"],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+)
+HTTP_REQUESTS_IN_PROGRESS = Gauge(
+    "gateway_http_requests_in_progress",
+    "HTTP requests being served by all workers",
+    multiprocess_mode="livesum"
+)
+
+# ----------------------------------------- RPC calls -------------------------------------------------------------- #
+
+RPC_CALL_SECONDS = Histogram(
+    "gateway_rpc_call_seconds",
+    "Time of RPC calls from the call to the last reply, per service, action and outcome (see tracing.RpcSpan)",
+    ["service", "action", "outcome"],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+)
+
+# ----------------------------------------- Circuit breakers ------------------------------------------------------- #
+
+CIRCUIT_STATE = Gauge(
+    "gateway_rpc_circuit_state",
+    "Circuit breaker state per downstream service (0 closed, 1 half open, 2 open)",
+    ["service"],
+    multiprocess_mode="liveall"
+)
+CIRCUIT_FAILURE_RATE = Gauge(
+    "gateway_rpc_circuit_failure_rate",
+    "Failure rate of the calls in the circuit breaker window per downstream service",
+    ["service"],
+    multiprocess_mode="liveall"
+)
+CIRCUIT_REJECTED = Counter(
+    "gateway_rpc_circuit_rejected_total",
+    "Calls rejected because the service's circuit was open",
+    ["service"]
+)
+
+# ----------------------------------------- Single flight ---------------------------------------------------------- #
+
+RPC_COALESCED = Counter(
+    "gateway_rpc_coalesced_total",
+    "Calls that shared the broker round-trip of an identical call already in flight",
+    ["service", "action"]
+)
+
+# ----------------------------------------- Compression ------------------------------------------------------------ #
+
+RPC_COMPRESSION_RATIO = Histogram(
+    "gateway_rpc_compression_ratio",
+    "Uncompressed / compressed size of RPC bodies above the compression threshold",
+    ["direction", "encoding"],
+    buckets=(1, 1.5, 2, 3, 5, 8, 12, 20, 50)
+)
+RPC_COMPRESSION_SECONDS = Histogram(
+    "gateway_rpc_compression_seconds",
+    "Time spent compressing requests and decompressing replies",
+    ["direction", "encoding"],
+    buckets=(.0005, .001, .0025, .005, .01, .025, .05, .1, .25, .5)
+)
+
+# ----------------------------------------- Notifications ---------------------------------------------------------- #
+
+RPC_NOTIFICATIONS = Counter(
+    "gateway_rpc_notifications_total",
+    "Fire-and-forget messages by publisher confirm result (confirmed, retried, failed, fallback)",
+    ["result"]
+)
+
+# ----------------------------------------- Action classification -------------------------------------------------- #
+
+RPC_MESSAGES = Counter(
+    "gateway_rpc_messages_total",
+    "RPC messages per service and action, by classification (query: transient, command: persistent and confirmed)",
+    ["service", "action", "kind"]
+)
+
+# ----------------------------------------- Saga journal ----------------------------------------------------------- #
+
+SAGA_JOURNAL_WRITES = Counter(
+    "gateway_saga_journal_writes_total",
+    "Saga stack changes by outcome (written in a bulk flush, collapsed before reaching Mongo, failed)",
+    ["result"]
+)
+SAGA_JOURNAL_FLUSH_SECONDS = Histogram(
+    "gateway_saga_journal_flush_seconds",
+    "Duration of the saga journal bulk writes",
+    buckets=(.001, .0025, .005, .01, .025, .05, .1, .25, .5, 1)
+)
+SAGA_RECOVERY = Counter(
+    "gateway_saga_recovery_total",
+    "Orphaned sagas handled by the recovery (recovered, failed, skipped: claimed by another process)",
+    ["result"]
+)
+SAGA_RECOVERY_STEPS = Counter(
+    "gateway_saga_recovery_steps_total",
+    "Rollbacks published by the saga recovery per service",
+    ["service"]
+)
+
+# ----------------------------------------- Bulk lane -------------------------------------------------------------- #
+
+RPC_BULK_IN_FLIGHT = Gauge(
+    "gateway_rpc_bulk_in_flight",
+    "Bulk RPCs (back-office grids, reports, exports) waiting for their replies in this worker",
+    multiprocess_mode="liveall"
+)
+RPC_BULK_WAIT_SECONDS = Histogram(
+    "gateway_rpc_bulk_wait_seconds",
+    "Time bulk RPCs waited for a slot of the bulk concurrency cap",
+    buckets=(.001, .01, .05, .1, .25, .5, 1, 2.5, 5, 10)
+)
+RPC_BULK_REJECTED = Counter(
+    "gateway_rpc_bulk_rejected_total",
+    "Bulk RPCs rejected with 503 after waiting RPC_BULK_QUEUE_TIMEOUT for a slot"
+)
+
+# ----------------------------------------- Admission control ------------------------------------------------------ #
+
+RPC_ADMISSION_LIMIT = Gauge(
+    "gateway_rpc_admission_limit",
+    "Adaptive limit on the calls in flight per downstream service in this worker",
+    ["service"],
+    multiprocess_mode="liveall"
+)
+RPC_ADMISSION_IN_FLIGHT = Gauge(
+    "gateway_rpc_admission_in_flight",
+    "Calls in flight per downstream service in this worker",
+    ["service"],
+    multiprocess_mode="liveall"
+)
+RPC_ADMISSION_SHED = Counter(
+    "gateway_rpc_admission_shed_total",
+    "Calls rejected with 503 because the service's limit and queue were full",
+    ["service"]
+)
+
+# ----------------------------------------- Hedging ---------------------------------------------------------------- #
+
+RPC_HEDGES = Counter(
+    "gateway_rpc_hedges_total",
+    "Hedged calls per service and action (sent, no_budget: due but over the hedge budget)",
+    ["service", "action", "result"]
+)
+RPC_HEDGE_DELAY = Gauge(
+    "gateway_rpc_hedge_delay_seconds",
+    "Current latency threshold past which calls of an action are hedged",
+    ["service", "action"],
+    multiprocess_mode="liveall"
+)
+
+# ----------------------------------------- InfluxDB --------------------------------------------------------------- #
+
+INFLUX_POINTS = Counter(
+    "gateway_influx_points_total",
+    "Monitoring points by outcome (written, dropped: queue full, failed: write error)",
+    ["result"]
+)
+
+# ----------------------------------------- Tracing ---------------------------------------------------------------- #
+
+TRACE_SPANS = Counter(
+    "gateway_trace_spans_total",
+    "Spans handed to the trace exporter by outcome (exported, dropped: queue full, failed: export error)",
+    ["result"]
+)
+
+# ----------------------------------------- Profiler --------------------------------------------------------------- #
+
+PROFILED_REQUESTS = Counter(
+    "gateway_profiled_requests_total",
+    "Requests whose stack samples were kept by the sampling profiler (slow or sampled 1 in N)",
+    ["reason"]
+)
+PROFILER_SAMPLES = Counter(
+    "gateway_profiler_samples_total",
+    "Stack samples taken of the requests in flight while the profiler is enabled"
+)
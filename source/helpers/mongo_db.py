@@ -1,13 +1,43 @@
+import threading
+
 from pymongo import MongoClient
 
 from source.config import settings
 
+client = None
+client_lock = threading.Lock()
+
+
+def get_client() -> MongoClient:
+    """
+    process-wide MongoClient; it is thread-safe and keeps its own connection pool, so building one per
+    operation only adds server discovery and auth to every call. Created lazily: MongoClient must not
+    be shared across a fork.
+    """
+    global client
+    with client_lock:
+        if client is None:
+            client = MongoClient(
+                settings.MONGO_HOST,
+                settings.MONGO_PORT,
+                username=settings.MONGO_USER,
+                password=settings.MONGO_PASS,
+                maxPoolSize=settings.MONGO_POOL_SIZE
+            )
+        return client
+
+
+def close_client():
+    global client
+    with client_lock:
+        if client is not None:
+            client.close()
+            client = None
+
 
 class MongoDb:
     def __init__(self):
-        self.connection = MongoClient(
-            settings.MONGO_HOST, settings.MONGO_PORT, username=settings.MONGO_USER, password=settings.MONGO_PASS
-        )
+        self.connection = get_client()
         self.database = self.connection["db-gateway"]
         self.saga_collection = self.database["saga"]
 
@@ -15,4 +45,5 @@ class MongoDb:
         return self
 
     def __exit__(self, exc_type, exc_val, exc_tb):
-        self.connection.close()
+        # the client is shared, its connections go back to the pool
+        pass
@@ -1,34 +1,129 @@
+import socket
 import time
-from starlette.middleware.base import BaseHTTPMiddleware
-import command
-from source.helpers.influx import InfluxConnection
 
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, generate_latest
+from prometheus_client.multiprocess import MultiProcessCollector
+from starlette.requests import Request
+from starlette.responses import Response
+from starlette.routing import BaseRoute
+
+from source.config import settings
+from source.helpers.influx import influx_writer
+from source.helpers.metrics import HTTP_REQUEST_SECONDS, HTTP_REQUESTS, HTTP_REQUESTS_IN_PROGRESS
+from source.helpers.request_context import current_context
+
+# resolved once per process, it is a tag of every point
+GATEWAY = socket.gethostname()
+
+# (app, endpoint) -> routes of app served by endpoint, filled as requests come in
+routes_by_endpoint = dict()
+
+
+def endpoint_routes(app, endpoint) -> list:
+    if endpoint is None:
+        # no route matched, mounts have no endpoint either
+        return []
+    key = (app, endpoint)
+    routes = routes_by_endpoint.get(key)
+    if routes is None:
+        routes = [
+            route for route in getattr(app, "routes", ())
+            if isinstance(route, BaseRoute) and getattr(route, "endpoint", None) is endpoint
+        ]
+        routes_by_endpoint[key] = routes
+    return routes
+
+
+def route_template(scope) -> str:
+    """
+    path template of the route that served the request, e.g. /cart/api/v1/cart/{systemCode}/{storageId}.
+    Routing leaves the innermost app, its endpoint, the mount prefix and the path left to it in
+    the scope; paths no route matched are tagged as {path} under their mount, so there are never
+    more distinct tags than routes.
+    """
+    root_path = scope.get("root_path", "")
+    routes = endpoint_routes(scope.get("app"), scope.get("endpoint"))
+    if len(routes) > 1:
+        # one function behind several routes, the path tells them apart
+        routes = [route for route in routes if route.path_regex.match(scope.get("path", ""))] or routes
+    if routes:
+        return root_path + routes[0].path
+    return root_path + "/{path}"
+
+
+def mounted_app(scope) -> str:
+    # name of the sub-app that served the request, from its mount (/cart/api/v1 -> cart); gateway for the root app
+    root_path = scope.get("root_path", "")
+    return root_path.split("/")[1] if root_path else "gateway"
+
+
+class Monitoring:
+    """
+    Pure ASGI middleware of the root app measuring every HTTP request, for all sub-apps:
+    Prometheus counters and histograms labelled by sub-app, route template and status, and a point
+    per request written to InfluxDB (see influx.InfluxWriter), tagged with the route template and
+    the response status. Its fields split the response time between downstream services (RPC
+    round-trips of the request, see RequestContext.downstream) and the gateway itself.
+    Must run inside RequestContextMiddleware.
+    """
 
-class Monitoring(BaseHTTPMiddleware):
     def __init__(self, app):
-        super().__init__(app)
-
-    async def dispatch(self, request, call_next):
-        start = round(time.time() * 1000)
-        response = await call_next(request)
-        end = round(time.time() * 1000)
-        service = request.url.path.split("/")[1]
-        if service:
-            if request.path_params:
-                url = "/".join(list(set(request.url.path.split("/")).difference(set(request.path_params.values()))))
-            else:
-                url = request.url.path
-            gateway = command.run(["hostname"]).output.decode("utf-8")
-            with InfluxConnection() as db:
-                db.monitoring(
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        service = scope["path"].split("/")[1]
+        method = scope["method"]
+        status = 500
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        start = time.perf_counter()
+        HTTP_REQUESTS_IN_PROGRESS.inc()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            HTTP_REQUESTS_IN_PROGRESS.dec()
+            elapsed = time.perf_counter() - start
+            route = route_template(scope)
+            sub_app = mounted_app(scope)
+            HTTP_REQUEST_SECONDS.labels(app=sub_app, method=method, route=route).observe(elapsed)
+            HTTP_REQUESTS.labels(app=sub_app, method=method, route=route, status=str(status)).inc()
+            if service and settings.INFLUXDB_ENABLED:
+                response_time = elapsed * 1000
+                context = current_context()
+                downstream = min(context.downstream * 1000, response_time) if context else 0
+                influx_writer.monitoring(
                     tags={
                         "service": service,
-                        "url": url,
-                        "method": request.method,
-                        "gateway": gateway
+                        "url": route,
+                        "method": method,
+                        "status": str(status),
+                        "gateway": GATEWAY
                     },
                     fields={
-                        "response_time": end - start
+                        "response_time": round(response_time),
+                        "gateway_time": round(response_time - downstream, 3),
+                        "downstream_time": round(downstream, 3)
                     }
                 )
-        return response
+
+
+def metrics(request: Request) -> Response:
+    """
+    Prometheus scrape endpoint of the root app. With PROMETHEUS_MULTIPROC_DIR the samples of every
+    worker are merged, so any worker answering the scrape reports the whole gateway.
+    """
+    if settings.PROMETHEUS_MULTIPROC_DIR:
+        registry = CollectorRegistry()
+        MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    # the content type has its charset already, media_type would add it again
+    return Response(generate_latest(registry), headers={"Content-Type": CONTENT_TYPE_LATEST})
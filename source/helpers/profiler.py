@@ -0,0 +1,326 @@
+"""
+Opt-in sampling profiler of the requests served by the gateway. While enabled, a thread of every
+worker takes the Python stack of each thread every PROFILER_INTERVAL seconds and charges it to the
+request running there: on the event loop through the Profiler middleware frame of the request,
+in the threadpool through the sync endpoint it runs, which instrument() wraps to lend its thread to
+the profile the request's RequestContext carries into the worker (sync dependencies are not
+profiled). When a request ends its samples are kept if it took longer than
+PROFILER_SLOW_THRESHOLD seconds or was drawn 1 in PROFILER_SAMPLE_RATE, and added to the profile
+of its route template.
+
+Profiles are appended every PROFILER_FLUSH_INTERVAL seconds in collapsed stack format, one file per
+route in PROFILER_DIR (GET_cart_api_v1_cart.collapsed), rotated past PROFILER_MAX_BYTES:
+
+    flamegraph.pl log/profiles/GET_cart_api_v1_cart.collapsed > cart.svg
+
+or open it in speedscope. /admin/profiler (see profiler_admin) switches it on and off in every
+worker without a restart.
+"""
+import asyncio
+import functools
+import hmac
+import json
+import logging
+import os
+import random
+import re
+import sys
+import threading
+import time
+from collections import Counter, defaultdict
+
+from fastapi import HTTPException
+from pydantic import BaseModel, ValidationError, confloat, conint
+from fastapi.routing import APIRoute
+from starlette.requests import Request
+from starlette.responses import JSONResponse
+from starlette.routing import Mount
+
+from source.config import settings
+from source.helpers.metrics import PROFILED_REQUESTS, PROFILER_SAMPLES
+from source.helpers.monitoring import route_template
+from source.helpers.request_context import current_context
+
+ADMIN_TOKEN_HEADER = "x-admin-token"
+STATE_FILE = "state.json"
+
+# seconds between two checks of the state file, i.e. how fast a toggle reaches every worker
+STATE_POLL_INTERVAL = 1
+
+
+class ProfilerState(BaseModel):
+    enabled: bool
+    slow_threshold: confloat(ge=0)
+    sample_rate: conint(ge=0)
+
+
+class Profile:
+    """stack samples of one request in flight"""
+
+    def __init__(self, frame, sampled: bool):
+        self.frame = frame
+        self.sampled = sampled
+        self.started = time.monotonic()
+        self.samples = Counter()
+
+
+class SamplingProfiler:
+    """
+    Samples the stacks of the requests in flight and aggregates the ones worth keeping per route.
+    Its state (enabled, slow_threshold, sample_rate) starts from the settings and is shared by
+    the workers through PROFILER_DIR/state.json, which the sampler thread polls.
+    """
+
+    def __init__(self):
+        self.state = ProfilerState(
+            enabled=settings.PROFILER_ENABLED,
+            slow_threshold=settings.PROFILER_SLOW_THRESHOLD,
+            sample_rate=settings.PROFILER_SAMPLE_RATE
+        )
+        self.state_mtime = None
+        # frame of the Profiler middleware of each request in flight -> its Profile
+        self.active = dict()
+        # thread running a sync endpoint -> Profile of its request, see profiled
+        self.threads = dict()
+        # "METHOD route template" -> collapsed stack -> samples, until the next flush
+        self.profiles = defaultdict(Counter)
+        self.labels = dict()
+        self.lock = threading.Lock()
+        self.thread = None
+        self.thread_lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.state.enabled
+
+    def ensure_started(self):
+        if self.thread is None:
+            with self.thread_lock:
+                if self.thread is None:
+                    self.thread = threading.Thread(target=self.run, name="sampling-profiler", daemon=True)
+                    self.thread.start()
+
+    # ----------------------------------------- Requests ----------------------------------------------------------- #
+
+    def start(self, frame) -> Profile:
+        rate = self.state.sample_rate
+        profile = Profile(frame, sampled=bool(rate) and random.random() < 1 / rate)
+        with self.lock:
+            self.active[frame] = profile
+        return profile
+
+    def finish(self, profile: Profile, key: str):
+        with self.lock:
+            self.active.pop(profile.frame, None)
+            if time.monotonic() - profile.started >= self.state.slow_threshold:
+                reason = "slow"
+            elif profile.sampled:
+                reason = "sampled"
+            else:
+                return
+            if not profile.samples:
+                return
+            self.profiles[key].update(profile.samples)
+        PROFILED_REQUESTS.labels(reason=reason).inc()
+
+    # ----------------------------------------- Sampling ----------------------------------------------------------- #
+
+    def label(self, frame) -> str:
+        code = frame.f_code
+        label = self.labels.get(code)
+        if label is None:
+            name = getattr(code, "co_qualname", code.co_name)
+            label = f"{frame.f_globals.get('__name__', '?')}:{name}".replace(";", ":")
+            self.labels[code] = label
+        return label
+
+    def sample(self):
+        own = threading.get_ident()
+        frames = sys._current_frames()
+        with self.lock:
+            if not self.active:
+                return
+            for thread_id, frame in frames.items():
+                if thread_id == own:
+                    continue
+                # a thread running a sync endpoint is its request's all the way down, the event loop's
+                # stack only from the middleware frame of the request running on it
+                profile = self.threads.get(thread_id)
+                stack = list()
+                while frame is not None:
+                    stack.append(self.label(frame))
+                    if profile is None:
+                        profile = self.active.get(frame)
+                        if profile is not None:
+                            break
+                    frame = frame.f_back
+                if profile is not None:
+                    profile.samples[";".join(reversed(stack))] += 1
+                    PROFILER_SAMPLES.inc()
+
+    # ----------------------------------------- Output ------------------------------------------------------------- #
+
+    @staticmethod
+    def path(key: str) -> str:
+        # GET /cart/api/v1/cart/{systemCode} -> GET_cart_api_v1_cart_{systemCode}.collapsed
+        return os.path.join(settings.PROFILER_DIR, re.sub(r"[^\w{}-]+", "_", key).strip("_") + ".collapsed")
+
+    @staticmethod
+    def rotate(path: str):
+        for i in range(settings.PROFILER_BACKUPS - 1, 0, -1):
+            if os.path.exists(f"{path}.{i}"):
+                os.replace(f"{path}.{i}", f"{path}.{i + 1}")
+        if settings.PROFILER_BACKUPS:
+            os.replace(path, f"{path}.1")
+        else:
+            os.remove(path)
+
+    def flush(self):
+        """append the profiles collected since the last flush to their files"""
+        with self.lock:
+            profiles, self.profiles = self.profiles, defaultdict(Counter)
+        if not profiles:
+            return
+        os.makedirs(settings.PROFILER_DIR, exist_ok=True)
+        for key, samples in profiles.items():
+            path = self.path(key)
+            try:
+                if os.path.exists(path) and os.path.getsize(path) >= settings.PROFILER_MAX_BYTES:
+                    self.rotate(path)
+            except OSError:
+                # another worker rotated it first
+                pass
+            # one write per flush: the workers append to the same files
+            with open(path, "a") as f:
+                f.write("".join(f"{stack} {count}\n" for stack, count in samples.items()))
+
+    # ----------------------------------------- State -------------------------------------------------------------- #
+
+    def state_path(self) -> str:
+        return os.path.join(settings.PROFILER_DIR, STATE_FILE)
+
+    def load_state(self):
+        try:
+            mtime = os.stat(self.state_path()).st_mtime
+            if mtime == self.state_mtime:
+                return
+            with open(self.state_path()) as f:
+                self.state = ProfilerState(**json.load(f))
+            self.state_mtime = mtime
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError, ValidationError) as e:
+            logging.error(f"Profiler state could not be read... {e}")
+
+    def configure(self, state: ProfilerState):
+        """apply state here and publish it to the other workers"""
+        self.state = state
+        os.makedirs(settings.PROFILER_DIR, exist_ok=True)
+        temporary = f"{self.state_path()}.{os.getpid()}"
+        with open(temporary, "w") as f:
+            json.dump(state.dict(), f)
+        os.replace(temporary, self.state_path())
+        self.ensure_started()
+
+    def run(self):
+        polled = flushed = time.monotonic()
+        while True:
+            time.sleep(settings.PROFILER_INTERVAL if self.enabled else STATE_POLL_INTERVAL)
+            now = time.monotonic()
+            try:
+                if now - polled >= STATE_POLL_INTERVAL:
+                    self.load_state()
+                    polled = now
+                if self.enabled:
+                    self.sample()
+                if now - flushed >= settings.PROFILER_FLUSH_INTERVAL:
+                    self.flush()
+                    flushed = now
+            except Exception as e:
+                logging.error(f"Sampling profiler failed... {e}")
+
+
+profiler = SamplingProfiler()
+
+
+class Profiler:
+    """
+    Pure ASGI middleware registering every request with the sampling profiler while it is enabled.
+    Must run inside RequestContextMiddleware.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        profiler.ensure_started()
+        context = current_context()
+        if scope["type"] != "http" or not profiler.enabled or context is None:
+            await self.app(scope, receive, send)
+            return
+        # the frame of this call is on the event loop's stack whenever the request runs there
+        profile = profiler.start(sys._getframe())
+        context.profile = profile
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            context.profile = None
+            profiler.finish(profile, f"{scope['method']} {route_template(scope)}")
+
+
+def profiled(call):
+    """sync endpoint that lends the worker thread it runs on to the profile of its request"""
+
+    @functools.wraps(call)
+    def wrapper(*args, **kwargs):
+        context = current_context()
+        profile = context.profile if context is not None else None
+        if profile is None:
+            return call(*args, **kwargs)
+        thread_id = threading.get_ident()
+        with profiler.lock:
+            profiler.threads[thread_id] = profile
+        try:
+            return call(*args, **kwargs)
+        finally:
+            with profiler.lock:
+                profiler.threads.pop(thread_id, None)
+
+    wrapper.profiled = True
+    return wrapper
+
+
+def instrument(routes):
+    """
+    wrap the sync endpoints of routes and of the apps mounted there with profiled. FastAPI looks
+    dependant.call up on every request, so they run in the threadpool wrapped.
+    """
+    for route in routes:
+        if isinstance(route, APIRoute):
+            call = route.dependant.call
+            if not asyncio.iscoroutinefunction(call) and not getattr(call, "profiled", False):
+                route.dependant.call = profiled(call)
+        elif isinstance(route, Mount):
+            instrument(route.routes or ())
+
+
+async def profiler_admin(request: Request) -> JSONResponse:
+    """
+    GET returns the profiler state, POST changes it in every worker, e.g.
+    {"enabled": true, "slow_threshold": 0.5, "sample_rate": 50}; omitted fields keep their value.
+    Needs the PROFILER_ADMIN_TOKEN in the x-admin-token header, does not exist without one.
+    """
+    token = settings.PROFILER_ADMIN_TOKEN
+    if not token:
+        raise HTTPException(status_code=404, detail="Not Found")
+    if not hmac.compare_digest(request.headers.get(ADMIN_TOKEN_HEADER, "").encode(), token.encode()):
+        raise HTTPException(status_code=403, detail="Invalid admin token")
+    if request.method == "POST":
+        try:
+            body = await request.json()
+            state = ProfilerState(**dict(profiler.state.dict(), **body))
+        except (ValueError, TypeError, ValidationError) as e:
+            raise HTTPException(status_code=422, detail=str(e))
+        profiler.configure(state)
+        logging.info(f"Profiler state changed to {state.dict()}")
+    return JSONResponse(dict(profiler.state.dict(), pid=os.getpid()))
@@ -0,0 +1,69 @@
+import time
+from contextvars import ContextVar
+
+from source.config import settings
+
+
+class RequestContext:
+    """
+    State of one HTTP request that the RPC layer needs while handling it.
+    Sync routes run in the threadpool with a copy of the request's contextvars,
+    so they see the same RequestContext object as the middleware.
+    """
+
+    def __init__(self, timeout: float = None):
+        self.started = time.monotonic()
+        self.deadline = self.started + timeout if timeout else None
+        # seconds spent waiting on downstream services, the rest of the request is gateway time
+        self.downstream = 0.0
+        # set by tracing.Tracing: trace of the request, its server span and the RPC spans ended so far
+        self.trace_id = None
+        self.span_id = None
+        self.spans = list()
+        # set by profiler.Profiler while the request's stacks are sampled
+        self.profile = None
+
+    def remaining(self):
+        # seconds left from the request's budget, None if the request has no deadline
+        if self.deadline is None:
+            return None
+        return self.deadline - time.monotonic()
+
+
+request_context: ContextVar = ContextVar("request_context", default=None)
+
+
+def current_context():
+    return request_context.get()
+
+
+def remaining_budget():
+    context = request_context.get()
+    return context.remaining() if context else None
+
+
+def add_downstream(seconds: float):
+    # called by the RPC clients with the time each round-trip took
+    context = request_context.get()
+    if context is not None:
+        context.downstream += seconds
+
+
+class RequestContextMiddleware:
+    """
+    Pure ASGI middleware that opens a RequestContext with a REQUEST_TIMEOUT budget for every
+    HTTP request, so nested RPC calls of a multistep flow share the originating deadline.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        token = request_context.set(RequestContext(settings.REQUEST_TIMEOUT))
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            request_context.reset(token)
@@ -1,46 +1,140 @@
 from collections import deque
-import copy
+from datetime import datetime, timedelta
+import logging
+import threading
+import time
+
+from bson import ObjectId
+from pymongo import DeleteOne, ReplaceOne
+
+from source.config import settings
+from source.helpers.metrics import SAGA_JOURNAL_FLUSH_SECONDS, SAGA_JOURNAL_WRITES
 from source.helpers.mongo_db import MongoDb
 
 
+class SagaJournal:
+    """
+    Write-behind store of the saga compensation stacks. Sagas only record their latest stack (or
+    None once finished) in a buffer; a background thread writes it to Mongo in one bulk_write every
+    SAGA_FLUSH_INTERVAL seconds or as soon as SAGA_FLUSH_BATCH_SIZE sagas changed. Every write
+    replaces the whole stack, so repeated steps of a saga collapse into one write and a failed
+    flush can simply be retried; a saga finished before its first flush is never written at all.
+    """
+
+    def __init__(self):
+        self.pending = dict()
+        self.persisted = set()
+        # sagas whose stack the running flush is writing: they may exist in Mongo once it returns
+        self.flushing = set()
+        self.lock = threading.Lock()
+        self.write_lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.thread = None
+
+    def record(self, item_id: ObjectId, actions):
+        """actions is the compensation stack of the saga, None deletes it"""
+        with self.lock:
+            if actions is None and item_id not in self.persisted and item_id not in self.flushing:
+                self.pending.pop(item_id, None)
+                SAGA_JOURNAL_WRITES.labels(result="collapsed").inc()
+                return
+            self.pending[item_id] = actions
+            full = len(self.pending) >= settings.SAGA_FLUSH_BATCH_SIZE
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, name="saga-journal", daemon=True)
+                self.thread.start()
+        if full:
+            self.wakeup.set()
+
+    def run(self):
+        while True:
+            self.wakeup.wait(settings.SAGA_FLUSH_INTERVAL)
+            self.wakeup.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                logging.error(f"Saga journal flush failed... {e}")
+
+    def flush(self):
+        """write every buffered change now; raises if Mongo refused them (they stay buffered)"""
+        with self.write_lock:
+            with self.lock:
+                batch, self.pending = self.pending, dict()
+                self.flushing = {item_id for item_id, actions in batch.items() if actions is not None}
+            if not batch:
+                return
+            operations = [
+                DeleteOne({"_id": item_id}) if actions is None
+                else ReplaceOne({"_id": item_id}, {"actions": actions}, upsert=True)
+                for item_id, actions in batch.items()
+            ]
+            started = time.perf_counter()
+            try:
+                with MongoDb() as client:
+                    client.saga_collection.bulk_write(operations, ordered=False)
+            except Exception:
+                with self.lock:
+                    for item_id, actions in batch.items():
+                        # a newer state recorded meanwhile wins over the failed one, a saga finished
+                        # meanwhile has its delete buffered already
+                        self.pending.setdefault(item_id, actions)
+                    self.flushing = set()
+                SAGA_JOURNAL_WRITES.labels(result="failed").inc(len(operations))
+                raise
+            SAGA_JOURNAL_FLUSH_SECONDS.observe(time.perf_counter() - started)
+            SAGA_JOURNAL_WRITES.labels(result="written").inc(len(operations))
+            with self.lock:
+                for item_id, actions in batch.items():
+                    if actions is None:
+                        self.persisted.discard(item_id)
+                    else:
+                        self.persisted.add(item_id)
+                self.flushing = set()
+
+
+journal = SagaJournal()
+
+
 class Saga:
     def __init__(self):
         self.item_id = None
         self.stack = deque()
 
     @staticmethod
-    def startup_action():
+    def startup_action(claimable: dict = None):
+        """cursor on the sagas left behind, older than SAGA_RECOVERY_GRACE seconds"""
+        cutoff = ObjectId.from_datetime(datetime.utcnow() - timedelta(seconds=settings.SAGA_RECOVERY_GRACE))
         with MongoDb() as client:
-            result = client.saga_collection.find()
-            return result
+            return client.saga_collection.find(
+                {"_id": {"$lt": cutoff}, **(claimable or {})},
+                batch_size=settings.SAGA_RECOVERY_BATCH_SIZE
+            )
 
     def compensate(self):
+        # the stack must be durable before its rollbacks are published
+        try:
+            journal.flush()
+        except Exception as e:
+            logging.error(f"Saga journal flush before compensation failed... {e}")
         return self.stack
 
     def add(self, item: dict):
-        new_item = copy.deepcopy(item)
-        for key, value in new_item.items():
-            new_item[key]["action"] = new_item[key]["action"] + "_rollback"
+        # only the action of each service changes, their bodies are shared with the message
+        new_item = {key: dict(value, action=value["action"] + "_rollback") for key, value in item.items()}
         self.stack.append(new_item)
-        with MongoDb() as client:
-            if self.item_id:
-                result = client.saga_collection.update_one({"_id": self.item_id},
-                                                           {"$push": {"actions": new_item}})
-            else:
-                result = client.saga_collection.insert_one({"actions": [new_item]})
-                self.item_id = result.inserted_id
+        if self.item_id is None:
+            self.item_id = ObjectId()
+        journal.record(self.item_id, list(self.stack))
 
     def remove(self, services: list):
         temp = self.stack.pop()
         item = {key: temp[key] for key in temp if key not in services}
         if item:
             self.stack.append(item)
-            with MongoDb() as client:
-                client.saga_collection.update_one({"_id": self.item_id},
-                                                  {"$set": {"actions." + str(len(self.stack) - 1): item}})
+        journal.record(self.item_id, list(self.stack))
 
     def finish(self):
-        with MongoDb() as client:
-            client.saga_collection.delete_one({"_id": self.item_id})
+        if self.item_id is not None:
+            journal.record(self.item_id, None)
         self.stack.clear()
         self.item_id = None
@@ -0,0 +1,191 @@
+"""
+Recovery of sagas orphaned by a crash: their documents are left in the saga collection with the
+rollbacks still to publish. Run on startup (SAGA_RECOVERY_ON_STARTUP) or by hand:
+
+    python -m source.helpers.saga_recovery --workers 32
+
+Only sagas older than SAGA_RECOVERY_GRACE seconds are compensated, younger ones may still belong
+to a running gateway process.
+
+Gateways before sagas were finished on success left a document behind for every committed saga,
+and recovery would roll those transactions back: empty the saga collection of documents written by
+them before the first recovery. SAGA_RECOVERY_ON_STARTUP is off by default for that reason, and
+because every worker runs it; enable it on one instance only, or run the command above once per deploy.
+"""
+import argparse
+import datetime
+import logging
+import os
+import socket
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from fastapi import HTTPException
+
+from source.config import settings
+from source.helpers.metrics import SAGA_RECOVERY, SAGA_RECOVERY_STEPS
+from source.helpers.mongo_db import MongoDb
+from source.helpers.saga_pattern import Saga
+
+# identifies the claims of this process on the sagas it is recovering
+OWNER = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+
+class RateLimiter:
+    """token bucket: rate calls per second, bursts of up to rate calls"""
+
+    def __init__(self, rate: float):
+        self.rate = rate
+        self.tokens = rate
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.rate, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class SagaRecovery:
+    """
+    Streams the orphaned sagas with a cursor and compensates them on a bounded pool of workers.
+    A saga is claimed before it is touched, so several gateway processes starting together share
+    the backlog instead of compensating a saga twice; a claim not released within
+    SAGA_RECOVERY_LEASE seconds (its owner died) can be taken over.
+    The rollbacks of a saga are published newest first, like Saga.compensate does, each one
+    checkpointed by popping it from the document, so a recovery interrupted halfway resumes where
+    it stopped. Calls to each service are limited to its SAGA_RECOVERY_SERVICE_RATES rate (default
+    SAGA_RECOVERY_RATE per second), a backlog must not take down the services it compensates on.
+    """
+
+    def __init__(self, rpc, workers: int = None):
+        self.rpc = rpc
+        self.workers = workers or settings.SAGA_RECOVERY_WORKERS
+        self.limiters = dict()
+        self.limiters_lock = threading.Lock()
+        self.results = {"recovered": 0, "failed": 0, "skipped": 0}
+        self.results_lock = threading.Lock()
+
+    def limiter(self, service: str) -> RateLimiter:
+        with self.limiters_lock:
+            if service not in self.limiters:
+                rate = settings.SAGA_RECOVERY_SERVICE_RATES.get(service, settings.SAGA_RECOVERY_RATE)
+                self.limiters[service] = RateLimiter(float(rate))
+            return self.limiters[service]
+
+    @staticmethod
+    def claimable(now: datetime.datetime) -> dict:
+        lease = now - datetime.timedelta(seconds=settings.SAGA_RECOVERY_LEASE)
+        return {"$or": [{"recovering": {"$exists": False}}, {"claimed_at": {"$lt": lease}}]}
+
+    def claim(self, collection, item_id) -> bool:
+        now = datetime.datetime.utcnow()
+        result = collection.update_one(
+            {"_id": item_id, **self.claimable(now)},
+            {"$set": {"recovering": OWNER, "claimed_at": now}}
+        )
+        return result.modified_count == 1
+
+    @staticmethod
+    def release(collection, item_id):
+        collection.update_one({"_id": item_id, "recovering": OWNER}, {"$unset": {"recovering": "", "claimed_at": ""}})
+
+    def done(self, result: str):
+        SAGA_RECOVERY.labels(result=result).inc()
+        with self.results_lock:
+            self.results[result] += 1
+
+    def compensate(self, collection, document: dict):
+        item_id = document["_id"]
+        if not self.claim(collection, item_id):
+            # another process is on it
+            self.done("skipped")
+            return
+        actions = list(document.get("actions") or [])
+        try:
+            while actions:
+                item = actions[-1]
+                for service in item:
+                    self.limiter(service).acquire()
+                self.rpc.publish(message=[item], compensate=True)
+                # checkpoint: a rollback published is never published again
+                collection.update_one({"_id": item_id, "recovering": OWNER}, {"$pop": {"actions": 1}})
+                for service in item:
+                    SAGA_RECOVERY_STEPS.labels(service=service).inc()
+                actions.pop()
+        except Exception as e:
+            # left for the next recovery, from the rollback that failed
+            detail = e.detail if isinstance(e, HTTPException) else e
+            logging.error(f"Saga {item_id} recovery failed, {len(actions)} rollbacks left... {detail}")
+            self.release(collection, item_id)
+            self.done("failed")
+            return
+        collection.delete_one({"_id": item_id, "recovering": OWNER})
+        self.done("recovered")
+
+    def run(self) -> dict:
+        started = time.perf_counter()
+        # never more sagas read ahead than the workers can take, the backlog may not fit in memory
+        slots = threading.BoundedSemaphore(self.workers * 2)
+
+        def task(document):
+            try:
+                self.compensate(collection, document)
+            except Exception as e:
+                logging.error(f"Saga {document.get('_id')} recovery failed... {e}")
+            finally:
+                slots.release()
+
+        with MongoDb() as client, ThreadPoolExecutor(self.workers, thread_name_prefix="saga-recovery") as pool:
+            collection = client.saga_collection
+            cursor = Saga.startup_action(self.claimable(datetime.datetime.utcnow()))
+            for document in cursor:
+                slots.acquire()
+                pool.submit(task, document)
+        logging.info(
+            f"Saga recovery finished in {time.perf_counter() - started:.1f}s... "
+            + ", ".join(f"{key}: {value}" for key, value in self.results.items())
+        )
+        return self.results
+
+
+def recover(workers: int = None) -> dict:
+    from source.message_broker.rabbitmq import new_rpc
+    return new_rpc.compensate_actions(workers)
+
+
+def start_recovery() -> threading.Thread:
+    """recover in the background, the gateway serves meanwhile"""
+
+    def target():
+        try:
+            recover()
+        except Exception as e:
+            logging.error(f"Saga recovery could not run... {e}")
+
+    thread = threading.Thread(target=target, name="saga-recovery", daemon=True)
+    thread.start()
+    return thread
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compensate the sagas left in the saga collection by a crash")
+    parser.add_argument("-w", "--workers", type=int, default=settings.SAGA_RECOVERY_WORKERS,
+                        help="sagas compensated concurrently")
+    args = parser.parse_args()
+    logging.basicConfig(format='%(asctime)s %(levelname)-8s %(message)s', level=logging.INFO)
+    results = recover(args.workers)
+    print(", ".join(f"{key}: {value}" for key, value in results.items()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,348 @@
+"""
+Request traces: every HTTP request gets a server span (see Tracing) and every RPC publish made
+while handling it a client span (see RpcSpan) with its service, action, bytes out and in, the time
+it queued in the gateway before being published, its total time and outcome.
+The trace id comes from the caller's W3C traceparent header when it sent one and travels to the
+services in the traceparent header of the AMQP messages, so their spans join the same trace.
+
+Spans are exported as OTLP/JSON: appended to TRACING_FILE (TRACING_EXPORTER=file, one
+ExportTraceServiceRequest per line, what the collector's file receiver reads) or posted to an
+OpenTelemetry collector at TRACING_OTLP_ENDPOINT (TRACING_EXPORTER=otlp). With
+TRACING_SERVER_TIMING the RPC spans of a request are also listed in its Server-Timing header.
+"""
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from contextlib import contextmanager
+
+import requests
+from fastapi import HTTPException
+
+from source.config import settings
+from source.helpers.metrics import RPC_CALL_SECONDS, TRACE_SPANS
+from source.helpers.monitoring import GATEWAY, route_template
+from source.helpers.request_context import current_context
+
+TRACEPARENT_HEADER = "traceparent"
+
+# OTLP span kinds and status codes
+SERVER = 2
+CLIENT = 3
+STATUS_OK = 1
+STATUS_ERROR = 2
+
+# more Server-Timing entries than this only bloat the response, the trace has them all
+SERVER_TIMING_SPANS = 32
+
+
+def new_id(size: int) -> str:
+    return os.urandom(size).hex()
+
+
+def parse_traceparent(value: str) -> tuple:
+    # (trace id, parent span id) of a W3C traceparent header, (None, None) if it is missing or malformed
+    parts = value.strip().lower().split("-") if value else []
+    if len(parts) != 4 or len(parts[1]) != 32 or len(parts[2]) != 16:
+        return None, None
+    try:
+        if not int(parts[1], 16) or not int(parts[2], 16):
+            # all zero ids are invalid
+            return None, None
+    except ValueError:
+        return None, None
+    return parts[1], parts[2]
+
+
+def otlp_value(value) -> dict:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+def otlp_attributes(attributes: dict) -> list:
+    return [{"key": key, "value": otlp_value(value)} for key, value in attributes.items() if value is not None]
+
+
+class Span:
+    """one timed operation of a trace, exported when it ends"""
+
+    def __init__(self, name: str, kind: int, trace_id: str, parent_id: str = None):
+        self.trace_id = trace_id
+        self.span_id = new_id(8)
+        self.parent_id = parent_id
+        self.name = name
+        self.kind = kind
+        self.attributes = dict()
+        self.start_time = time.time_ns()
+        self.started = time.monotonic()
+        self.duration = None
+        self.outcome = "ok"
+
+    @property
+    def traceparent(self) -> str:
+        return f"00-{self.trace_id}-{self.span_id}-01"
+
+    def end(self, outcome: str = None):
+        if outcome is not None:
+            self.outcome = outcome
+        self.duration = time.monotonic() - self.started
+        exporter.export(self)
+
+    def to_otlp(self) -> dict:
+        span = {
+            "traceId": self.trace_id,
+            "spanId": self.span_id,
+            "name": self.name,
+            "kind": self.kind,
+            "startTimeUnixNano": str(self.start_time),
+            "endTimeUnixNano": str(self.start_time + int(self.duration * 1e9)),
+            "attributes": otlp_attributes(dict(self.attributes, **{"gateway.outcome": self.outcome})),
+            "status": {"code": STATUS_OK if self.outcome == "ok" else STATUS_ERROR},
+        }
+        if self.parent_id:
+            span["parentSpanId"] = self.parent_id
+        return span
+
+
+class RpcSpan(Span):
+    """
+    client span of one RPC publish, a child of the request's server span (or the root of a new
+    trace outside HTTP requests, e.g. saga recovery). queue_wait is the time the call spent in the
+    gateway before its message was handed to the transport (bulkhead, admission queue, encoding);
+    bytes are counted as encoded on the wire, hedged copies and every reply included.
+    """
+
+    def __init__(self, message: dict, services):
+        self.context = current_context()
+        if self.context is not None and self.context.trace_id is not None:
+            trace_id, parent_id = self.context.trace_id, self.context.span_id
+        else:
+            trace_id, parent_id = new_id(16), None
+        services = list(services)
+        actions = [
+            message[service].get("action") if isinstance(message.get(service), dict) else None
+            for service in services
+        ]
+        super().__init__(
+            "+".join(f"{service}.{action}" for service, action in zip(services, actions)), CLIENT, trace_id, parent_id
+        )
+        self.calls = list(zip(services, actions))
+        self.queue_wait = None
+        self.bytes_out = 0
+        self.bytes_in = 0
+        self.attributes.update({
+            "rpc.system": "rabbitmq",
+            "rpc.service": ",".join(services),
+            "rpc.method": ",".join(str(action) for action in actions),
+        })
+
+    def headers(self, headers: dict) -> dict:
+        # AMQP headers of the message carrying the trace on
+        return dict(headers, **{TRACEPARENT_HEADER: self.traceparent})
+
+    def published(self, size: int):
+        if self.queue_wait is None:
+            self.queue_wait = time.monotonic() - self.started
+        self.bytes_out += size
+
+    def received(self, size: int):
+        self.bytes_in += size
+
+    def replies(self, replies: dict, expected=()):
+        """outcome from the replies: timeout if one is missing or timed out, error if one failed"""
+        replies = replies or dict()
+        if any(service not in replies or (replies[service] or {}).get("timeout") for service in expected) \
+                or any(isinstance(reply, dict) and reply.get("timeout") for reply in replies.values()):
+            self.outcome = "timeout"
+        elif any(not isinstance(reply, dict) or not reply.get("success") for reply in replies.values()):
+            self.outcome = "error"
+
+    def end(self, outcome: str = None):
+        self.attributes.update({
+            "gateway.queue_wait_ms": round((self.queue_wait or 0) * 1000, 3),
+            "gateway.bytes_out": self.bytes_out,
+            "gateway.bytes_in": self.bytes_in,
+        })
+        super().end(outcome)
+        for service, action in self.calls:
+            RPC_CALL_SECONDS.labels(service=service, action=str(action), outcome=self.outcome).observe(self.duration)
+        if self.context is not None:
+            self.context.spans.append(self)
+
+    def server_timing(self) -> str:
+        return (
+            f'{self.name};dur={self.duration * 1000:.1f};desc="{self.outcome}, wait '
+            f'{(self.queue_wait or 0) * 1000:.1f}ms, {self.bytes_out}B out, {self.bytes_in}B in"'
+        )
+
+
+@contextmanager
+def rpc_span(message: dict, services):
+    """span of the RPC publish run in the block; an exception escaping the block sets its outcome"""
+    span = RpcSpan(message, services)
+    try:
+        yield span
+    except HTTPException as e:
+        span.outcome = "rejected" if e.status_code == 503 else "error"
+        raise
+    except Exception:
+        span.outcome = "error"
+        raise
+    finally:
+        span.end()
+
+
+def server_timing(context, elapsed: float) -> str:
+    spans = context.spans[:SERVER_TIMING_SPANS]
+    entries = [span.server_timing() for span in spans]
+    entries.append(f"gateway;dur={max(elapsed - context.downstream, 0) * 1000:.1f}")
+    entries.append(f'trace;desc="{context.trace_id}"')
+    return ", ".join(entries)
+
+
+class Tracing:
+    """
+    Pure ASGI middleware opening the server span of every HTTP request, named after the route
+    template; the RPC spans of the request are its children. Adds the Server-Timing header when
+    TRACING_SERVER_TIMING is set. Must run inside RequestContextMiddleware.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        context = current_context()
+        if scope["type"] != "http" or context is None:
+            await self.app(scope, receive, send)
+            return
+        traceparent = next(
+            (value.decode("latin-1") for key, value in scope["headers"] if key == TRACEPARENT_HEADER.encode()), None
+        )
+        trace_id, parent_id = parse_traceparent(traceparent)
+        span = Span(scope["method"], SERVER, trace_id or new_id(16), parent_id)
+        context.trace_id, context.span_id = span.trace_id, span.span_id
+        method = scope["method"]
+        status = 500
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                if settings.TRACING_SERVER_TIMING:
+                    header = server_timing(context, time.monotonic() - span.started)
+                    message = dict(message, headers=list(message.get("headers", [])) + [
+                        (b"server-timing", header.encode("latin-1"))
+                    ])
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            route = route_template(scope)
+            span.name = f"{method} {route}"
+            span.attributes.update({
+                "http.method": method,
+                "http.route": route,
+                "http.status_code": status,
+                "gateway.rpc_calls": len(context.spans),
+                "gateway.downstream_ms": round(context.downstream * 1000, 3),
+            })
+            span.end("error" if status >= 500 else "ok")
+
+
+class SpanExporter:
+    """
+    Background exporter of the ended spans, like influx.InfluxWriter: export() only puts the span
+    in a bounded queue (dropped and counted when it is full) and a worker thread writes them in
+    batches of TRACING_BATCH_SIZE or every TRACING_FLUSH_INTERVAL seconds. A no-op with
+    TRACING_EXPORTER=none.
+    """
+
+    def __init__(self):
+        self.queue = queue.Queue(maxsize=settings.TRACING_QUEUE_SIZE)
+        self.thread = None
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.session = None
+
+    def export(self, span: Span):
+        if settings.TRACING_EXPORTER == "none":
+            return
+        if self.thread is None:
+            with self.lock:
+                if self.thread is None:
+                    self.thread = threading.Thread(target=self.run, name="trace-exporter", daemon=True)
+                    self.thread.start()
+        try:
+            self.queue.put_nowait(span)
+        except queue.Full:
+            TRACE_SPANS.labels(result="dropped").inc()
+
+    def batch(self, timeout: float) -> list:
+        spans = list()
+        deadline = time.monotonic() + timeout
+        while len(spans) < settings.TRACING_BATCH_SIZE:
+            try:
+                spans.append(self.queue.get(timeout=max(deadline - time.monotonic(), 0)))
+            except queue.Empty:
+                break
+        return spans
+
+    @staticmethod
+    def payload(spans: list) -> dict:
+        # OTLP/JSON ExportTraceServiceRequest
+        return {"resourceSpans": [{
+            "resource": {"attributes": otlp_attributes({
+                "service.name": settings.TRACING_SERVICE_NAME, "host.name": GATEWAY, "process.pid": os.getpid()
+            })},
+            "scopeSpans": [{"scope": {"name": "gateway"}, "spans": [span.to_otlp() for span in spans]}]
+        }]}
+
+    def write(self, spans: list):
+        try:
+            payload = self.payload(spans)
+            if settings.TRACING_EXPORTER == "otlp":
+                if self.session is None:
+                    self.session = requests.Session()
+                self.session.post(settings.TRACING_OTLP_ENDPOINT, json=payload, timeout=5).raise_for_status()
+            elif settings.TRACING_EXPORTER == "file":
+                directory = os.path.dirname(settings.TRACING_FILE)
+                if directory:
+                    os.makedirs(directory, exist_ok=True)
+                with open(settings.TRACING_FILE, "a") as f:
+                    f.write(json.dumps(payload) + "\n")
+            else:
+                raise ValueError(f"Unknown trace exporter {settings.TRACING_EXPORTER}, use none, file or otlp")
+            TRACE_SPANS.labels(result="exported").inc(len(spans))
+        except Exception as e:
+            logging.error(f"Exporting {len(spans)} spans failed... {e}")
+            TRACE_SPANS.labels(result="failed").inc(len(spans))
+
+    def run(self):
+        while not self.stopped.is_set():
+            spans = self.batch(settings.TRACING_FLUSH_INTERVAL)
+            if spans:
+                self.write(spans)
+
+    def close(self):
+        """export what is still queued and stop the worker"""
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join(settings.TRACING_FLUSH_INTERVAL + 1)
+        spans = self.batch(0)
+        while spans:
+            self.write(spans)
+            spans = self.batch(0)
+        if self.session is not None:
+            self.session.close()
+            self.session = None
+
+
+exporter = SpanExporter()
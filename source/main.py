@@ -1,14 +1,27 @@
 # important import... don't remove this at home(even you dear friend)
 import source.services.invoker
 import logging
+import os
+import shutil
 
 import uvicorn
 from fastapi import FastAPI, HTTPException
+from starlette.routing import Mount
 from starlette.staticfiles import StaticFiles
 from fastapi.responses import PlainTextResponse
 
 from config import settings
-from source.helpers.monitoring import Monitoring
+from source.helpers.influx import influx_writer
+from source.helpers.monitoring import Monitoring, metrics
+# only after helpers.metrics: prometheus_client picks multiprocess mode from the environment when first imported
+from prometheus_client import multiprocess
+from source.helpers.mongo_db import close_client
+from source.helpers.profiler import Profiler, instrument, profiler, profiler_admin
+from source.helpers.saga_pattern import journal
+from source.helpers.saga_recovery import start_recovery
+from source.helpers.request_context import RequestContextMiddleware
+from source.helpers.tracing import Tracing, exporter
+from source.message_broker.async_rpc import async_rpc
 from source.routers.address.app import app as address_app
 from source.routers.attribute.app import app as attribute_app
 from source.routers.cart.app import app as cart_app
@@ -35,7 +48,16 @@ app = FastAPI(title="API Gateway",
               redoc_url="/redoc/" if settings.DEBUG_MODE else None
               )
 
+app.add_middleware(Profiler)
 app.add_middleware(Monitoring)
+app.add_middleware(Tracing)
+app.add_middleware(RequestContextMiddleware)
+
+# one scrape endpoint for the whole gateway, every sub-app and worker included
+app.add_route("/metrics", metrics, include_in_schema=False)
+
+# switches the sampling profiler of every worker at runtime
+app.add_route("/admin/profiler", profiler_admin, methods=["GET", "POST"], include_in_schema=False)
 
 
 # ----------------------------------------- Mount all services here -------------------------------------------------- #
@@ -78,6 +100,9 @@ app.mount("/coupon/api/v1", coupon_app)
 
 app.mount("/rating/api/v1", rating_app)
 
+# sync endpoints run in the threadpool, where the profiler knows their request only through them
+instrument(app.routes)
+
 
 # ----------------------------------------- Start logging features  -------------------------------------------------- #
 
@@ -93,22 +118,47 @@ async def startup_event() -> None:
         datefmt='%Y-%m-%d %H:%M:%S'
     )
     logging.info("Application is starting...")
+    if settings.SAGA_RECOVERY_ON_STARTUP and settings.RPC_TRANSPORT != "memory":
+        start_recovery()
+    if settings.RPC_TRANSPORT == "memory":
+        # no RabbitMQ behind the in-process broker, notifications fall back to the sync transport
+        return
+    try:
+        await async_rpc.connect()
+    except Exception as e:
+        logging.error(f"Async RabbitMQ client could not connect on startup... {e}")
 
 
 @app.on_event("shutdown")
-def shutdown_event() -> None:
+async def shutdown_event() -> None:
     """
     This function will be called when the application stops.
     """
     logging.info("Application is shutting down...")
+    await async_rpc.close()
+    try:
+        journal.flush()
+    except Exception as e:
+        logging.error(f"Saga journal could not be flushed on shutdown... {e}")
+    close_client()
+    influx_writer.close()
+    exporter.close()
+    profiler.flush()
+    if settings.PROMETHEUS_MULTIPROC_DIR:
+        # drops the live gauges of this worker from the merged metrics
+        multiprocess.mark_process_dead(os.getpid())
 
 
 @app.get("/")
 def main():
     if settings.DEBUG_MODE:
-        return [{"path": f"https://devapi.aasood.com{route.path}/docs/"} for route in app.routes][4:-1]
+        return [{"path": f"https://devapi.aasood.com{route.path}/docs/"} for route in app.routes if isinstance(route, Mount)]
     raise HTTPException(status_code=404, detail="Not Found")
 
 
 if __name__ == "__main__":
+    if settings.PROMETHEUS_MULTIPROC_DIR:
+        # samples of the workers of a previous run must not be merged into this one
+        shutil.rmtree(settings.PROMETHEUS_MULTIPROC_DIR, ignore_errors=True)
+        os.makedirs(settings.PROMETHEUS_MULTIPROC_DIR)
     uvicorn.run("main:app", host=settings.UVICORN_HOST, port=settings.UVICORN_PORT, reload=True, workers=12)
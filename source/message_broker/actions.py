@@ -0,0 +1,105 @@
+import pika
+
+from source.config import settings
+from source.helpers.metrics import RPC_MESSAGES
+from source.message_broker.batch import unwrap
+
+QUERY = "query"
+COMMAND = "command"
+INTERACTIVE = "interactive"
+BULK = "bulk"
+# lane of the message, for services that consume bulk messages on queues of their own
+LANE_HEADER = "x-lane"
+
+# read-only actions, their messages are useless once the RPC deadline passed. Only the actions
+# listed here (or in RPC_QUERY_ACTIONS) are queries: names are no proof, e.g. get_link_request
+# creates a link request
+queries = {
+    "all_warehouses", "calc_cart_count", "calculate_credit_per_product", "calculate_wage", "check_basket_is_valid",
+    "check_coupon", "check_credit_state", "check_customer_remaining_gift", "check_is_registered",
+    "check_repetitious_imei", "checkout_check_basket", "cities", "customer_products_report",
+    "customer_products_value", "find_links", "get_accounting_records", "get_all_assignees",
+    "get_all_attributes_by_assignee", "get_all_available_baskets", "get_all_payment_by_service_id",
+    "get_all_property", "get_all_warehouses", "get_attribute_by_name", "get_attributes", "get_basket_products",
+    "get_cart", "get_category_list", "get_credit_and_expire_date", "get_csv", "get_currencies",
+    "get_customer_addresses", "get_customers_grid_data", "get_dealership_inventory", "get_default_address",
+    "get_directories_tree", "get_main_menu", "get_mega_menu", "get_one_order", "get_orders_list_dealership",
+    "get_price", "get_price_list", "get_product_backoffice", "get_product_by_name", "get_product_by_system_code",
+    "get_product_list_by_system_code", "get_product_page", "get_products_credit_price_by_system_codes",
+    "get_products_rates", "get_profile", "get_quantity", "get_quantity_list", "get_remaining_credit",
+    "get_report_wallet_log", "get_shipment_details", "get_stock", "get_stock_by_city_id", "get_transactions",
+    "get_wallet_by_customer_id", "get_warehouse_list", "main_page", "neighborhoods", "price_list",
+    "price_list_all", "price_list_tehran", "products_b2b_price", "shipment_storage_detail", "states",
+}
+# actions that must never be classified as query, even if listed in RPC_QUERY_ACTIONS
+commands = {"get_link_request", "get_referral_number", "get_waybill_number"}
+# back-office grids, reports and exports: slow queries, big replies and nobody waiting at a checkout
+bulk_actions = {
+    "get_accounting_records", "get_csv", "get_customers_grid_data", "get_report_wallet_log", "price_list_all",
+}
+
+
+def register_query(*actions: str):
+    queries.update(actions)
+
+
+def register_command(*actions: str):
+    commands.update(actions)
+
+
+def register_bulk(*actions: str):
+    bulk_actions.update(actions)
+
+
+def action_kind(action: str) -> str:
+    if action in commands:
+        return COMMAND
+    if action in queries or action in settings.RPC_QUERY_ACTIONS:
+        return QUERY
+    return COMMAND
+
+
+def classify(message) -> str:
+    """
+    query if every service of the message is asked for a read-only action, command otherwise;
+    messages whose actions are unknown (e.g. raw gallery uploads) are commands. Batch envelopes
+    are classified by the requests they carry.
+    """
+    if not isinstance(message, dict) or not message:
+        return COMMAND
+    for request in message.values():
+        for item in unwrap(request):
+            if not isinstance(item, dict) or action_kind(str(item.get("action", ""))) != QUERY:
+                return COMMAND
+    return QUERY
+
+
+def delivery_mode(kind: str) -> int:
+    # queries are transient (their TTL is the RPC deadline), commands survive a broker restart
+    if kind == QUERY:
+        return pika.spec.TRANSIENT_DELIVERY_MODE
+    return pika.spec.PERSISTENT_DELIVERY_MODE
+
+
+def observe(message, kind: str):
+    for service, request in (message.items() if isinstance(message, dict) else ()):
+        for item in unwrap(request):
+            action = item.get("action", "") if isinstance(item, dict) else ""
+            RPC_MESSAGES.labels(service=service, action=action, kind=kind).inc()
+
+
+def lane(message) -> str:
+    """bulk if one of the services of the message is asked for a bulk action, interactive otherwise"""
+    for request in (message.values() if isinstance(message, dict) else ()):
+        for item in unwrap(request):
+            action = item.get("action") if isinstance(item, dict) else None
+            if action in bulk_actions or action in settings.RPC_BULK_ACTIONS:
+                return BULK
+    return INTERACTIVE
+
+
+def priority(lane_name: str) -> int:
+    # AMQP message priority, honored by service queues declared with x-max-priority
+    if lane_name == BULK:
+        return settings.RPC_PRIORITY_BULK
+    return settings.RPC_PRIORITY_INTERACTIVE
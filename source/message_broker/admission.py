@@ -0,0 +1,166 @@
+import asyncio
+import threading
+import time
+
+from fastapi import HTTPException
+
+from source.config import settings
+from source.helpers.metrics import RPC_ADMISSION_IN_FLIGHT, RPC_ADMISSION_LIMIT, RPC_ADMISSION_SHED
+from source.helpers.request_context import remaining_budget
+from source.message_broker.actions import BULK, INTERACTIVE
+from source.message_broker.circuit_breaker import reply_outcomes
+
+
+class AdaptiveLimiter:
+    """
+    AIMD limit on the calls a worker has in flight to one downstream service. Each reply within
+    latency_target while the limit is in use raises it by 1/limit (about +1 per limit calls); a
+    timeout, a 5xx or a slower reply multiplies it by backoff, at most once per latency_target so
+    a burst of timeouts from one slowdown counts once. Calls over the limit queue up to queue_size
+    deep, the rest is shed.
+    """
+
+    def __init__(
+            self,
+            service: str,
+            initial: int = 20,
+            min_limit: int = 2,
+            max_limit: int = 200,
+            latency_target: float = 1,
+            backoff: float = 0.9,
+            queue_size: int = 50
+    ):
+        self.service = service
+        self.limit = float(initial)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.latency_target = latency_target
+        self.backoff = backoff
+        self.queue_size = queue_size
+        self.in_flight = 0
+        self.waiting = 0
+        self.decreased_at = 0
+        self.condition = threading.Condition()
+        RPC_ADMISSION_LIMIT.labels(service=service).set(self.limit)
+
+    def acquire(self, timeout: float) -> bool:
+        with self.condition:
+            if self.in_flight >= int(self.limit):
+                if self.waiting >= self.queue_size:
+                    return False
+                self.waiting += 1
+                try:
+                    if not self.condition.wait_for(lambda: self.in_flight < int(self.limit), timeout):
+                        return False
+                finally:
+                    self.waiting -= 1
+            self.in_flight += 1
+            RPC_ADMISSION_IN_FLIGHT.labels(service=self.service).set(self.in_flight)
+            return True
+
+    def release(self, success: bool = None, latency: float = None):
+        """success and latency of the call, both None if it ended without an outcome"""
+        with self.condition:
+            self.in_flight -= 1
+            if success is not None:
+                if not success or latency > self.latency_target:
+                    now = time.monotonic()
+                    if now - self.decreased_at >= self.latency_target:
+                        self.decreased_at = now
+                        self.limit = max(self.min_limit, self.limit * self.backoff)
+                elif self.in_flight + 1 >= self.limit / 2:
+                    self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+            RPC_ADMISSION_LIMIT.labels(service=self.service).set(self.limit)
+            RPC_ADMISSION_IN_FLIGHT.labels(service=self.service).set(self.in_flight)
+            self.condition.notify()
+
+
+limiters = dict()
+limiters_lock = threading.Lock()
+
+
+def get_limiter(service: str) -> AdaptiveLimiter:
+    with limiters_lock:
+        if service not in limiters:
+            limiters[service] = AdaptiveLimiter(
+                service=service,
+                initial=settings.RPC_ADMISSION_INITIAL_LIMIT,
+                min_limit=settings.RPC_ADMISSION_MIN_LIMIT,
+                max_limit=settings.RPC_ADMISSION_MAX_LIMIT,
+                latency_target=settings.RPC_ADMISSION_LATENCY_TARGET,
+                backoff=settings.RPC_ADMISSION_BACKOFF,
+                queue_size=settings.RPC_ADMISSION_QUEUE_SIZE
+            )
+        return limiters[service]
+
+
+class Admission:
+    """
+    the limiter slots one RPC holds, released with the outcome of each service's reply. Bulk calls
+    take slots like any other but never feed the AIMD signal: a report is slow by nature and must
+    not shrink the limit interactive calls get.
+    """
+
+    def __init__(self, limiters_taken: dict = None, lane_name: str = INTERACTIVE):
+        self.limiters = limiters_taken or dict()
+        self.lane = lane_name
+        self.outcomes = dict()
+
+    def record(self, pending, deadlines: dict, late_services):
+        if self.lane == BULK:
+            return
+        for service, success, latency in reply_outcomes(pending, deadlines, late_services):
+            self.outcomes[service] = (success, latency)
+
+    def release(self):
+        limiters_taken, self.limiters = self.limiters, dict()
+        for service, limiter in limiters_taken.items():
+            limiter.release(*self.outcomes.get(service, (None, None)))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.release()
+
+
+def shed(service: str):
+    RPC_ADMISSION_SHED.labels(service=service).inc()
+    raise HTTPException(
+        status_code=503,
+        detail={"error": f"{service} service is overloaded, please try again later"},
+        headers={"Retry-After": str(settings.RPC_ADMISSION_RETRY_AFTER)}
+    )
+
+
+def admit(services, lane_name: str = INTERACTIVE) -> Admission:
+    """
+    take a slot of each service's limiter, waiting at most RPC_ADMISSION_QUEUE_TIMEOUT seconds
+    (or what is left of the request's budget) for them; raises HTTPException 503 with Retry-After
+    for the first service that has none. lane_name is the lane of the call (see actions.lane).
+    """
+    wait = settings.RPC_ADMISSION_QUEUE_TIMEOUT
+    budget = remaining_budget()
+    if budget is not None:
+        wait = max(min(wait, budget), 0)
+    deadline = time.monotonic() + wait
+    admission = Admission(lane_name=lane_name)
+    # always in the same order, two calls never wait on each other's services
+    for service in sorted(services):
+        limiter = get_limiter(service)
+        if not limiter.acquire(max(deadline - time.monotonic(), 0)):
+            admission.release()
+            shed(service)
+        admission.limiters[service] = limiter
+    return admission
+
+
+async def admit_async(services, lane_name: str = INTERACTIVE) -> Admission:
+    """admit for the event loop: the limiters are waited on in a worker thread"""
+    task = asyncio.ensure_future(asyncio.to_thread(admit, services, lane_name))
+    try:
+        return await asyncio.shield(task)
+    except asyncio.CancelledError:
+        # the caller gave up while queued, the slots it gets afterwards go back right away
+        task.add_done_callback(lambda done: done.cancelled() or done.exception() or done.result().release())
+        raise
@@ -0,0 +1,244 @@
+import asyncio
+import json
+import logging
+import time
+import uuid
+
+import aio_pika
+
+from source.config import settings
+from source.helpers.metrics import RPC_NOTIFICATIONS
+from source.helpers.request_context import add_downstream
+from source.helpers.tracing import RpcSpan, rpc_span
+from source.message_broker.codecs import NEGOTIATION_HEADERS, encode_message, decode_reply
+from source.message_broker.actions import LANE_HEADER, QUERY, COMMAND, classify, lane, observe, priority
+from source.message_broker.admission import Admission, admit_async
+from source.message_broker.circuit_breaker import reject_open_circuits, record_replies, unavailable_error
+from source.message_broker.deadline import service_deadlines, deadline_properties, timeout_error
+from source.message_broker.reply_dispatcher import PendingReply
+
+
+class AsyncRabbitRPC:
+    """
+    asyncio counterpart of rabbit_server.RabbitRPC with the same message/headers contract.
+    Every worker shares one robust connection and a single reply consumer; replies are resolved
+    into asyncio futures keyed by correlation_id, so a route can keep many calls in flight.
+    Calls go through the same circuit breakers and admission limiters as the sync client.
+    """
+
+    def __init__(self, exchange_name: str, timeout: int):
+        self.host = settings.RABBITMQ_HOST
+        self.port = settings.RABBITMQ_PORT
+        self.user = settings.RABBITMQ_USER
+        self.password = settings.RABBITMQ_PASS
+        self.exchange_name = exchange_name
+        self.timeout = timeout
+        self.connection = None
+        self.channel = None
+        self.exchange = None
+        self.callback_queue = None
+        self.pending = dict()
+        self.connect_lock = None
+        self.loop = None
+        self.notifications = None
+        self.notifier = None
+
+    async def connect(self):
+        # connect once per worker, aio_pika reconnects and restores the consumer on its own
+        if self.connect_lock is None:
+            self.connect_lock = asyncio.Lock()
+        async with self.connect_lock:
+            if self.connection and not self.connection.is_closed:
+                return
+            self.connection = await aio_pika.connect_robust(
+                host=self.host,
+                port=self.port,
+                login=self.user,
+                password=self.password
+            )
+            self.channel = await self.connection.channel()
+            self.exchange = await self.channel.declare_exchange(
+                self.exchange_name, aio_pika.ExchangeType.HEADERS
+            )
+            self.callback_queue = await self.channel.declare_queue(exclusive=True)
+            await self.callback_queue.consume(self.on_response, no_ack=True)
+            if self.notifier is None:
+                self.notifications = asyncio.Queue()
+                self.notifier = asyncio.create_task(self.run_notifier())
+                self.loop = asyncio.get_running_loop()
+
+    async def close(self, flush_timeout: float = 5):
+        if self.notifier is not None:
+            # give queued notifications a chance to reach the broker before the worker exits
+            try:
+                await asyncio.wait_for(self.notifications.join(), flush_timeout)
+            except asyncio.TimeoutError:
+                logging.error(f"{self.notifications.qsize()} notifications were not published before shutdown")
+            self.notifier.cancel()
+            self.loop = self.notifications = self.notifier = None
+        if self.connection and not self.connection.is_closed:
+            await self.connection.close()
+        for future, _, _ in self.pending.values():
+            if not future.done():
+                future.cancel()
+        self.pending.clear()
+
+    async def fanout_publish(self, exchange_name: str, message: dict):
+        # publish to all services
+        await self.connect()
+        exchange = await self.channel.get_exchange(exchange_name)
+        await exchange.publish(aio_pika.Message(body=json.dumps(message).encode()), routing_key='')
+
+    async def publish(
+            self,
+            message: dict,
+            headers: dict,
+            extra_data: str = None,
+            response_len: int = None,
+            timeout: float = None
+    ) -> dict:
+        """
+        publish message with given message and headers and wait for the replies.
+        response_len defaults to the number of services in headers; the result maps each
+        service name to its reply, exactly like rabbit_server.RabbitRPC.publish: services that
+        miss their deadline get a timeout_error entry, every service gets an unavailable_error
+        entry while RabbitMQ cannot be reached. Raises HTTPException 503 if the circuit of one of
+        the services is open or (with Retry-After) if a service is over its admission limit.
+        """
+        response_len = len(headers) if response_len is None else response_len
+        with rpc_span(message, headers) as span:
+            if not response_len:
+                return await self.round_trip(span, message, headers, extra_data, response_len, timeout)
+            reject_open_circuits(headers)
+            with await admit_async(headers, lane(message)) as admission:
+                return await self.round_trip(span, message, headers, extra_data, response_len, timeout, admission)
+
+    async def round_trip(self, span: RpcSpan, message: dict, headers: dict, extra_data: str, response_len: int,
+                         timeout: float = None, admission: Admission = None) -> dict:
+        try:
+            await self.connect()
+        except (aio_pika.exceptions.AMQPError, ConnectionError) as error:
+            logging.error(f"Publishing to {', '.join(headers)} failed, RabbitMQ is unreachable... {error}")
+            span.outcome = "error"
+            return {service: unavailable_error(service) for service in headers}
+        corr_id = str(uuid.uuid4())
+        deadlines = service_deadlines(headers, timeout or self.timeout)
+        expiration, headers = deadline_properties(headers, deadlines)
+        message_lane = lane(message)
+        headers.update(NEGOTIATION_HEADERS, **{LANE_HEADER: message_lane})
+        headers = span.headers(headers)
+        body, content_type, content_encoding = encode_message(message, extra_data)
+        kind = classify(message)
+        observe(message, kind)
+        delivery_modes = {QUERY: aio_pika.DeliveryMode.NOT_PERSISTENT, COMMAND: aio_pika.DeliveryMode.PERSISTENT}
+        future = asyncio.get_running_loop().create_future()
+        pending = PendingReply(corr_id, response_len)
+        self.pending[corr_id] = (future, pending, span)
+        late_services = list()
+        try:
+            span.published(len(body))
+            await self.exchange.publish(
+                aio_pika.Message(
+                    body=body,
+                    headers=headers,
+                    correlation_id=corr_id,
+                    reply_to=self.callback_queue.name,
+                    delivery_mode=delivery_modes[kind],
+                    priority=priority(message_lane),
+                    content_type=content_type,
+                    content_encoding=content_encoding,
+                    expiration=int(expiration) / 1000
+                ),
+                routing_key=''
+            )
+            if response_len:
+                await asyncio.wait_for(future, max(deadlines.values()) - time.monotonic())
+        except asyncio.TimeoutError:
+            late_services = [service for service in deadlines if service not in pending.result()]
+        except (aio_pika.exceptions.AMQPError, ConnectionError) as error:
+            logging.error(f"Publishing to {', '.join(deadlines)} failed, RabbitMQ is unreachable... {error}")
+            span.outcome = "error"
+            return {service: unavailable_error(service) for service in deadlines}
+        finally:
+            self.pending.pop(corr_id, None)
+            add_downstream(time.monotonic() - pending.started)
+        if not response_len:
+            return {}
+        record_replies(pending, deadlines, late_services, message_lane)
+        if admission is not None:
+            admission.record(pending, deadlines, late_services)
+        result = pending.result()
+        for service in late_services:
+            result[service] = timeout_error(service, deadlines[service] - pending.started)
+        span.replies(result)
+        return result
+
+    def notify(self, message: dict, headers: dict, extra_data: str = None) -> bool:
+        """
+        queue a message nobody waits a reply for (sms, logs, cart cleanup) and return immediately.
+        Thread-safe, so sync routes running in the threadpool can call it too. Returns False
+        when the notifier is not running in this worker, the caller has to publish it itself then.
+        """
+        loop = self.loop
+        if loop is None or loop.is_closed():
+            return False
+        loop.call_soon_threadsafe(self.notifications.put_nowait, (message, headers, extra_data, 0))
+        return True
+
+    async def publish_async(self, message: dict, headers: dict, extra_data: str = None):
+        # notify from async code, connecting first if this worker has not done it yet
+        await self.connect()
+        self.notify(message, headers, extra_data)
+
+    async def run_notifier(self):
+        """
+        publish queued notifications in batches: every message of a batch is published before the
+        broker's confirms are awaited together, so durability costs one round-trip per batch.
+        Failed messages are queued again RPC_NOTIFY_RETRIES times.
+        """
+        while True:
+            batch = [await self.notifications.get()]
+            while len(batch) < settings.RPC_NOTIFY_BATCH_SIZE and not self.notifications.empty():
+                batch.append(self.notifications.get_nowait())
+            results = await asyncio.gather(
+                *(self.send_notification(message, headers, extra_data) for message, headers, extra_data, _ in batch),
+                return_exceptions=True
+            )
+            for (message, headers, extra_data, attempts), result in zip(batch, results):
+                self.notifications.task_done()
+                if not isinstance(result, Exception):
+                    RPC_NOTIFICATIONS.labels(result="confirmed").inc()
+                elif attempts + 1 < settings.RPC_NOTIFY_RETRIES:
+                    RPC_NOTIFICATIONS.labels(result="retried").inc()
+                    self.loop.call_later(1, self.notifications.put_nowait, (message, headers, extra_data, attempts + 1))
+                else:
+                    RPC_NOTIFICATIONS.labels(result="failed").inc()
+                    logging.error(f"Notification to {', '.join(headers)} was not published: {result}")
+
+    async def send_notification(self, message: dict, headers: dict, extra_data: str = None):
+        body, content_type, content_encoding = encode_message(message, extra_data)
+        await self.exchange.publish(
+            aio_pika.Message(
+                body=body,
+                headers=headers,
+                delivery_mode=aio_pika.DeliveryMode.PERSISTENT,
+                priority=priority(lane(message)),
+                content_type=content_type,
+                content_encoding=content_encoding
+            ),
+            routing_key=''
+        )
+
+    async def on_response(self, message: aio_pika.IncomingMessage):
+        pending = self.pending.get(message.correlation_id)
+        if pending is None:
+            return
+        future, pending, span = pending
+        span.received(len(message.body))
+        key, value = next(iter(decode_reply(message.body, message.content_type, message.content_encoding).items()))
+        pending.add(key, value)
+        if pending.done() and not future.done():
+            future.set_result(None)
+
+
+async_rpc = AsyncRabbitRPC(exchange_name='headers_exchange', timeout=5)
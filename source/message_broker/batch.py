@@ -0,0 +1,32 @@
+"""
+Batch envelope: one message carrying N requests for a service, answered by one reply with N results.
+
+    request: {"cart": {"action": "batch", "body": {"requests": [{"action": ..., "body": ...}, ...]}}}
+    reply:   {"cart": {"success": true, "status_code": 200, "message": [<reply 1>, ..., <reply N>]}}
+
+Each result is what the service would have replied to its request alone. A service that fails the
+envelope as a whole replies as for a single request, and each request of the envelope gets that
+reply. Only services listed in RPC_BATCH_SERVICES are sent envelopes.
+"""
+BATCH_ACTION = "batch"
+
+
+def batch_envelope(requests: list) -> dict:
+    return {"action": BATCH_ACTION, "body": {"requests": requests}}
+
+
+def unwrap(request) -> list:
+    # the requests of a batch envelope, the request itself otherwise
+    if isinstance(request, dict) and request.get("action") == BATCH_ACTION:
+        return (request.get("body") or {}).get("requests") or []
+    return [request]
+
+
+def batch_replies(reply: dict, count: int) -> list:
+    """the count replies carried by the reply of a batch envelope"""
+    results = reply.get("message") if reply.get("success") else None
+    if isinstance(results, list) and len(results) == count:
+        return results
+    if reply.get("success"):
+        reply = {"success": False, "status_code": 502, "error": "Malformed batch reply"}
+    return [dict(reply) for _ in range(count)]
@@ -0,0 +1,57 @@
+import threading
+import time
+from contextlib import contextmanager
+
+from fastapi import HTTPException
+
+from source.config import settings
+from source.helpers.metrics import RPC_BULK_IN_FLIGHT, RPC_BULK_REJECTED, RPC_BULK_WAIT_SECONDS
+from source.helpers.request_context import remaining_budget
+from source.message_broker.actions import BULK, lane
+
+
+class Bulkhead:
+    """
+    Caps the bulk RPCs (see actions.lane) a worker has in flight at RPC_BULK_CONCURRENCY, so report
+    exports queue behind each other instead of taking the threadpool and the services' capacity
+    from interactive calls. A call waits for a slot at most RPC_BULK_QUEUE_TIMEOUT seconds (or what
+    is left of its request's budget) and is then rejected with a 503.
+    """
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.semaphore = threading.BoundedSemaphore(limit)
+
+    def acquire(self, message) -> bool:
+        """take a slot if message is bulk; True if one was taken and must be released"""
+        if lane(message) != BULK:
+            return False
+        wait = settings.RPC_BULK_QUEUE_TIMEOUT
+        budget = remaining_budget()
+        if budget is not None:
+            wait = max(min(wait, budget), 0)
+        started = time.perf_counter()
+        if not self.semaphore.acquire(timeout=wait):
+            RPC_BULK_REJECTED.inc()
+            raise HTTPException(
+                status_code=503,
+                detail={"error": "Too many reports are being prepared right now, please try again later"}
+            )
+        RPC_BULK_WAIT_SECONDS.observe(time.perf_counter() - started)
+        RPC_BULK_IN_FLIGHT.inc()
+        return True
+
+    def release(self):
+        RPC_BULK_IN_FLIGHT.dec()
+        self.semaphore.release()
+
+    @contextmanager
+    def slot(self, message):
+        bulk = self.acquire(message)
+        try:
+            yield
+        finally:
+            if bulk:
+                self.release()
+
+bulkhead = Bulkhead(settings.RPC_BULK_CONCURRENCY)
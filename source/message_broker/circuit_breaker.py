@@ -0,0 +1,168 @@
+import logging
+import math
+import threading
+import time
+from collections import deque
+
+from fastapi import HTTPException
+
+from source.config import settings
+from source.helpers.metrics import CIRCUIT_STATE, CIRCUIT_FAILURE_RATE, CIRCUIT_REJECTED
+from source.message_broker.actions import BULK, INTERACTIVE
+
+
+class CircuitBreaker:
+    """
+    Breaker for one downstream service, keyed by the header-routing service name.
+    Opens when the failure rate (errors, timeouts and slow replies) of the last `window`
+    calls reaches `error_rate`, rejects calls for `open_seconds`, then lets `probes`
+    half-open calls through: one failing probe opens it again, all passing close it.
+    """
+    CLOSED = "closed"
+    HALF_OPEN = "half_open"
+    OPEN = "open"
+    STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+    def __init__(
+            self,
+            service: str,
+            window: int = 20,
+            min_calls: int = 10,
+            error_rate: float = 0.5,
+            slow_call: float = 3,
+            open_seconds: float = 15,
+            probes: int = 1
+    ):
+        self.service = service
+        self.min_calls = min_calls
+        self.error_rate = error_rate
+        self.slow_call = slow_call
+        self.open_seconds = open_seconds
+        self.probes = probes
+        self.calls = deque(maxlen=window)
+        self.state = self.CLOSED
+        self.opened_at = 0
+        self.probes_left = 0
+        self.probes_passed = 0
+        self.lock = threading.Lock()
+        CIRCUIT_STATE.labels(service=service).set(0)
+
+    def set_state(self, state: str):
+        if state != self.state:
+            logging.info(f"Circuit of {self.service} service: {self.state} -> {state}")
+        self.state = state
+        CIRCUIT_STATE.labels(service=self.service).set(self.STATE_VALUES[state])
+
+    def allow(self) -> bool:
+        with self.lock:
+            if self.state == self.OPEN:
+                if time.monotonic() - self.opened_at < self.open_seconds:
+                    CIRCUIT_REJECTED.labels(service=self.service).inc()
+                    return False
+                self.set_state(self.HALF_OPEN)
+                self.opened_at = time.monotonic()
+                self.probes_left = self.probes
+                self.probes_passed = 0
+            if self.state == self.HALF_OPEN:
+                if self.probes_left <= 0:
+                    if time.monotonic() - self.opened_at < self.open_seconds:
+                        CIRCUIT_REJECTED.labels(service=self.service).inc()
+                        return False
+                    # probes that never reported back (e.g. their call was rejected by another circuit)
+                    self.opened_at = time.monotonic()
+                    self.probes_left = self.probes
+                self.probes_left -= 1
+            return True
+
+    def record(self, success: bool, latency: float, slow_call: float = None):
+        """outcome of a call; slow_call overrides the breaker's slow call threshold for this one"""
+        failed = not success or latency > (self.slow_call if slow_call is None else slow_call)
+        with self.lock:
+            if self.state == self.HALF_OPEN:
+                if failed:
+                    self.trip()
+                else:
+                    self.probes_passed += 1
+                    if self.probes_passed >= self.probes:
+                        self.calls.clear()
+                        self.set_state(self.CLOSED)
+                return
+            self.calls.append(failed)
+            failure_rate = sum(self.calls) / len(self.calls)
+            CIRCUIT_FAILURE_RATE.labels(service=self.service).set(failure_rate)
+            if self.state == self.CLOSED and len(self.calls) >= self.min_calls and failure_rate >= self.error_rate:
+                self.trip()
+
+    def trip(self):
+        self.opened_at = time.monotonic()
+        self.set_state(self.OPEN)
+
+
+breakers = dict()
+breakers_lock = threading.Lock()
+
+
+def get_breaker(service: str) -> CircuitBreaker:
+    with breakers_lock:
+        if service not in breakers:
+            breakers[service] = CircuitBreaker(
+                service=service,
+                window=settings.CIRCUIT_BREAKER_WINDOW,
+                min_calls=settings.CIRCUIT_BREAKER_MIN_CALLS,
+                error_rate=settings.CIRCUIT_BREAKER_ERROR_RATE,
+                slow_call=settings.CIRCUIT_BREAKER_SLOW_CALL,
+                open_seconds=settings.CIRCUIT_BREAKER_OPEN_SECONDS
+            )
+        return breakers[service]
+
+
+def open_circuits(services) -> list:
+    return [service for service in services if not get_breaker(service).allow()]
+
+
+def unavailable_error(service: str) -> dict:
+    return {"success": False, "status_code": 503, "error": f"{service} service is temporarily unavailable"}
+
+
+def raise_unavailable(service: str):
+    raise HTTPException(status_code=503, detail={"error": unavailable_error(service)["error"]})
+
+
+def reject_open_circuits(services):
+    # fail immediately instead of letting the request wait out the timeout of a service that is down
+    rejected = open_circuits(services)
+    if rejected:
+        raise_unavailable(rejected[0])
+
+
+def reply_outcomes(pending, deadlines: dict, late_services):
+    """
+    (service, success, latency) of each service that replied or missed its deadline;
+    timeouts and 5xx replies count as failures, business errors (4xx) do not
+    """
+    for service in deadlines:
+        if service in late_services:
+            yield service, False, deadlines[service] - pending.started
+            continue
+        reply = pending.responses.get(service)
+        if reply is None:
+            continue
+        success = reply.get("success") or reply.get("status_code", 500) < 500
+        yield service, success, pending.arrived[service] - pending.started
+
+
+def slow_call(breaker: CircuitBreaker, lane_name: str) -> float:
+    """
+    seconds past which a successful reply still counts as a failure. Bulk calls (reports, exports)
+    are slow by nature and only fail on errors and timeouts; a service given a longer timeout in
+    RPC_SERVICE_TIMEOUTS is expected to be that slow, so its calls are never slow before it.
+    """
+    if lane_name == BULK:
+        return math.inf
+    return max(breaker.slow_call, settings.RPC_SERVICE_TIMEOUTS.get(breaker.service, 0))
+
+
+def record_replies(pending, deadlines: dict, late_services: list, lane_name: str = INTERACTIVE):
+    for service, success, latency in reply_outcomes(pending, deadlines, late_services):
+        breaker = get_breaker(service)
+        breaker.record(success, latency, slow_call(breaker, lane_name))
@@ -0,0 +1,124 @@
+import json
+
+from source.config import settings
+from source.message_broker.compression import ACCEPT_ENCODING_HEADER, ACCEPT_ENCODING, compress, decompress
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+ACCEPT_HEADER = "x-accept"
+
+
+class JsonCodec:
+    """
+    stdlib json, what every service speaks. Messages go out without content_type
+    because services (and the gallery upload envelope) read content_type as extra data.
+    """
+    name = "json"
+    content_type = "application/json"
+    legacy = True
+
+    @staticmethod
+    def encode(message) -> bytes:
+        return json.dumps(message).encode()
+
+    @staticmethod
+    def decode(body: bytes):
+        return json.loads(body)
+
+
+class OrjsonCodec(JsonCodec):
+    """same JSON on the wire as JsonCodec, several times faster for multi megabyte price lists"""
+    name = "orjson"
+
+    @staticmethod
+    def encode(message) -> bytes:
+        return orjson.dumps(message, option=orjson.OPT_NON_STR_KEYS)
+
+    @staticmethod
+    def decode(body: bytes):
+        return orjson.loads(body)
+
+
+class MsgpackCodec:
+    """binary and smaller than JSON; only for services listed in RPC_CODEC_SERVICES"""
+    name = "msgpack"
+    content_type = "application/msgpack"
+    legacy = False
+
+    @staticmethod
+    def encode(message) -> bytes:
+        return msgpack.packb(message, use_bin_type=True)
+
+    @staticmethod
+    def decode(body: bytes):
+        return msgpack.unpackb(body, raw=False)
+
+
+CODECS = {codec.name: codec for codec in (JsonCodec, OrjsonCodec, MsgpackCodec)}
+AVAILABLE = {"json": True, "orjson": orjson is not None, "msgpack": msgpack is not None}
+
+
+def get_codec(name: str = None):
+    name = name or settings.RPC_CODEC
+    if name not in CODECS:
+        raise ValueError(f"Unknown RPC codec {name}, use one of {', '.join(CODECS)}")
+    if not AVAILABLE[name]:
+        raise ImportError(f"RPC codec {name} needs the {name} package")
+    return CODECS[name]
+
+
+# content_type -> codec used for replies; JSON replies use orjson when it is installed
+DECODERS = {content_type: OrjsonCodec if AVAILABLE["orjson"] else JsonCodec
+            for content_type in (None, "", JsonCodec.content_type)}
+if AVAILABLE["msgpack"]:
+    DECODERS[MsgpackCodec.content_type] = MsgpackCodec
+
+# content types this gateway can decode, sent with every request so services may pick one
+ACCEPT = ", ".join(content_type for content_type in DECODERS if content_type)
+NEGOTIATION_HEADERS = {ACCEPT_HEADER: ACCEPT, ACCEPT_ENCODING_HEADER: ACCEPT_ENCODING}
+
+
+def message_codec(message, extra_data: str = None, codec=None):
+    """
+    codec of an outgoing message: RPC_CODEC (or codec) if every service it goes to reads it, i.e. the
+    codec is JSON on the wire or the services are listed in RPC_CODEC_SERVICES, JsonCodec otherwise.
+    Messages with extra_data are JSON too: extra_data travels as content_type, where a binary codec
+    names itself.
+    """
+    codec = codec or get_codec()
+    if codec.legacy:
+        return codec
+    services = message if isinstance(message, dict) else ()
+    if extra_data or not services or any(service not in settings.RPC_CODEC_SERVICES for service in services):
+        return JsonCodec
+    return codec
+
+
+def encode_message(message, extra_data: str = None, codec=None):
+    """
+    body, content_type and content_encoding of an outgoing message, see message_codec; big bodies
+    are compressed for services that opted in (see compression.compress). Raw bodies (e.g. gallery
+    uploads) and their extra_data pass through untouched.
+    """
+    if not isinstance(message, (dict, list)):
+        return message, extra_data, None
+    codec = message_codec(message, extra_data, codec)
+    body, content_encoding = compress(codec.encode(message), message if isinstance(message, dict) else ())
+    return body, extra_data if codec.legacy else codec.content_type, content_encoding
+
+
+def decode_reply(body: bytes, content_type: str = None, content_encoding: str = None):
+    """
+    decode a reply exactly once, picking the codec by the reply's content_type;
+    services that echo other content types back reply in JSON. Compressed replies are
+    decompressed first.
+    """
+    return DECODERS.get(content_type, DECODERS[None]).decode(decompress(body, content_encoding))
@@ -0,0 +1,76 @@
+import time
+import zlib
+
+from source.config import settings
+from source.helpers.metrics import RPC_COMPRESSION_RATIO, RPC_COMPRESSION_SECONDS
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+ACCEPT_ENCODING_HEADER = "x-accept-encoding"
+
+
+class ZlibCompressor:
+    name = "deflate"
+
+    @staticmethod
+    def compress(body: bytes) -> bytes:
+        return zlib.compress(body, settings.RPC_COMPRESSION_LEVEL)
+
+    @staticmethod
+    def decompress(body: bytes) -> bytes:
+        return zlib.decompress(body)
+
+
+class ZstdCompressor:
+    name = "zstd"
+
+    @staticmethod
+    def compress(body: bytes) -> bytes:
+        return zstandard.ZstdCompressor(level=settings.RPC_COMPRESSION_LEVEL).compress(body)
+
+    @staticmethod
+    def decompress(body: bytes) -> bytes:
+        # replies compressed in streaming mode carry no content size in the frame header
+        return zstandard.ZstdDecompressor().decompressobj().decompress(body)
+
+
+# content_encoding -> compressor; RPC_COMPRESSION names them by their library
+COMPRESSORS = {ZlibCompressor.name: ZlibCompressor}
+if zstandard is not None:
+    COMPRESSORS[ZstdCompressor.name] = ZstdCompressor
+SETTING_NAMES = {"zlib": ZlibCompressor.name, "zstd": ZstdCompressor.name}
+
+# content encodings this gateway can decompress, sent with every request so services compress big replies
+ACCEPT_ENCODING = ", ".join(COMPRESSORS)
+
+
+def compress(body: bytes, services=()):
+    """
+    compress a message body of at least RPC_COMPRESSION_THRESHOLD bytes with RPC_COMPRESSION if every
+    service it goes to is listed in RPC_COMPRESSION_SERVICES, i.e. decompresses requests by their
+    content_encoding; returns the body to send and its content_encoding (None when sent as is).
+    """
+    encoding = SETTING_NAMES.get(settings.RPC_COMPRESSION)
+    if encoding not in COMPRESSORS or len(body) < settings.RPC_COMPRESSION_THRESHOLD:
+        return body, None
+    if not services or any(service not in settings.RPC_COMPRESSION_SERVICES for service in services):
+        return body, None
+    started = time.perf_counter()
+    compressed = COMPRESSORS[encoding].compress(body)
+    RPC_COMPRESSION_SECONDS.labels(direction="compress", encoding=encoding).observe(time.perf_counter() - started)
+    RPC_COMPRESSION_RATIO.labels(direction="request", encoding=encoding).observe(len(body) / max(len(compressed), 1))
+    return compressed, encoding
+
+
+def decompress(body: bytes, encoding: str = None) -> bytes:
+    # replies without content_encoding (or with one we do not know, e.g. "utf-8") are plain
+    if encoding not in COMPRESSORS:
+        return body
+    started = time.perf_counter()
+    decompressed = COMPRESSORS[encoding].decompress(body)
+    RPC_COMPRESSION_SECONDS.labels(direction="decompress", encoding=encoding).observe(time.perf_counter() - started)
+    RPC_COMPRESSION_RATIO.labels(direction="reply", encoding=encoding).observe(len(decompressed) / max(len(body), 1))
+    return decompressed
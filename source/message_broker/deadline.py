@@ -0,0 +1,49 @@
+import time
+
+from source.config import settings
+from source.helpers.exception_handler import ExceptionHandler
+from source.helpers.request_context import remaining_budget
+
+DEADLINE_HEADER = "x-deadline"
+
+
+def service_deadlines(services, timeout: float, now: float = None, overrides: dict = None) -> dict:
+    """
+    monotonic deadline of every service of a publish. RPC_SERVICE_TIMEOUTS overrides the default
+    timeout of slow services, e.g. {"product": 10}, overrides given by the caller win over both,
+    and nothing may outlive the HTTP request's budget.
+    """
+    now = now or time.monotonic()
+    overrides = overrides or {}
+    budget = remaining_budget()
+    deadlines = dict()
+    for service in services:
+        service_timeout = overrides.get(service) or settings.RPC_SERVICE_TIMEOUTS.get(service, timeout)
+        if budget is not None:
+            service_timeout = min(service_timeout, budget)
+        deadlines[service] = now + service_timeout
+    return deadlines
+
+
+def expired_services(deadlines: dict) -> list:
+    now = time.monotonic()
+    return [service for service, deadline in deadlines.items() if deadline <= now]
+
+
+def timeout_error(service: str, timeout: float) -> dict:
+    # structured reply for a service that missed its deadline, shaped like a failed service response
+    message = f"{service} service is not responding after {round(timeout, 2)} seconds"
+    ExceptionHandler(message=message).logger()
+    return {"success": False, "status_code": 504, "error": message, "timeout": True}
+
+
+def deadline_properties(headers: dict, deadlines: dict):
+    """
+    expiration (remaining budget in milliseconds, as AMQP wants it) and a copy of headers with the
+    absolute x-deadline in epoch milliseconds, so services can drop work nobody waits for anymore.
+    """
+    remaining = max(deadlines.values(), default=time.monotonic()) - time.monotonic()
+    remaining_ms = max(int(remaining * 1000), 1)
+    stamped = dict(headers or {})
+    stamped[DEADLINE_HEADER] = int(time.time() * 1000) + remaining_ms
+    return str(remaining_ms), stamped
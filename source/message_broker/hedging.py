@@ -0,0 +1,114 @@
+import threading
+import time
+from collections import deque
+
+from source.config import settings
+from source.helpers.metrics import RPC_HEDGE_DELAY, RPC_HEDGES
+
+
+class LatencyTracker:
+    """recent reply latencies of one action and the percentile past which its calls are hedged"""
+
+    def __init__(self, window: int = 256, refresh: int = 16):
+        self.latencies = deque(maxlen=window)
+        self.refresh = refresh
+        self.count = 0
+        self.threshold = None
+
+    def observe(self, latency: float):
+        self.latencies.append(latency)
+        self.count += 1
+        if self.count % self.refresh == 0 and len(self.latencies) >= settings.RPC_HEDGE_MIN_SAMPLES:
+            ordered = sorted(self.latencies)
+            self.threshold = ordered[min(int(len(ordered) * settings.RPC_HEDGE_PERCENTILE), len(ordered) - 1)]
+
+
+class Hedger:
+    """
+    Hedging of idempotent reads (RPC_HEDGE_ACTIONS): when the reply of a call is later than the
+    RPC_HEDGE_PERCENTILE latency recently observed for its action, the RPC client publishes the
+    same message again and takes whichever reply comes first. Every hedgeable call earns
+    RPC_HEDGE_BUDGET of a token and a hedge costs a whole one, so hedges never add more than
+    that fraction of extra calls, even when a service slows down as a whole.
+    """
+    MAX_TOKENS = 10
+
+    def __init__(self):
+        self.trackers = dict()
+        self.tokens = 1.0
+        # first attempts a hedge beat, still registered until they reply: (key, pending, corr_id, deadline)
+        self.awaited = list()
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def key(message, headers: dict):
+        """(service, action) of a single service call to a hedged action, None otherwise"""
+        if not isinstance(message, dict) or len(message) != 1 or len(headers) != 1:
+            return None
+        service, request = next(iter(message.items()))
+        action = request.get("action") if isinstance(request, dict) else None
+        if service not in headers or action not in settings.RPC_HEDGE_ACTIONS:
+            return None
+        return service, action
+
+    def delay(self, key: tuple):
+        # seconds to wait for the reply before hedging, None while too few latencies are known
+        with self.lock:
+            self.tokens = min(self.MAX_TOKENS, self.tokens + settings.RPC_HEDGE_BUDGET)
+            tracker = self.trackers.get(key)
+            if tracker is None or tracker.threshold is None:
+                return None
+            return max(tracker.threshold, settings.RPC_HEDGE_MIN_DELAY)
+
+    def spend(self, key: tuple) -> bool:
+        with self.lock:
+            if self.tokens < 1:
+                RPC_HEDGES.labels(service=key[0], action=key[1], result="no_budget").inc()
+                return False
+            self.tokens -= 1
+        RPC_HEDGES.labels(service=key[0], action=key[1], result="sent").inc()
+        return True
+
+    def observe(self, key: tuple, latency: float):
+        with self.lock:
+            tracker = self.trackers.setdefault(key, LatencyTracker())
+            tracker.observe(latency)
+            if tracker.threshold is not None:
+                RPC_HEDGE_DELAY.labels(service=key[0], action=key[1]).set(tracker.threshold)
+
+    def observe_primary(self, key: tuple, pending, corr_id: str, deadline: float) -> bool:
+        """
+        record the latency of the first attempt of a call, never the one of a hedge that won: the
+        percentile would drift down with every hedge and hedges fire ever earlier. Returns False if
+        a hedge beat it; its reply is then awaited under corr_id, which the caller must keep
+        registered until collect() returns it.
+        """
+        arrived = pending.replied_at(corr_id)
+        if arrived is not None:
+            self.observe(key, arrived - pending.started)
+            return True
+        with self.lock:
+            self.awaited.append((key, pending, corr_id, deadline))
+        return False
+
+    def collect(self) -> list:
+        """
+        record the awaited first attempts that replied since, or passed their deadline (they took at
+        least that long); returns their (correlation id, pending reply), to be discarded by the caller.
+        """
+        now = time.monotonic()
+        with self.lock:
+            awaited, self.awaited = self.awaited, list()
+        done = list()
+        for key, pending, corr_id, deadline in awaited:
+            arrived = pending.replied_at(corr_id)
+            if arrived is None and now < deadline:
+                with self.lock:
+                    self.awaited.append((key, pending, corr_id, deadline))
+                continue
+            self.observe(key, (arrived or deadline) - pending.started)
+            done.append((corr_id, pending))
+        return done
+
+
+hedger = Hedger()
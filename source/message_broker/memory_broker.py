@@ -0,0 +1,256 @@
+import heapq
+import json
+import logging
+import random
+import threading
+import time
+import uuid
+
+import pika
+
+from source.message_broker.batch import BATCH_ACTION, unwrap
+from source.message_broker.codecs import decode_reply
+from source.message_broker.reply_dispatcher import ReplyRouter, PendingReply
+from source.message_broker.transport import Transport
+
+
+# ----------------------------------------- Latency distributions -------------------------------------------------- #
+
+def constant(seconds: float):
+    return lambda: seconds
+
+
+def uniform(low: float, high: float):
+    return lambda: random.uniform(low, high)
+
+
+def exponential(mean: float):
+    return lambda: random.expovariate(1 / mean) if mean else 0
+
+
+def lognormal(median: float, sigma: float = 0.5):
+    # long tailed like real services: most calls near the median, a few much slower
+    return lambda: median * random.lognormvariate(0, sigma)
+
+
+# ----------------------------------------- Fake services ---------------------------------------------------------- #
+
+class FakeService:
+    """
+    Scriptable stand-in for one downstream service, bound to the headers exchange by its name.
+    handlers map an action to a reply or to a callable that gets the request body and returns it;
+    unknown actions get default; batch envelopes are answered request by request. Every call waits
+    latency() seconds (see the distributions above), fails with error_status at error_rate and is
+    never answered at drop_rate. exchanges are the fanout exchanges its queue is bound to, their
+    messages are kept in fanout_messages.
+    """
+
+    def __init__(
+            self,
+            name: str,
+            handlers: dict = None,
+            latency=None,
+            error_rate: float = 0,
+            error_status: int = 500,
+            drop_rate: float = 0,
+            default: dict = None,
+            exchanges: tuple = ()
+    ):
+        self.name = name
+        self.handlers = handlers or dict()
+        self.latency = latency or constant(0)
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.drop_rate = drop_rate
+        self.default = default if default is not None else {"success": True, "status_code": 200, "message": {}}
+        self.exchanges = set(exchanges)
+        self.calls = 0
+        self.fanout_messages = list()
+
+    def on(self, action: str, reply=None):
+        """register the reply of an action, usable as decorator: @service.on("get_cart")"""
+        if reply is not None:
+            self.handlers[action] = reply
+            return reply
+
+        def decorator(handler):
+            self.handlers[action] = handler
+            return handler
+        return decorator
+
+    def handle(self, request: dict):
+        """reply of this service to its part of a message, None if the call is dropped"""
+        self.calls += 1
+        if random.random() < self.drop_rate:
+            return None
+        action = request.get("action") if isinstance(request, dict) else None
+        if random.random() < self.error_rate:
+            return {"success": False, "status_code": self.error_status, "error": f"{self.name} fake error in {action}"}
+        if action == BATCH_ACTION and action not in self.handlers:
+            return {"success": True, "status_code": 200, "message": [self.reply(item) for item in unwrap(request)]}
+        return self.reply(request)
+
+    def reply(self, request: dict):
+        handler = self.handlers.get(request.get("action"), self.default)
+        try:
+            return handler(request.get("body")) if callable(handler) else handler
+        except Exception as e:
+            return {"success": False, "status_code": 500, "error": str(e)}
+
+
+# ----------------------------------------- Broker ----------------------------------------------------------------- #
+
+class Scheduler:
+    """one thread running callbacks at their due time, so simulated latency costs no thread per call"""
+
+    def __init__(self):
+        self.queue = list()
+        self.condition = threading.Condition()
+        self.counter = 0
+        self.thread = threading.Thread(target=self.run, name="memory-broker-scheduler", daemon=True)
+        self.thread.start()
+
+    def call_later(self, delay: float, callback, *args):
+        with self.condition:
+            self.counter += 1
+            heapq.heappush(self.queue, (time.monotonic() + delay, self.counter, callback, args))
+            self.condition.notify()
+
+    def run(self):
+        while True:
+            with self.condition:
+                while not self.queue or self.queue[0][0] > time.monotonic():
+                    self.condition.wait(self.queue[0][0] - time.monotonic() if self.queue else None)
+                _, _, callback, args = heapq.heappop(self.queue)
+            try:
+                callback(*args)
+            except Exception as e:
+                logging.error(f"Memory broker callback failed... {e}")
+
+
+class MemoryBroker:
+    """
+    In-process stand-in for the subset of RabbitMQ the gateway uses: a headers exchange routing
+    on service names with x-match any, fanout exchanges, exclusive reply queues, correlation_id /
+    reply_to and per-message expiration. Messages are delivered to FakeService objects.
+    """
+
+    def __init__(self):
+        self.services = dict()
+        self.queues = dict()
+        self.lock = threading.Lock()
+        self.scheduler = None
+
+    def add_service(self, service: FakeService) -> FakeService:
+        with self.lock:
+            self.services[service.name] = service
+        return service
+
+    def remove_service(self, name: str):
+        with self.lock:
+            self.services.pop(name, None)
+
+    def declare_queue(self, callback) -> str:
+        # exclusive, server named queue consumed by callback(channel, method, properties, body)
+        name = f"amq.gen-{uuid.uuid4()}"
+        with self.lock:
+            self.queues[name] = callback
+        return name
+
+    def call_later(self, delay: float, callback, *args):
+        with self.lock:
+            if self.scheduler is None:
+                self.scheduler = Scheduler()
+        self.scheduler.call_later(delay, callback, *args)
+
+    def publish(self, properties: pika.BasicProperties, body):
+        """publish on the headers exchange; services whose name is a truthy header get the message"""
+        headers = properties.headers or dict()
+        with self.lock:
+            services = [service for name, service in self.services.items() if headers.get(name)]
+        if not services:
+            logging.info(f"Memory broker: no service bound for {', '.join(headers)}, message dropped")
+            return
+        expires = time.monotonic() + int(properties.expiration) / 1000 if properties.expiration else None
+        message = self.decode(properties, body)
+        for service in services:
+            self.call_later(max(service.latency(), 0), self.deliver, service, message, properties, expires)
+
+    def fanout(self, exchange_name: str, body):
+        """publish on a fanout exchange; every service bound to it gets the message"""
+        message = json.loads(body)
+        with self.lock:
+            services = [service for service in self.services.values() if exchange_name in service.exchanges]
+        if not services:
+            logging.info(f"Memory broker: no service bound to {exchange_name}, message dropped")
+            return
+        for service in services:
+            service.fanout_messages.append(message)
+
+    def deliver(self, service: FakeService, message: dict, properties: pika.BasicProperties, expires: float):
+        if expires is not None and time.monotonic() > expires:
+            # expired in the queue, like RabbitMQ the message is never seen by the service
+            return
+        reply = service.handle(message.get(service.name))
+        if reply is None or not properties.reply_to:
+            return
+        with self.lock:
+            callback = self.queues.get(properties.reply_to)
+        if callback is not None:
+            callback(
+                None, None,
+                pika.BasicProperties(correlation_id=properties.correlation_id),
+                json.dumps({service.name: reply}).encode()
+            )
+
+    @staticmethod
+    def decode(properties: pika.BasicProperties, body) -> dict:
+        try:
+            return decode_reply(body, properties.content_type, properties.content_encoding)
+        except Exception:
+            # raw bodies (gallery uploads) carry their message as json in content_type
+            return json.loads(properties.content_type)
+
+
+class MemoryTransport(Transport):
+    """Transport on a MemoryBroker; publishing never blocks and confirms are implicit."""
+
+    def __init__(self, broker: MemoryBroker):
+        self.broker = broker
+        self.router = ReplyRouter()
+        self.router.reply_to = broker.declare_queue(self.router.on_response)
+
+    @property
+    def reply_to(self) -> str:
+        return self.router.reply_to
+
+    def register(self, corr_id: str, response_len: int) -> PendingReply:
+        return self.router.register(corr_id, response_len)
+
+    def alias(self, corr_id: str, pending: PendingReply):
+        self.router.alias(corr_id, pending)
+
+    def discard(self, corr_id: str, pending: PendingReply = None):
+        self.router.discard(corr_id, pending)
+
+    def send(self, properties: pika.BasicProperties, body, confirm: bool = False):
+        self.broker.publish(properties, body)
+
+    def publish(self, properties: pika.BasicProperties, body, confirm: bool = False):
+        self.broker.publish(properties, body)
+
+    def fanout(self, exchange_name: str, body):
+        self.broker.fanout(exchange_name, body)
+
+
+memory_broker = MemoryBroker()
+memory_transport = None
+memory_transport_lock = threading.Lock()
+
+
+def get_memory_transport() -> MemoryTransport:
+    global memory_transport
+    with memory_transport_lock:
+        if memory_transport is None:
+            memory_transport = MemoryTransport(memory_broker)
+        return memory_transport
@@ -0,0 +1,174 @@
+import logging
+import os
+import queue
+import threading
+from contextlib import contextmanager
+
+import pika
+
+from source.config import settings
+
+
+class PooledChannel:
+    """
+    A long-lived connection and channel used for publishing. Replies are not consumed here,
+    they go to the worker's shared reply queue (see reply_dispatcher.ReplyDispatcher).
+    With confirm the channel is in publisher confirms mode and basic_publish waits for the broker's ack.
+    """
+
+    def __init__(self, parameters: pika.ConnectionParameters, exchange_name: str, confirm: bool = False):
+        self.parameters = parameters
+        self.exchange_name = exchange_name
+        self.confirm = confirm
+        self.connection = None
+        self.channel = None
+        self.connect()
+
+    def connect(self):
+        # open connection and declare the headers exchange only once per pooled channel
+        self.connection = pika.BlockingConnection(self.parameters)
+        self.channel = self.connection.channel()
+        self.channel.exchange_declare(exchange=self.exchange_name, exchange_type='headers')
+        if self.confirm:
+            self.channel.confirm_delivery()
+
+    def is_open(self) -> bool:
+        return bool(self.connection and self.connection.is_open and self.channel and self.channel.is_open)
+
+    def health_check(self) -> bool:
+        # let pika notice a dropped connection before the channel is reused
+        if not self.is_open():
+            return False
+        try:
+            self.connection.process_data_events(time_limit=0)
+        except Exception as e:
+            logging.info(f"Pooled RabbitMQ channel is broken... {e}")
+            return False
+        return self.is_open()
+
+    def close(self):
+        try:
+            if self.connection and self.connection.is_open:
+                self.connection.close()
+        except Exception as e:
+            logging.info(f"Error closing pooled RabbitMQ connection... {e}")
+
+
+class ChannelPool:
+    """
+    Per-worker pool of PooledChannel objects. A channel is leased by one caller at a time,
+    health checked on lease and reconnected by the pool instead of by every request.
+    """
+
+    def __init__(
+            self,
+            exchange_name: str,
+            host: str,
+            port: int,
+            user: str,
+            password: str,
+            max_size: int = 20,
+            lease_timeout: float = 10,
+            connect_retries: int = 3,
+            confirm: bool = False
+    ):
+        self.exchange_name = exchange_name
+        self.confirm = confirm
+        self.parameters = pika.ConnectionParameters(
+            host=host,
+            port=port,
+            credentials=pika.PlainCredentials(user, password),
+            heartbeat=0,
+            blocked_connection_timeout=86400  # 86400 seconds = 24 hours
+        )
+        self.max_size = max_size
+        self.lease_timeout = lease_timeout
+        self.connect_retries = connect_retries
+        self.pid = os.getpid()
+        self.idle = queue.LifoQueue()
+        self.slots = threading.BoundedSemaphore(max_size)
+
+    def reset_after_fork(self):
+        # sockets inherited from the parent process must never be shared with a worker
+        if self.pid != os.getpid():
+            self.pid = os.getpid()
+            self.idle = queue.LifoQueue()
+            self.slots = threading.BoundedSemaphore(self.max_size)
+
+    def create(self) -> PooledChannel:
+        try_counter = 1
+        while True:
+            try:
+                return PooledChannel(self.parameters, self.exchange_name, self.confirm)
+            except Exception as e:
+                try_counter += 1
+                if try_counter > self.connect_retries:
+                    raise e
+
+    def acquire(self) -> PooledChannel:
+        self.reset_after_fork()
+        if not self.slots.acquire(timeout=self.lease_timeout):
+            raise TimeoutError(f"No free RabbitMQ channel in pool after {self.lease_timeout} seconds")
+        try:
+            while True:
+                try:
+                    pooled = self.idle.get_nowait()
+                except queue.Empty:
+                    return self.create()
+                if pooled.health_check():
+                    return pooled
+                pooled.close()
+        except Exception:
+            self.slots.release()
+            raise
+
+    def release(self, pooled: PooledChannel):
+        if pooled.is_open():
+            self.idle.put(pooled)
+        else:
+            pooled.close()
+        self.slots.release()
+
+    @contextmanager
+    def lease(self):
+        pooled = self.acquire()
+        try:
+            yield pooled
+        finally:
+            self.release(pooled)
+
+    def close(self):
+        while True:
+            try:
+                self.idle.get_nowait().close()
+            except queue.Empty:
+                break
+
+
+pools = dict()
+pools_lock = threading.Lock()
+
+
+def get_pool(exchange_name: str, host: str, port: int, user: str, password: str, confirm: bool = False) -> ChannelPool:
+    # one pool per exchange, broker and confirm mode in every worker process
+    key = (exchange_name, host, port, user, confirm)
+    with pools_lock:
+        if key not in pools:
+            pools[key] = ChannelPool(
+                exchange_name=exchange_name,
+                host=host,
+                port=port,
+                user=user,
+                password=password,
+                max_size=settings.RABBITMQ_POOL_SIZE,
+                lease_timeout=settings.RABBITMQ_POOL_TIMEOUT,
+                confirm=confirm
+            )
+        return pools[key]
+
+
+def close_pools():
+    with pools_lock:
+        for pool in pools.values():
+            pool.close()
+        pools.clear()
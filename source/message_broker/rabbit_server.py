@@ -1,14 +1,41 @@
-import datetime
 import json
-import signal
-import sys
+import logging
+import time
 import uuid
 
 import pika
 from pika.exceptions import StreamLostError
 
 from source.config import settings
-from source.helpers.exception_handler import ExceptionHandler
+from source.helpers.metrics import RPC_NOTIFICATIONS
+from source.helpers.request_context import add_downstream
+from source.helpers.tracing import RpcSpan, rpc_span
+from source.message_broker.async_rpc import async_rpc
+from source.message_broker.codecs import NEGOTIATION_HEADERS, encode_message
+from source.message_broker.actions import LANE_HEADER, QUERY, classify, delivery_mode, lane, observe, priority
+from source.message_broker.admission import Admission, admit
+from source.message_broker.batch import batch_envelope, batch_replies
+from source.message_broker.bulkhead import bulkhead
+from source.message_broker.hedging import hedger
+from source.message_broker.deadline import service_deadlines, expired_services, deadline_properties, timeout_error
+from source.message_broker.transport import get_transport
+from source.message_broker.single_flight import single_flight, coalesce_key
+from source.message_broker.circuit_breaker import (
+    get_breaker, open_circuits, unavailable_error, raise_unavailable, reject_open_circuits, record_replies
+)
+
+# the broker is unreachable or no channel/consumer got ready in time (TimeoutError of the pool and
+# the reply dispatcher): the services get a structured 503 each, like an open circuit
+BROKER_ERRORS = (
+    pika.exceptions.ConnectionClosed, pika.exceptions.ChannelClosed, pika.exceptions.ChannelWrongStateError,
+    StreamLostError, pika.exceptions.AMQPHeartbeatTimeout, pika.exceptions.AMQPConnectionError, TimeoutError
+)
+
+
+def unreachable(span: RpcSpan, services, error: Exception) -> dict:
+    logging.error(f"Publishing to {', '.join(services)} failed, RabbitMQ is unreachable... {error}")
+    span.outcome = "error"
+    return {service: unavailable_error(service) for service in services}
 
 
 class RabbitRPC:
@@ -23,135 +50,335 @@ class RabbitRPC:
         self.user = settings.RABBITMQ_USER if not local else "guest"
         self.password = settings.RABBITMQ_PASS if not local else "guest"
         self.exchange_name = exchange_name
-        self.credentials = pika.PlainCredentials(self.user, self.password)
-        self.connection = None
-        self.channel = None
-        self.connect()
-        self.broker_response = {}
         self.corr_id = None
         self.response_len = 0
         self.timeout = timeout
-        self.consume()
+
+    @property
+    def transport(self):
+        # looked up on use, module level clients are created before RPC_TRANSPORT may be switched
+        return get_transport(self.exchange_name, self.host, self.port, self.user, self.password)
 
     def __enter__(self):
         return self
 
     def __exit__(self, exc_type, exc_val, exc_tb):
-        self.connection.close()
+        # channels are returned to the pool after every publish, so nothing is left to close here
+        pass
 
     def connect(self):
-        # connect to rabbit with defined credentials
-        if not self.connection or self.connection.is_closed:
-            credentials = pika.PlainCredentials(self.user, self.password)
-            try_counter = 1
-            while True:
-                try:
-                    self.connection = pika.BlockingConnection(
-                        pika.ConnectionParameters(
-                            host=self.host,
-                            port=self.port,
-                            credentials=self.credentials,
-                            heartbeat=0,
-                            blocked_connection_timeout=86400  # 86400 seconds = 24 hours
-                        )
-                    )
-                    break
-                except Exception as e:
-                    try_counter += 1
-                    if try_counter > 3:
-                        raise e
-            # self.connection.sleep(1)
-            self.channel = self.connection.channel()
-            self.channel.exchange_declare(exchange=self.exchange_name, exchange_type='headers')
-            self.queue_result = self.channel.queue_declare(queue="", exclusive=True)
-            self.callback_queue = self.queue_result.method.queue
-            if self.channel_is_closed():
-                self.connect()
+        # connections live in the worker's channel pool; kept for callers that still call it explicitly
+        pass
 
     def fanout_publish(self, exchange_name: str, message: dict):
         # publish to all services
-        self.channel.exchange_declare(exchange=exchange_name, exchange_type='fanout', passive=True)
-        self.channel.basic_publish(
-            exchange=exchange_name,
-            routing_key='',
-            body=json.dumps(message)
-        )
-
-    def channel_is_closed(self):
-        return self.channel.is_closed
+        self.transport.fanout(exchange_name, json.dumps(message))
 
     def response_len_setter(self, response_len: int):
         # response length setter for timeout handler
         self.response_len = response_len
         self.corr_id = str(uuid.uuid4())
 
-    def publish(self, message: dict, headers: dict, extra_data: str = None):
-        # publish message with given message and headers
-        if self.channel_is_closed():
-            self.connect()
-            self.publish(message=message, headers=headers, extra_data=extra_data)
+    def send_request(self, corr_id: str, message, headers: dict, extra_data: str = None, deadlines: dict = None,
+                     span: RpcSpan = None):
+        # publish on the headers exchange, replies reach the worker's reply consumer under corr_id.
+        # queries go out transient, commands persistent on a channel with publisher confirms;
+        # bulk messages get a lower priority than interactive ones; span's trace goes in the headers
+        kind = classify(message)
+        observe(message, kind)
+        message_lane = lane(message)
+        expiration = None
+        if deadlines:
+            expiration, headers = deadline_properties(headers, deadlines)
+        headers = dict(headers, **NEGOTIATION_HEADERS, **{LANE_HEADER: message_lane})
+        body, content_type, content_encoding = encode_message(message, extra_data)
+        if span is not None:
+            headers = span.headers(headers)
+            span.published(len(body))
+        self.transport.send(
+            pika.BasicProperties(
+                reply_to=self.transport.reply_to,
+                correlation_id=corr_id,
+                delivery_mode=delivery_mode(kind),
+                priority=priority(message_lane),
+                content_type=content_type,
+                content_encoding=content_encoding,
+                expiration=expiration,
+                headers=headers
+            ),
+            body,
+            confirm=kind != QUERY
+        )
+
+    def notify(self, message: dict, headers: dict, extra_data: str = None):
+        """
+        fire-and-forget publish for side effects nobody waits for (sms, logs, cart cleanup):
+        no reply_to, returns immediately and the worker's notifier publishes it with batched
+        publisher confirms. Without a running notifier it is published right here on a confirmed channel.
+        """
+        if async_rpc.notify(message, headers, extra_data):
+            return
+        RPC_NOTIFICATIONS.labels(result="fallback").inc()
+        body, content_type, content_encoding = encode_message(message, extra_data)
+        self.transport.publish(
+            pika.BasicProperties(
+                delivery_mode=pika.spec.PERSISTENT_DELIVERY_MODE,
+                priority=priority(lane(message)),
+                content_type=content_type,
+                content_encoding=content_encoding,
+                headers=headers
+            ),
+            body,
+            confirm=True
+        )
+
+    def publish(self, message: dict, headers: dict, extra_data: str = None, timeout: float = None):
+        """
+        publish message with given message and headers and wait for the replies (see request).
+        Identical concurrent reads of an action listed in RPC_COALESCE_ACTIONS share one
+        broker round-trip and each caller gets its own copy of the reply.
+        """
+        key = coalesce_key(message, headers, extra_data) if self.response_len == 1 else None
+        if key is None:
+            return self.request(message, headers, extra_data, timeout)
+        started = time.monotonic()
+        deadline = service_deadlines(headers, timeout or self.timeout, started)[key[0]]
         try:
-            self.channel.basic_publish(
-                exchange=self.exchange_name,
-                routing_key='',
-                properties=pika.BasicProperties(
-                    reply_to=self.callback_queue,
-                    correlation_id=self.corr_id,
-                    delivery_mode=pika.spec.PERSISTENT_DELIVERY_MODE,
-                    content_type=extra_data,
-                    headers=headers
-                ),
-                body=json.dumps(message) if isinstance(message, dict) else message
+            return single_flight.do(
+                key,
+                lambda: self.request(message, headers, extra_data, timeout),
+                deadline - started
             )
-            print("message sent...")
-            started = datetime.datetime.now()
-            timed_out = False
-            while len(self.broker_response) < self.response_len:
-                if (datetime.datetime.now() - started).total_seconds() > 10 and not timed_out:
-                    print(f"timeout {message}")
-                    timed_out = True
-                self.connection.process_data_events()
-            result = self.broker_response.copy()
-            self.broker_response.clear()
-            return result
-        except (pika.exceptions.ConnectionClosed, pika.exceptions.ChannelClosed,
-                pika.exceptions.ChannelWrongStateError, StreamLostError, pika.exceptions.AMQPHeartbeatTimeout,
-                pika.exceptions.AMQPConnectionError) as error:
-            sys.stdout.write("\033[1;31m")
-            print("        !!! ERROR !!!       =================== Pika Exception raised: ", end="")
-            sys.stdout.write("\033[;1m\033[1;31m")
-            print(error, " ========================     ")
-            self.connect()
-        except Exception as e:
-            sys.stdout.write("\033[1;31m")
-            print("        !!! ERROR !!!       =================== Unknown Exception raised: ", end="")
-            sys.stdout.write("\033[;1m\033[1;31m")
-            print(e, " ========================     ")
-            self.connect()
-
-    def on_response(self, channel, method, properties, body):
-        if self.corr_id == properties.correlation_id:
-            print("message received...")
-            key = next(iter(json.loads(body)))
-            self.broker_response[key] = json.loads(body).get(key)
+        except TimeoutError:
+            return {key[0]: self.timeout_error(key[0], deadline - started)}
+
+    def request(self, message: dict, headers: dict, extra_data: str = None, timeout: float = None):
+        """
+        publish message with given message and headers, replies come back through the worker's reply consumer.
+        Waits at most timeout seconds (default: the constructor timeout, overridden per service by
+        RPC_SERVICE_TIMEOUTS and capped by the HTTP request's remaining budget); services that miss
+        their deadline get a timeout_error entry in the result. The deadline travels with the message
+        as expiration and x-deadline header.
+        Raises HTTPException 503 right away if the circuit of one of the services is open, if a
+        bulk call found no slot under RPC_BULK_CONCURRENCY in time, or (with Retry-After) if a
+        service has more calls in flight than its adaptive limit and queue allow.
+        While RabbitMQ cannot be reached every service gets an unavailable_error (503) entry;
+        any other exception propagates.
+        Every call is traced as an RpcSpan of the HTTP request it serves.
+        """
+        with rpc_span(message, headers) as span:
+            if not self.response_len:
+                return self.round_trip(span, message, headers, extra_data, timeout)
+            reject_open_circuits(headers)
+            with bulkhead.slot(message), admit(headers, lane(message)) as admission:
+                return self.round_trip(span, message, headers, extra_data, timeout, admission)
+
+    def round_trip(self, span: RpcSpan, message: dict, headers: dict, extra_data: str = None, timeout: float = None,
+                   admission: Admission = None):
+        corr_id = self.corr_id
+        hedge_id = None
+        awaited = False
+        try:
+            pending = self.transport.register(corr_id, self.response_len) if self.response_len else None
+            try:
+                deadlines = None
+                if pending is not None:
+                    deadlines = service_deadlines(headers, timeout or self.timeout, pending.started)
+                    if expired_services(deadlines) == list(deadlines):
+                        # the HTTP request's budget is already spent, nobody would wait for the replies
+                        span.outcome = "timeout"
+                        return {service: self.timeout_error(service, 0) for service in headers}
+                self.send_request(corr_id, message, headers, extra_data, deadlines, span)
+                logging.debug(f"Message {corr_id} sent to {', '.join(headers)}")
+                if pending is None:
+                    return {}
+                hedge_key = hedger.key(message, headers)
+                if hedge_key is not None:
+                    for awaited_id, awaited_pending in hedger.collect():
+                        self.transport.discard(awaited_id, awaited_pending)
+                    hedge_id = self.hedge(hedge_key, pending, message, headers, extra_data, deadlines, span)
+                late_services = pending.wait_until(deadlines)
+                if hedge_key is not None and not late_services:
+                    # a first attempt beaten by its hedge stays registered until it replied
+                    awaited = not hedger.observe_primary(hedge_key, pending, corr_id, deadlines[hedge_key[0]])
+                record_replies(pending, deadlines, late_services, lane(message))
+                if admission is not None:
+                    admission.record(pending, deadlines, late_services)
+                result = pending.result()
+                for service in late_services:
+                    result[service] = self.timeout_error(service, deadlines[service] - pending.started)
+                span.replies(result)
+                logging.debug(f"Replies of message {corr_id} received")
+                return result
+            finally:
+                if pending is not None:
+                    if not awaited:
+                        self.transport.discard(corr_id)
+                    add_downstream(time.monotonic() - pending.started)
+                    span.received(pending.size)
+                if hedge_id is not None:
+                    self.transport.discard(hedge_id)
+        except BROKER_ERRORS as error:
+            return unreachable(span, headers, error)
+
+    def hedge(self, key: tuple, pending, message: dict, headers: dict, extra_data: str, deadlines: dict,
+              span: RpcSpan):
+        """
+        wait for the reply up to the hedge delay of its action, then publish the message again
+        under a new correlation id routed to the same pending reply; returns that id, None if
+        the reply came in time or the hedge budget is spent.
+        """
+        delay = hedger.delay(key)
+        if delay is None or delay >= deadlines[key[0]] - time.monotonic() or pending.wait(delay):
+            return None
+        if not hedger.spend(key):
+            return None
+        hedge_id = str(uuid.uuid4())
+        self.transport.alias(hedge_id, pending)
+        span.attributes["gateway.hedged"] = True
+        self.send_request(hedge_id, message, headers, extra_data, deadlines, span)
+        return hedge_id
+
+    def scatter(self, message: dict, headers: dict, optional: tuple = (), timeouts: dict = None,
+                extra_data: str = None):
+        """
+        publish one message to several services and yield (service, reply) as each reply arrives,
+        so handlers can start dependent work before the slowest service answered.
+        timeouts overrides the deadline of single services (e.g. a short one for an optional service).
+        A service that misses its deadline yields a timeout_error; for services listed in optional
+        it is also marked "optional": True so handlers can degrade instead of failing.
+        An open circuit raises HTTPException 503 for a required service; an optional one is not
+        called and yields an unavailable error marked optional. A service over its admission limit
+        raises HTTPException 503 with Retry-After. While RabbitMQ cannot be reached every service
+        yields an unavailable error.
+        Stop iterating (or raise) at any time, late replies are simply dropped.
+        """
+        with rpc_span(message, headers) as span:
+            yield from self.scatter_replies(span, message, headers, optional, timeouts, extra_data)
+
+    def scatter_replies(self, span: RpcSpan, message: dict, headers: dict, optional: tuple, timeouts: dict,
+                        extra_data: str):
+        rejected = open_circuits(headers)
+        required = [service for service in rejected if service not in optional]
+        if required:
+            raise_unavailable(required[0])
+        headers = {service: value for service, value in headers.items() if service not in rejected}
+        for service in rejected:
+            yield service, dict(unavailable_error(service), optional=True)
+        if not headers:
+            return
+        message_lane = lane(message)
+        corr_id = str(uuid.uuid4())
+        admission = pending = None
+        replies = dict()
+        try:
+            admission = admit(headers, message_lane)
+            try:
+                pending = self.transport.register(corr_id, len(headers))
+                deadlines = service_deadlines(headers, self.timeout, pending.started, timeouts)
+                self.send_request(corr_id, message, headers, extra_data, deadlines, span)
+            except BROKER_ERRORS as error:
+                for service, reply in unreachable(span, headers, error).items():
+                    if service in optional:
+                        reply["optional"] = True
+                    replies[service] = reply
+                    yield service, reply
+                return
+            waiting = set(deadlines)
+            while waiting:
+                arrived, expired = pending.wait_any(deadlines, waiting)
+                for service, reply in arrived.items():
+                    waiting.discard(service)
+                    record_replies(pending, {service: deadlines[service]}, [], message_lane)
+                    admission.record(pending, {service: deadlines[service]}, [])
+                    replies[service] = reply
+                    yield service, reply
+                for service in expired:
+                    waiting.discard(service)
+                    get_breaker(service).record(False, deadlines[service] - pending.started)
+                    admission.record(pending, {service: deadlines[service]}, [service])
+                    reply = self.timeout_error(service, deadlines[service] - pending.started)
+                    if service in optional:
+                        reply["optional"] = True
+                    replies[service] = reply
+                    yield service, reply
+        finally:
+            self.transport.discard(corr_id)
+            if admission is not None:
+                admission.release()
+            if pending is not None:
+                add_downstream(time.monotonic() - pending.started)
+                span.received(pending.size)
+            span.replies(replies)
+
+    def batch(self, service: str, requests: list, timeout: float = None) -> list:
+        """
+        send requests ({"action": ..., "body": ...} dicts) to one service and return their replies in
+        the same order, in one round-trip instead of one per request. Services listed in
+        RPC_BATCH_SERVICES get them in batch envelopes of up to RPC_BATCH_SIZE requests, each answered
+        by one reply listing the N results; any other service gets one message per request, all
+        published before waiting. A request left without reply gets a timeout_error, every request an
+        unavailable_error while RabbitMQ cannot be reached.
+        Raises HTTPException 503 like request does (open circuit, admission limit).
+        """
+        if not requests:
+            return []
+        with rpc_span({service: requests[0]}, [service]) as span:
+            span.attributes["rpc.batch_size"] = len(requests)
+            return self.send_batch(span, service, requests, timeout)
+
+    def send_batch(self, span: RpcSpan, service: str, requests: list, timeout: float = None) -> list:
+        reject_open_circuits([service])
+        enveloped = service in settings.RPC_BATCH_SERVICES
+        if enveloped:
+            size = settings.RPC_BATCH_SIZE
+            chunks = [requests[i:i + size] for i in range(0, len(requests), size)]
+            messages = [{service: batch_envelope(chunk)} for chunk in chunks]
+        else:
+            chunks = [[request] for request in requests]
+            messages = [{service: request} for request in requests]
+        headers = {service: True}
+        message_lane = lane(messages[0])
+        with bulkhead.slot(messages[0]), admit(headers, message_lane) as admission:
+            pendings = [(str(uuid.uuid4()), message) for message in messages]
+            started = time.monotonic()
+            deadlines = service_deadlines(headers, timeout or self.timeout, started)
+            registered = list()
+            try:
+                try:
+                    for corr_id, message in pendings:
+                        registered.append(self.transport.register(corr_id, 1))
+                        self.send_request(corr_id, message, headers, None, deadlines, span)
+                except BROKER_ERRORS as error:
+                    reply = unreachable(span, headers, error)[service]
+                    return [dict(reply) for _ in requests]
+                replies = list()
+                for pending, chunk in zip(registered, chunks):
+                    late_services = pending.wait_until(deadlines)
+                    record_replies(pending, deadlines, late_services, message_lane)
+                    admission.record(pending, deadlines, late_services)
+                    if late_services:
+                        reply = self.timeout_error(service, deadlines[service] - started)
+                    else:
+                        reply = pending.result()[service]
+                    replies.extend(batch_replies(reply, len(chunk)) if enveloped else [reply])
+                span.replies(dict(enumerate(replies)))
+                return replies
+            finally:
+                for corr_id, _ in pendings:
+                    self.transport.discard(corr_id)
+                add_downstream(time.monotonic() - started)
+                span.received(sum(pending.size for pending in registered))
 
     def consume(self):
-        self.channel.basic_consume(on_message_callback=self.on_response, queue=self.callback_queue, auto_ack=True)
+        # replies are consumed once per worker by the reply dispatcher
+        pass
 
-    def timeout_handler(self, signum, frame):
-        # manual handler for not taking response from consumers according to timeout
-        signal.alarm(0)
-        self.response_len = 0
-        self.broker_response = {"error": "One or more services is not responding", "status_code": 408}
-        exc_handler = ExceptionHandler(message="One or more services is not responding")
-        exc_handler.logger()
-        exc_handler.send_sms()
+    timeout_error = staticmethod(timeout_error)
 
 
 if __name__ == '__main__':
     rpc = RabbitRPC(exchange_name='test_exchange', timeout=5)
-    rpc.connect()
-    rpc.consume()
     rpc.response_len_setter(response_len=1)
     test_result = rpc.publish(
         message={
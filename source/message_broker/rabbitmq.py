@@ -1,4 +1,3 @@
-import datetime
 import json
 import logging
 import time
@@ -8,7 +7,16 @@ import pika
 from fastapi import HTTPException
 
 from source.config import settings
+from source.helpers.request_context import add_downstream
 from source.helpers.saga_pattern import Saga
+from source.helpers.tracing import RpcSpan, rpc_span
+from source.message_broker.codecs import NEGOTIATION_HEADERS, encode_message
+from source.message_broker.actions import LANE_HEADER, QUERY, classify, delivery_mode, lane, observe, priority
+from source.message_broker.admission import Admission, admit
+from source.message_broker.bulkhead import bulkhead
+from source.message_broker.deadline import service_deadlines, deadline_properties
+from source.message_broker.transport import get_transport
+from source.message_broker.circuit_breaker import reject_open_circuits, record_replies
 
 
 class Singleton(type):
@@ -21,6 +29,11 @@ class Singleton(type):
 
 
 class RabbitRPC(metaclass=Singleton):
+    """
+    Process-wide RPC client. All per-request state (correlation id, replies, saga) lives in
+    the publish call itself, so concurrent threads can share the singleton safely.
+    """
+
     def __init__(
             self,
             exchange_name: str,
@@ -31,157 +44,137 @@ class RabbitRPC(metaclass=Singleton):
         self.user = settings.RABBITMQ_USER
         self.password = settings.RABBITMQ_PASS
         self.exchange_name = exchange_name
-        self.publish_connection, self.publish_channel, self.callback_queue = self.connect()
-        self.broker_response = {}
-        self.corr_id = None
-        self.response_len = 0
         self.timeout = timeout
-        self.saga = Saga()
-        self.consume()
-
-    def connect(self):
-        # connect to rabbit with defined credentials
-        credentials = pika.PlainCredentials(self.user, self.password)
-        try_count = 0
-        while True:
-            try_count += 1
-            try:
-                connection = pika.BlockingConnection(
-                    pika.ConnectionParameters(host=self.host,
-                                              port=self.port,
-                                              credentials=credentials)
-                )
-                channel = connection.channel()
-                channel.exchange_declare(exchange=self.exchange_name, exchange_type='headers')
-                queue_result = channel.queue_declare(queue="", exclusive=True)
-                return connection, channel, queue_result.method.queue
-            except Exception as e:
-                logging.info(f"Error connecting to RabbitMQ... {e}")
-                print(f"{datetime.datetime.now()} - Error connecting to pika...{e}")
-                if try_count > 1000:
-                    raise e
-                time.sleep(1)
+
+    @property
+    def transport(self):
+        # looked up on use, module level clients are created before RPC_TRANSPORT may be switched
+        return get_transport(self.exchange_name, self.host, self.port, self.user, self.password)
 
     def fanout_publish(self, exchange_name: str, message: dict):
         # publish to all services
-        self.publish_channel.exchange_declare(exchange=exchange_name, exchange_type='fanout', passive=True)
-        self.publish_channel.basic_publish(
-            exchange=exchange_name,
-            routing_key='',
-            body=json.dumps(message)
-        )
-
-    def publish_pre_requisite(self, message: list, saga: bool):
+        self.transport.fanout(exchange_name, json.dumps(message))
+
+    @staticmethod
+    def publish_pre_requisite(message: list, saga: Saga = None):
         messages = dict()
         for i in message:
             messages.update(i)
         if saga:
-            self.saga.add(messages)
-        self.response_len = len(messages)
-        self.corr_id = str(uuid.uuid4())
+            saga.add(messages)
         return messages
 
-    def publish_response_handler(self, messages: dict, saga: bool, compensate: bool = False):
-        if len(self.broker_response) < self.response_len:
-            bad_services = list(messages.keys() - self.broker_response.keys())
+    def compensate(self, saga: Saga):
+        stack = saga.compensate()
+        for _ in range(len(stack)):
+            item = stack.pop()
+            self.publish(message=[item], compensate=True)
+        saga.finish()
+
+    def publish_response_handler(self, messages: dict, responses: dict, saga: Saga = None, compensate: bool = False):
+        if len(responses) < len(messages):
+            bad_services = list(messages.keys() - responses.keys())
             logging.info(f"Timeout waiting for response... services: {', '.join(bad_services)}")
             if saga:
-                self.saga.remove(bad_services)
-                stack = self.saga.compensate()
-                for _ in range(len(stack)):
-                    item = stack.pop()
-                    self.publish(message=[item], compensate=True)
-                self.saga.finish()
-
-            self.broker_response.clear()
+                saga.remove(bad_services)
+                self.compensate(saga)
             raise HTTPException(
                 status_code=500,
                 detail={"error": f"{', '.join(bad_services)} does not respond..."}
             )
         else:
             result = list()
-            error_services = [i for i in messages.keys() if not self.broker_response.get(i).get("success")]
+            error_services = [i for i in messages.keys() if not responses.get(i).get("success")]
             if len(error_services):
                 if saga:
-                    self.saga.remove(error_services)
-                    stack = self.saga.compensate()
-                    for _ in range(len(stack)):
-                        item = stack.pop()
-                        self.publish(message=[item], compensate=True)
-                    self.saga.finish()
-
-                status_code = self.broker_response.get(error_services[0]).get("status_code", 500)
-                error = self.broker_response.get(error_services[0]).get("error", "Something went wrong...")
-                self.broker_response.clear()
+                    saga.remove(error_services)
+                    self.compensate(saga)
+
+                status_code = responses.get(error_services[0]).get("status_code", 500)
+                error = responses.get(error_services[0]).get("error", "Something went wrong...")
                 raise HTTPException(
                     status_code=status_code,
                     detail=error
                 )
+            if saga:
+                # committed, nothing is left to compensate
+                saga.finish()
             for i in messages.keys():
-                result.append(self.broker_response.get(i, {}))
+                result.append(responses.get(i, {}))
             result = result[0] if len(result) == 1 else result
-            self.broker_response.clear()
             return result
 
     def publish(self, message: list, extra_data: str = None, saga: bool = False, compensate: bool = False):
+        saga = Saga() if saga else None
         messages = self.publish_pre_requisite(message, saga)
-        try_count = 0
-        while True:
-            try_count += 1
-            try:
-                self.publish_channel.basic_publish(
-                    exchange=self.exchange_name,
-                    routing_key='',
-                    properties=pika.BasicProperties(
-                        reply_to=self.callback_queue,
-                        correlation_id=self.corr_id,
-                        delivery_mode=pika.spec.PERSISTENT_DELIVERY_MODE,
-                        content_type=extra_data,
-                        headers={i: True for i in messages.keys()}
-                    ),
-                    body=json.dumps(messages) if isinstance(messages, dict) else messages
-                )
-                break
-            except Exception as e:
-                logging.info(f"Error publishing to RabbitMQ... {e}")
-                if try_count > 3:
-                    raise e
-                self.publish_connection, self.publish_channel, self.callback_queue = self.connect()
-                self.consume()
-        started = datetime.datetime.now()
-        while (len(self.broker_response) < self.response_len) and (
-                (datetime.datetime.now() - started).total_seconds()) < self.timeout:
-            try:
-                self.publish_connection.process_data_events()
-            except Exception as e:
-                logging.info(f"Error consuming from RabbitMQ... {e}")
-                self.publish_connection, self.publish_channel, self.callback_queue = self.connect()
-                self.consume()
-        return self.publish_response_handler(messages, saga, compensate)
-
-    def compensate_actions(self):
-        items = self.saga.startup_action()
-
-    def on_response(self, channel, method, properties, body):
-        if self.corr_id == properties.correlation_id:
-            # print("message received...")
-            logging.info("Message received...")
-            print(f"{datetime.datetime.now()} - Message received...")
-            key = next(iter(json.loads(body)))
-            self.broker_response[key] = json.loads(body).get(key)
-
-    def consume(self):
-        try_count = 0
-        while True:
-            try:
+        with rpc_span(messages, messages) as span:
+            responses = self.round_trip(span, messages, extra_data, compensate)
+        return self.publish_response_handler(messages, responses, saga, compensate)
+
+    def round_trip(self, span: RpcSpan, messages: dict, extra_data: str = None, compensate: bool = False) -> dict:
+        if not compensate:
+            # compensations are always attempted, even against a service whose circuit is open
+            reject_open_circuits(messages)
+        corr_id = str(uuid.uuid4())
+        transport = self.transport
+        pending = transport.register(corr_id, len(messages))
+        deadlines = service_deadlines(messages, self.timeout, pending.started)
+        expiration, headers = deadline_properties({i: True for i in messages.keys()}, deadlines)
+        message_lane = lane(messages)
+        headers.update(NEGOTIATION_HEADERS, **{LANE_HEADER: message_lane})
+        headers = span.headers(headers)
+        body, content_type, content_encoding = encode_message(messages, extra_data)
+        kind = classify(messages)
+        observe(messages, kind)
+        admission = Admission()
+        bulk = False
+        try:
+            bulk = bulkhead.acquire(messages)
+            if not compensate:
+                admission = admit(messages, message_lane)
+            span.published(len(body))
+            try_count = 0
+            while True:
                 try_count += 1
-                self.publish_channel.basic_consume(on_message_callback=self.on_response, queue=self.callback_queue,
-                                                   auto_ack=True)
-                break
-            except Exception as e:
-                if try_count > 100:
-                    raise e
-                self.publish_connection, self.publish_channel, self.callback_queue = self.connect()
+                try:
+                    transport.send(
+                        pika.BasicProperties(
+                            reply_to=transport.reply_to,
+                            correlation_id=corr_id,
+                            delivery_mode=delivery_mode(kind),
+                            priority=priority(message_lane),
+                            content_type=content_type,
+                            content_encoding=content_encoding,
+                            expiration=expiration,
+                            headers=headers
+                        ),
+                        body,
+                        confirm=kind != QUERY
+                    )
+                    break
+                except Exception as e:
+                    logging.info(f"Error publishing to RabbitMQ... {e}")
+                    if try_count > 3:
+                        raise e
+            late_services = pending.wait_until(deadlines)
+            record_replies(pending, deadlines, late_services, message_lane)
+            admission.record(pending, deadlines, late_services)
+            responses = pending.result()
+        finally:
+            transport.discard(corr_id)
+            admission.release()
+            add_downstream(time.monotonic() - pending.started)
+            span.received(pending.size)
+            if bulk:
+                bulkhead.release()
+        span.replies(responses, expected=messages)
+        return responses
+
+    @staticmethod
+    def compensate_actions(workers: int = None) -> dict:
+        # compensate the sagas a crashed gateway left behind
+        from source.helpers.saga_recovery import SagaRecovery
+        return SagaRecovery(new_rpc, workers).run()
 
 
 new_rpc = RabbitRPC(exchange_name='headers_exchange', timeout=10)
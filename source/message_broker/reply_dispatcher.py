@@ -0,0 +1,226 @@
+import logging
+import os
+import threading
+import time
+
+import pika
+
+from source.config import settings
+from source.message_broker.codecs import decode_reply
+
+DIRECT_REPLY_TO = "amq.rabbitmq.reply-to"
+
+
+class PendingReply:
+    """
+    Replies collected for one correlation_id. Filled by the dispatcher thread and
+    awaited by the request thread that published the message.
+    """
+
+    def __init__(self, corr_id: str, response_len: int):
+        self.corr_id = corr_id
+        self.response_len = response_len
+        self.responses = dict()
+        self.arrived = dict()
+        # bytes of the replies as received, hedged duplicates included
+        self.size = 0
+        # when the first reply under each correlation id arrived; hedged copies have ids of their own
+        self.replied = dict()
+        self.condition = threading.Condition()
+        self.started = time.monotonic()
+
+    def add(self, key: str, value, size: int = 0, corr_id: str = None):
+        with self.condition:
+            self.size += size
+            if corr_id is not None:
+                self.replied.setdefault(corr_id, time.monotonic())
+            if key in self.responses:
+                return
+            self.responses[key] = value
+            self.arrived[key] = time.monotonic()
+            self.condition.notify_all()
+
+    def done(self) -> bool:
+        return len(self.responses) >= self.response_len
+
+    def wait(self, timeout: float = None) -> bool:
+        with self.condition:
+            return self.condition.wait_for(self.done, timeout)
+
+    def wait_until(self, deadlines: dict) -> list:
+        """
+        block without polling until every reply arrived or each missing service passed its
+        own deadline (time.monotonic() based); returns the services that did not answer in time.
+        """
+        with self.condition:
+            while not self.done():
+                missing = [service for service in deadlines if service not in self.responses]
+                remaining = max((deadlines[service] for service in missing), default=0) - time.monotonic()
+                if remaining <= 0:
+                    return missing
+                self.condition.wait(remaining)
+            return []
+
+    def wait_any(self, deadlines: dict, services) -> tuple:
+        """
+        block until at least one of services replied or passed its deadline;
+        returns the replies that arrived and the services that expired meanwhile.
+        """
+        with self.condition:
+            while True:
+                arrived = {service: self.responses[service] for service in services if service in self.responses}
+                now = time.monotonic()
+                expired = [service for service in services if service not in arrived and deadlines[service] <= now]
+                if arrived or expired:
+                    return arrived, expired
+                self.condition.wait(min(deadlines[service] for service in services) - now)
+
+    def result(self) -> dict:
+        with self.condition:
+            return self.responses.copy()
+
+    def replied_at(self, corr_id: str):
+        with self.condition:
+            return self.replied.get(corr_id)
+
+
+class ReplyRouter:
+    """
+    Routes replies to the PendingReply registered under their correlation_id.
+    Shared by every transport that consumes replies (see transport.Transport).
+    """
+
+    def __init__(self):
+        self.reply_to = None
+        self.pending = dict()
+        self.lock = threading.Lock()
+
+    def register(self, corr_id: str, response_len: int) -> PendingReply:
+        pending = PendingReply(corr_id, response_len)
+        with self.lock:
+            self.pending[corr_id] = pending
+        return pending
+
+    def alias(self, corr_id: str, pending: PendingReply):
+        # replies under corr_id also go to pending, the first reply of each service wins
+        with self.lock:
+            self.pending[corr_id] = pending
+
+    def discard(self, corr_id: str, pending: PendingReply = None):
+        # given pending, only if corr_id still routes to it: the id may have been registered again since
+        with self.lock:
+            if pending is None or self.pending.get(corr_id) is pending:
+                self.pending.pop(corr_id, None)
+
+    def on_response(self, channel, method, properties, body):
+        with self.lock:
+            pending = self.pending.get(properties.correlation_id)
+        if pending is None:
+            # late reply of a request that already returned
+            return
+        key, value = next(iter(decode_reply(body, properties.content_type, properties.content_encoding).items()))
+        pending.add(key, value, len(body), properties.correlation_id)
+
+
+class ReplyDispatcher(ReplyRouter):
+    """
+    Single reply consumer per worker. A daemon thread owns the consuming connection and
+    routes every reply to the PendingReply registered under its correlation_id, so any
+    number of request threads can share it without declaring reply queues per request.
+    With direct_reply_to the pseudo queue amq.rabbitmq.reply-to is used and no queue is
+    created at all; messages must then be published on the consuming channel (see send).
+    """
+
+    def __init__(self, host: str, port: int, user: str, password: str, direct_reply_to: bool = False):
+        super().__init__()
+        self.parameters = pika.ConnectionParameters(
+            host=host,
+            port=port,
+            credentials=pika.PlainCredentials(user, password),
+            heartbeat=0,
+            blocked_connection_timeout=86400  # 86400 seconds = 24 hours
+        )
+        self.direct_reply_to = direct_reply_to
+        self.connection = None
+        self.channel = None
+        self.ready = threading.Event()
+        self.thread = None
+
+    def start(self, timeout: float = 10):
+        # start the consumer thread lazily and wait until the reply queue is consuming
+        with self.lock:
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(target=self.run, name="rabbitmq-reply-dispatcher", daemon=True)
+                self.thread.start()
+        if not self.ready.wait(timeout):
+            raise TimeoutError(f"RabbitMQ reply consumer is not ready after {timeout} seconds")
+
+    def connect(self):
+        self.connection = pika.BlockingConnection(self.parameters)
+        self.channel = self.connection.channel()
+        if self.direct_reply_to:
+            self.reply_to = DIRECT_REPLY_TO
+        else:
+            self.reply_to = self.channel.queue_declare(queue="", exclusive=True).method.queue
+        self.channel.basic_consume(on_message_callback=self.on_response, queue=self.reply_to, auto_ack=True)
+
+    def run(self):
+        while True:
+            try:
+                self.connect()
+                self.ready.set()
+                while self.connection.is_open:
+                    self.connection.process_data_events(time_limit=1)
+            except Exception as e:
+                logging.info(f"Reply consumer lost RabbitMQ connection... {e}")
+            self.ready.clear()
+            time.sleep(1)
+
+    def send(self, pool, exchange: str, properties: pika.BasicProperties, body, timeout: float = 10):
+        """
+        publish a message whose replies must reach this consumer. With a shared reply queue
+        any pooled channel can publish; direct reply-to only works on the consuming channel,
+        so the message is handed over to the dispatcher thread.
+        """
+        if not self.direct_reply_to:
+            with pool.lease() as pooled:
+                pooled.channel.basic_publish(exchange=exchange, routing_key='', properties=properties, body=body)
+            return
+
+        done = threading.Event()
+        errors = list()
+
+        def basic_publish():
+            try:
+                self.channel.basic_publish(exchange=exchange, routing_key='', properties=properties, body=body)
+            except Exception as e:
+                errors.append(e)
+            finally:
+                done.set()
+
+        self.connection.add_callback_threadsafe(basic_publish)
+        if not done.wait(timeout):
+            raise TimeoutError(f"Publishing through reply consumer took more than {timeout} seconds")
+        if errors:
+            raise errors[0]
+
+
+dispatchers = dict()
+dispatchers_lock = threading.Lock()
+
+
+def get_dispatcher(host: str, port: int, user: str, password: str) -> ReplyDispatcher:
+    # one reply consumer per broker in every worker process
+    key = (os.getpid(), host, port, user)
+    with dispatchers_lock:
+        if key not in dispatchers:
+            dispatchers[key] = ReplyDispatcher(
+                host=host,
+                port=port,
+                user=user,
+                password=password,
+                direct_reply_to=settings.RABBITMQ_DIRECT_REPLY_TO
+            )
+        dispatcher = dispatchers[key]
+    dispatcher.start()
+    return dispatcher
@@ -0,0 +1,88 @@
+import copy
+import json
+import threading
+
+from source.config import settings
+from source.helpers.metrics import RPC_COALESCED
+
+
+class Flight:
+    """
+    One broker round-trip in progress. The leader fills result (or error) and one copy of it
+    per follower before setting done, so nobody mutates a reply another request is reading.
+    """
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.followers = 0
+        self.copies = list()
+
+
+class SingleFlight:
+    """
+    Collapses concurrent identical calls into one: the first caller of a key runs the call,
+    callers arriving while it is in flight wait for its result instead of publishing again.
+    Nothing is cached, the key is forgotten as soon as the leader has its reply.
+    """
+
+    def __init__(self):
+        self.flights = dict()
+        self.lock = threading.Lock()
+
+    def do(self, key: tuple, call, timeout: float):
+        """
+        run call() once for all concurrent callers of key; followers give up after timeout
+        seconds with TimeoutError, exceptions of the leader are raised in every caller.
+        """
+        with self.lock:
+            flight = self.flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self.flights[key] = Flight()
+            else:
+                flight.followers += 1
+                RPC_COALESCED.labels(service=key[0], action=key[1]).inc()
+        if leader:
+            try:
+                flight.result = call()
+            except Exception as e:
+                flight.error = e
+                raise
+            finally:
+                with self.lock:
+                    self.flights.pop(key, None)
+                if flight.error is None:
+                    flight.copies = [copy.deepcopy(flight.result) for _ in range(flight.followers)]
+                flight.done.set()
+            return flight.result
+        if not flight.done.wait(max(timeout, 0)):
+            raise TimeoutError(f"{key[0]} {key[1]} call in flight did not finish in time")
+        if flight.error is not None:
+            raise flight.error
+        return flight.copies.pop()
+
+
+def coalesce_key(message, headers: dict, extra_data: str = None):
+    """
+    key of a request that may share its round-trip with identical concurrent ones, None if it
+    must be sent on its own: only single service reads listed in RPC_COALESCE_ACTIONS qualify,
+    mutating actions are never coalesced.
+    """
+    if extra_data or not isinstance(message, dict) or len(message) != 1 or len(headers) != 1:
+        return None
+    service, request = next(iter(message.items()))
+    if service not in headers or not isinstance(request, dict):
+        return None
+    action = request.get("action")
+    if action not in settings.RPC_COALESCE_ACTIONS:
+        return None
+    try:
+        body = json.dumps(request.get("body"), sort_keys=True, separators=(",", ":"))
+    except (TypeError, ValueError):
+        return None
+    return service, action, body
+
+
+single_flight = SingleFlight()
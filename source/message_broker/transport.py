@@ -0,0 +1,103 @@
+import threading
+
+import pika
+
+from source.config import settings
+from source.message_broker.pool import get_pool
+from source.message_broker.reply_dispatcher import PendingReply, get_dispatcher
+
+
+class Transport:
+    """
+    What the RPC clients need from a broker: publishing on the headers exchange (with replies
+    routed back to reply_to by correlation_id, or fire-and-forget), fanout publishing and the
+    registration of pending replies. AmqpTransport talks to RabbitMQ, memory_broker.MemoryTransport
+    runs the whole exchange in process against fake services.
+    """
+
+    @property
+    def reply_to(self) -> str:
+        raise NotImplementedError
+
+    def register(self, corr_id: str, response_len: int) -> PendingReply:
+        raise NotImplementedError
+
+    def alias(self, corr_id: str, pending: PendingReply):
+        raise NotImplementedError
+
+    def discard(self, corr_id: str, pending: PendingReply = None):
+        raise NotImplementedError
+
+    def send(self, properties: pika.BasicProperties, body, confirm: bool = False):
+        # publish a message whose replies go to reply_to; confirm waits for the broker's ack
+        raise NotImplementedError
+
+    def publish(self, properties: pika.BasicProperties, body, confirm: bool = False):
+        # publish a message nobody waits a reply for
+        raise NotImplementedError
+
+    def fanout(self, exchange_name: str, body):
+        raise NotImplementedError
+
+
+class AmqpTransport(Transport):
+    """
+    RabbitMQ through the worker's channel pools (a plain one and one in publisher confirms mode)
+    and its shared reply consumer. The consumer is started on first use, not on construction.
+    """
+
+    def __init__(self, exchange_name: str, host: str, port: int, user: str, password: str):
+        self.exchange_name = exchange_name
+        self.host = host
+        self.port = port
+        self.user = user
+        self.password = password
+        self.pool = get_pool(exchange_name, host, port, user, password)
+        self.confirm_pool = get_pool(exchange_name, host, port, user, password, confirm=True)
+
+    def dispatcher(self):
+        return get_dispatcher(self.host, self.port, self.user, self.password)
+
+    @property
+    def reply_to(self) -> str:
+        return self.dispatcher().reply_to
+
+    def register(self, corr_id: str, response_len: int) -> PendingReply:
+        return self.dispatcher().register(corr_id, response_len)
+
+    def alias(self, corr_id: str, pending: PendingReply):
+        self.dispatcher().alias(corr_id, pending)
+
+    def discard(self, corr_id: str, pending: PendingReply = None):
+        self.dispatcher().discard(corr_id, pending)
+
+    def send(self, properties: pika.BasicProperties, body, confirm: bool = False):
+        self.dispatcher().send(self.confirm_pool if confirm else self.pool, self.exchange_name, properties, body)
+
+    def publish(self, properties: pika.BasicProperties, body, confirm: bool = False):
+        with (self.confirm_pool if confirm else self.pool).lease() as pooled:
+            pooled.channel.basic_publish(exchange=self.exchange_name, routing_key='', properties=properties, body=body)
+
+    def fanout(self, exchange_name: str, body):
+        with self.pool.lease() as pooled:
+            pooled.channel.exchange_declare(exchange=exchange_name, exchange_type='fanout', passive=True)
+            pooled.channel.basic_publish(exchange=exchange_name, routing_key='', body=body)
+
+
+transports = dict()
+transports_lock = threading.Lock()
+
+
+def get_transport(exchange_name: str, host: str, port: int, user: str, password: str) -> Transport:
+    """
+    transport of the RPC clients, chosen by RPC_TRANSPORT: "amqp" (RabbitMQ) or "memory"
+    (the in-process stand-in broker, for tests and benchmarks without RabbitMQ and services).
+    """
+    if settings.RPC_TRANSPORT == "memory":
+        from source.message_broker.memory_broker import get_memory_transport
+        return get_memory_transport()
+    key = (exchange_name, host, port, user)
+    with transports_lock:
+        if key not in transports:
+            transports[key] = AmqpTransport(exchange_name, host, port, user, password)
+        return transports[key]
@@ -5,7 +5,6 @@ from source.message_broker.rabbit_server import RabbitRPC
 from source.routers.address.validators.address import Address, AddressId
 from source.routers.address.validators.update_address import UpdateAddress
 from source.routers.customer.module.auth import AuthHandler
-from starlette_prometheus import metrics, PrometheusMiddleware
 
 TAGS = [
     {
@@ -25,13 +24,10 @@ app = FastAPI(
 
 auth_handler = AuthHandler()
 
-app.add_middleware(PrometheusMiddleware)
-app.add_route('/metrics', metrics)
-
 
 @app.exception_handler(starletteHTTPException)
 def validation_exception_handler(request, exc):
-    return responses.JSONResponse(exc.detail, status_code=exc.status_code)
+    return responses.JSONResponse(exc.detail, status_code=exc.status_code, headers=getattr(exc, "headers", None))
 
 
 @app.get("/states", tags=["City and States"])
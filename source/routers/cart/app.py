@@ -4,7 +4,6 @@ from typing import Optional
 import jdatetime
 from fastapi import FastAPI, HTTPException, Response, responses, Path, Depends, Query
 from starlette.exceptions import HTTPException as starletteHTTPException
-from starlette_prometheus import metrics, PrometheusMiddleware
 from source.config import settings
 from source.helpers.case_converter import convert_case
 from source.message_broker.rabbit_server import RabbitRPC
@@ -32,7 +31,7 @@ app = FastAPI(
 # customize exception handler of fast api
 @app.exception_handler(starletteHTTPException)
 def validation_exception_handler(request, exc):
-    return responses.JSONResponse(exc.detail, status_code=exc.status_code)
+    return responses.JSONResponse(exc.detail, status_code=exc.status_code, headers=getattr(exc, "headers", None))
 
 
 auth_handler = AuthHandler()
@@ -49,67 +48,30 @@ def add_and_edit_product(item: AddCart, response: Response, auth_header=Depends(
     user, token_dict = auth_header
     customer_type = user.get("customer_type")[0]
     with RabbitRPC(exchange_name='headers_exchange', timeout=5) as rpc:
-        rpc.response_len_setter(response_len=3)
-        result = rpc.publish(
-            message={
-                "product": {
-                    "action": "get_product_by_system_code",
-                    "body": {
-                        "system_code": item.system_code,
-                        "lang": "fa_ir"
-                    }
-                },
-                "customer": {
-                    "action": "check_is_registered",
-                    "body": {
-                        "customer_phone_number": user.get("phone_number"),
-                    }
-                },
-                "order": {
-                    "action": "customer_products_report",
-                    "body": {
-                        "customer_id": user.get("user_id")
-                    }
-                }
-            },
-            headers={'product': True, "customer": True, "order": True},
-        )
-        product_result = result.get("product", {})
-        customer_result = result.get("customer", {})
-        order_result = result.get("order", {})
-        if not product_result.get("success"):
-            raise HTTPException(status_code=product_result.get("status_code", 500),
-                                detail={"error": product_result.get("error", "Something went wrong")})
-        elif not customer_result.get("message", {}).get('customerIsActive'):
-            raise HTTPException(status_code=403,
-                                detail={"error": customer_result.get("message", {}).get('message')})
-        elif not customer_result.get("message", {}).get('customerOfogh') and item.system_code[:6] == "200001":
-            raise HTTPException(status_code=403,
-                                detail={"error": customer_result.get("message", {}).get('message')})
-
-        else:
-
-            ordered_count = [i.get("count") for i in order_result.get('customer_detail') if
-                             i.get('system_code') == item.system_code and i.get("storage_id") == item.storage_id]
-            ordered_count = ordered_count[0] if ordered_count else 0
-
-            product_result = product_result.get("message").copy()
-            final_result = dict()
-            final_result["user_info"] = {"user_id": user.get("user_id")}
-            cart_product = product_result.copy()
-            del cart_product['visible_in_site']
-            del cart_product['step']
-            del cart_product['warehouse_details']
-            final_result["product"] = cart_product
-
-            # quantity actions
-
-            quantity = product_result.get('warehouse_details', {}).get(customer_type, {}).get("storages", {}).get(
-                item.storage_id, {})
-
-            rpc.response_len_setter(response_len=1)
-            user_cart = rpc.publish(
+        # product, customer, order and cart answer independently, bad product, customer or cart fails fast.
+        # order is optional: without its report the products already ordered are not counted in max_qty
+        result = dict()
+        for service, service_result in rpc.scatter(
                 message={
+                    "product": {
+                        "action": "get_product_by_system_code",
+                        "body": {
+                            "system_code": item.system_code,
+                            "lang": "fa_ir"
+                        }
+                    },
+                    "customer": {
+                        "action": "check_is_registered",
+                        "body": {
+                            "customer_phone_number": user.get("phone_number"),
+                        }
+                    },
+                    "order": {
+                        "action": "customer_products_report",
+                        "body": {
+                            "customer_id": user.get("user_id")
+                        }
+                    },
                     "cart": {
                         "action": "get_cart",
                         "body": {
@@ -117,51 +79,84 @@ def add_and_edit_product(item: AddCart, response: Response, auth_header=Depends(
                         }
                     }
                 },
-                headers={'cart': True}
-            ).get('cart', {}).get('message', {})
-            now_count = 0
-            for cart_product in user_cart.get("products", []):
-                if cart_product.get("system_code") == item.system_code and cart_product.get(
-                        'storage_id') == item.storage_id:
-                    now_count = cart_product.get("count", 0)
-                    break
-            for cart_credit in user_cart.get("credits", []):
-                if cart_credit.get("system_code") == item.system_code and cart_credit.get(
-                        'storage_id') == item.storage_id:
-                    now_count += cart_credit.get("count", 0)
-                    break
-
-            allowed_count = (quantity.get("quantity", 0) - quantity.get('reserved', 0))
-            if allowed_count >= (now_count + item.count):
-                final_result["count"] = item.count
-                final_result["storage_id"] = item.storage_id
-            else:
-                raise HTTPException(status_code=400,
-                                    detail={"error": "موجودی این محصول کافی نیست"})
+                headers={'product': True, "customer": True, "order": True, "cart": True},
+                optional=("order",),
+        ):
+            result[service] = service_result
+            if service in ("product", "cart") and not service_result.get("success"):
+                raise HTTPException(status_code=service_result.get("status_code", 500),
+                                    detail={"error": service_result.get("error", "Something went wrong")})
+            elif service == "customer" and not service_result.get("message", {}).get('customerIsActive'):
+                raise HTTPException(status_code=403,
+                                    detail={"error": service_result.get("message", {}).get('message')})
+            elif service == "customer" and not service_result.get("message", {}).get(
+                    'customerOfogh') and item.system_code[:6] == "200001":
+                raise HTTPException(status_code=403,
+                                    detail={"error": service_result.get("message", {}).get('message')})
+        product_result = result.get("product", {})
+        order_result = result.get("order", {})
+        user_cart = result.get("cart", {}).get('message', {})
+        ordered_count = [i.get("count") for i in order_result.get('customer_detail') or [] if
+                         i.get('system_code') == item.system_code and i.get("storage_id") == item.storage_id]
+        ordered_count = ordered_count[0] if ordered_count else 0
+
+        product_result = product_result.get("message").copy()
+        final_result = dict()
+        final_result["user_info"] = {"user_id": user.get("user_id")}
+        cart_product = product_result.copy()
+        del cart_product['visible_in_site']
+        del cart_product['step']
+        del cart_product['warehouse_details']
+        final_result["product"] = cart_product
+
+        # quantity actions
+
+        quantity = product_result.get('warehouse_details', {}).get(customer_type, {}).get("storages", {}).get(
+            item.storage_id, {})
+
+        now_count = 0
+        for cart_product in user_cart.get("products", []):
+            if cart_product.get("system_code") == item.system_code and cart_product.get(
+                    'storage_id') == item.storage_id:
+                now_count = cart_product.get("count", 0)
+                break
+        for cart_credit in user_cart.get("credits", []):
+            if cart_credit.get("system_code") == item.system_code and cart_credit.get(
+                    'storage_id') == item.storage_id:
+                now_count += cart_credit.get("count", 0)
+                break
+
+        allowed_count = (quantity.get("quantity", 0) - quantity.get('reserved', 0))
+        if allowed_count >= (now_count + item.count):
+            final_result["count"] = item.count
+            final_result["storage_id"] = item.storage_id
+        else:
+            raise HTTPException(status_code=400,
+                                detail={"error": "موجودی این محصول کافی نیست"})
 
-            if (now_count + item.count) < quantity.get('min_qty') or (
-                    now_count + item.count + ordered_count) > quantity.get('max_qty'):
-                response.status_code = 400
-                raise HTTPException(status_code=400,
-                                    detail={"error": "مقدار وارد شده بیش از حد مجاز است"})
+        if (now_count + item.count) < quantity.get('min_qty') or (
+                now_count + item.count + ordered_count) > quantity.get('max_qty'):
+            response.status_code = 400
+            raise HTTPException(status_code=400,
+                                detail={"error": "مقدار وارد شده بیش از حد مجاز است"})
 
-            rpc.response_len_setter(response_len=1)
-            cart_result = rpc.publish(
-                message={
-                    "cart": {
-                        "action": "add_and_edit_product_in_cart",
-                        "body": final_result
-                    }
-                },
-                headers={'cart': True}
-            )
-            cart_result = cart_result.get("cart", {})
-            if not cart_result.get("success"):
-                raise HTTPException(status_code=product_result.get("status_code", 500),
-                                    detail={"error": product_result.get("error", "Something went wrong")})
-            else:
-                response.status_code = cart_result.get("status_code", 200)
-                return {"message": convert_case(cart_result.get("message"), "camel")}
+        rpc.response_len_setter(response_len=1)
+        cart_result = rpc.publish(
+            message={
+                "cart": {
+                    "action": "add_and_edit_product_in_cart",
+                    "body": final_result
+                }
+            },
+            headers={'cart': True}
+        )
+        cart_result = cart_result.get("cart", {})
+        if not cart_result.get("success"):
+            raise HTTPException(status_code=product_result.get("status_code", 500),
+                                detail={"error": product_result.get("error", "Something went wrong")})
+        else:
+            response.status_code = cart_result.get("status_code", 200)
+            return {"message": convert_case(cart_result.get("message"), "camel")}
 
 
 @app.put("/credit_cart/", tags=["Cart"])
@@ -223,6 +218,9 @@ def add_and_edit_credit_product(
         elif not customer_result.get("message", {}).get('customerOfogh') and item.system_code[:6] == "200001":
             raise HTTPException(status_code=403,
                                 detail={"error": customer_result.get("message", {}).get('message')})
+        elif not order_result.get("success"):
+            raise HTTPException(status_code=order_result.get("status_code", 500),
+                                detail={"error": order_result.get("error", "Something went wrong")})
         else:
             credit = credit_result.get("message")
             if jdatetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S") > credit.get(
@@ -248,7 +246,7 @@ def add_and_edit_credit_product(
                 item.storage_id, {})
 
             rpc.response_len_setter(response_len=1)
-            user_cart = rpc.publish(
+            cart_result = rpc.publish(
                 message={
                     "cart": {
                         "action": "get_cart",
@@ -258,7 +256,12 @@ def add_and_edit_credit_product(
                     }
                 },
                 headers={'cart': True}
-            ).get('cart', {}).get('message', {})
+            ).get('cart', {})
+            # without the cart the quantity check below cannot be made
+            if not cart_result.get("success"):
+                raise HTTPException(status_code=cart_result.get("status_code", 500),
+                                    detail={"error": cart_result.get("error", "Something went wrong")})
+            user_cart = cart_result.get('message', {})
             now_count = 0
             for cart_product in user_cart.get("products", []):
                 if cart_product.get("system_code") == item.system_code and cart_product.get(
@@ -382,19 +385,17 @@ def get_cart(response: Response,
         else:
             base_price = 0
             profit = 0
-            for product in cart_result["message"]["products"]:
-                rpc.response_len_setter(response_len=1)
-                product_result = rpc.publish(
-                    message={
-                        "product": {
-                            "action": "get_product_backoffice",
-                            "body": {
-                                "system_code": product.get("system_code")
-                            }
-                        }
-                    },
-                    headers={'product': True}
-                ).get("product", {}).get("message", {})
+            products = cart_result["message"]["products"]
+            product_results = rpc.batch("product", [
+                {
+                    "action": "get_product_backoffice",
+                    "body": {
+                        "system_code": product.get("system_code")
+                    }
+                } for product in products
+            ])
+            for product, product_result in zip(products, product_results):
+                product_result = product_result.get("message", {})
                 storage_details = product_result.get("warehouse_details", {}).get(customer_type, {}).get("storages",
                                                                                                          {}).get(
                     product.get("storage_id"), {})
@@ -1,4 +1,3 @@
-from starlette_prometheus import PrometheusMiddleware, metrics
 from fastapi import FastAPI
 from fastapi import responses
 from starlette.exceptions import HTTPException as starletteHTTPException
@@ -21,9 +20,6 @@ app = FastAPI(
     debug=settings.DEBUG_MODE
 )
 
-app.add_middleware(PrometheusMiddleware)
-app.add_route("/metrics", metrics)
-
 app.include_router(router_auth)
 app.include_router(router_register)
 app.include_router(router_profile)
@@ -33,4 +29,4 @@ app.include_router(router_rakiano)
 
 @app.exception_handler(starletteHTTPException)
 def validation_exception_handler(request, exc):
-    return responses.JSONResponse(exc.detail, status_code=exc.status_code)
+    return responses.JSONResponse(exc.detail, status_code=exc.status_code, headers=getattr(exc, "headers", None))
@@ -8,7 +8,6 @@ from source.routers.dealership.controllers.get_dealership import router as get_i
 from source.routers.dealership.controllers.registration_sell_request import router as sell
 from source.routers.dealership.controllers.cash_payment_callback import router as cash_payment
 from source.routers.dealership.controllers.return_products import router as return_product
-from starlette_prometheus import metrics, PrometheusMiddleware
 
 
 TAGS = [
@@ -30,7 +29,7 @@ app = FastAPI(
 
 @app.exception_handler(starletteHTTPException)
 def validation_exception_handler(request, exc):
-    return responses.JSONResponse(exc.detail, status_code=exc.status_code)
+    return responses.JSONResponse(exc.detail, status_code=exc.status_code, headers=getattr(exc, "headers", None))
 
 
 
@@ -42,6 +41,3 @@ app.include_router(get_inventory)
 app.include_router(sell)
 app.include_router(cash_payment)
 app.include_router(return_product)
-
-app.add_middleware(PrometheusMiddleware)
-app.add_route('/metrics', metrics)
\ No newline at end of file
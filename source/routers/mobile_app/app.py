@@ -4,7 +4,6 @@ from source.routers.mobile_app.controllers.app_controller import router as app_r
 from source.routers.mobile_app.controllers.football_controller import router as football_router
 from source.routers.mobile_app.controllers.user_controller import router as user_router
 from source.routers.mobile_app.controllers.world_cup_controller import router as wcup_router
-from starlette_prometheus import metrics, PrometheusMiddleware
 from source.config import settings
 
 TAGS = [
@@ -28,13 +27,10 @@ app = FastAPI(
 # customize exception handler of fast api
 @app.exception_handler(starletteHTTPException)
 def validation_exception_handler(request, exc):
-    return responses.JSONResponse(exc.detail, status_code=exc.status_code)
+    return responses.JSONResponse(exc.detail, status_code=exc.status_code, headers=getattr(exc, "headers", None))
 
 
 app.include_router(app_router)
 app.include_router(football_router)
 app.include_router(user_router)
 app.include_router(wcup_router)
-
-app.add_middleware(PrometheusMiddleware)
-app.add_route('/metrics', metrics)
\ No newline at end of file
@@ -51,8 +51,7 @@ def cancel_order(response: Response,
                 headers={'order': True}
             ).get("order")
             if order_result.get("success"):
-                rpc.response_len_setter(response_len=1)
-                rpc.publish(
+                rpc.notify(
                     message={
                         "order": {
                             "action": "send_cancel_order_sms",
@@ -118,8 +118,7 @@ def final_order(
                                 headers={"coupon": True}
                             ).get("coupon")
 
-                        rpc.response_len_setter(response_len=1)
-                        rpc.publish(
+                        rpc.notify(
                             message={
                                 "order": {
                                     "action": "send_place_order_sms",
@@ -136,8 +135,7 @@ def final_order(
                             },
                             headers={'order': True}
                         )
-                        rpc.response_len_setter(response_len=1)
-                        rpc.publish(
+                        rpc.notify(
                             message={
                                 "cart": {
                                     "action": "delete_cart",
@@ -156,8 +154,7 @@ def final_order(
                     response.status_code = 400
                     return {"success": False, "message": "سفارش به علت نقص فنی ثبت نشد. لطفا با پشتیبانی تماس بگیرید."}
             else:
-                rpc.response_len_setter(response_len=1)
-                rpc.publish(
+                rpc.notify(
                     message={
                         "cart": {
                             "action": "remove_cart",
@@ -172,8 +169,7 @@ def final_order(
                 place_order_result['gateway_error'] = "خطا در ثبت سفارش"
                 return place_order_result
         else:
-            rpc.response_len_setter(response_len=1)
-            rpc.publish(
+            rpc.notify(
                 message={
                     "cart": {
                         "action": "remove_cart",
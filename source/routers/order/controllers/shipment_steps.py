@@ -21,8 +21,7 @@ def get_shipment(response: Response, auth_header=Depends(auth_handler.check_curr
     response_result = shipment_detail(auth_header, response)
     if response_result.get("success"):
         with RabbitRPC(exchange_name='headers_exchange', timeout=5) as rpc:
-            rpc.response_len_setter(response_len=1)
-            rpc.publish(
+            rpc.notify(
                 message={
                     "cart": {
                         "action": "remove_cart",
@@ -32,7 +31,7 @@ def get_shipment(response: Response, auth_header=Depends(auth_handler.check_curr
                     }
                 },
                 headers={'cart': True}
-            ).get("cart", {})
+            )
             response.status_code = response_result.get("status_code")
             return {"success": True, "message": response_result.get("message")}
     else:
@@ -12,6 +12,20 @@ class EditQuantity:
         self.count = count
 
 
+def remove_products_from_cart(rpc, user_id, items: list):
+    # (system_code, storage_id) of each product to remove, all removed in one round-trip
+    rpc.batch("cart", [
+        {
+            "action": "remove_product_from_cart",
+            "body": {
+                "user_id": user_id,
+                "system_code": system_code,
+                "storage_id": storage_id
+            }
+        } for system_code, storage_id in items
+    ])
+
+
 def check_price_qty(auth_header, cart, response):
     with RabbitRPC(exchange_name='headers_exchange', timeout=5) as rpc:
         rpc.response_len_setter(response_len=1)
@@ -27,7 +41,7 @@ def check_price_qty(auth_header, cart, response):
             headers={'customer': True}
         ).get("customer", {})
         if not customer_result.get("success") or not customer_result.get('message').get('customerIsActive'):
-            rpc.publish(
+            rpc.notify(
                 message={
                     "cart": {
                         "action": "delete_cart",
@@ -47,23 +61,13 @@ def check_price_qty(auth_header, cart, response):
         allowed_storages = get_allowed_storages(auth_header[0].get("user_id"))
         products = []
         edited_result = []
+        # products to remove from the cart, removed together after each loop
+        removed = []
         if cart_result.get('products'):
             for cart_items in cart_result.get('products'):
                 if cart_items['storageId'] in allowed_storages:
                     if cart_items['price'] is None:
-                        result = rpc.publish(
-                            message={
-                                "cart": {
-                                    "action": "remove_product_from_cart",
-                                    "body": {
-                                        "user_id": auth_header[0].get("user_id"),
-                                        "system_code": cart_items['systemCode'],
-                                        "storage_id": cart_items['storageId']
-                                    }
-                                }
-                            },
-                            headers={'cart': True}
-                        )
+                        removed.append((cart_items['systemCode'], cart_items['storageId']))
                         edited_result.append({
                             "name": cart_items['name'],
                             "status": "removed",
@@ -80,24 +84,14 @@ def check_price_qty(auth_header, cart, response):
 
                         })
                 else:
-                    rpc.publish(
-                        message={
-                            "cart": {
-                                "action": "remove_product_from_cart",
-                                "body": {
-                                    "user_id": auth_header[0].get("user_id"),
-                                    "system_code": cart_items['systemCode'],
-                                    "storage_id": cart_items['storageId']
-                                }
-                            }
-                        },
-                        headers={'cart': True}
-                    )
+                    removed.append((cart_items['systemCode'], cart_items['storageId']))
                     edited_result.append({
                         "name": cart_items.get('name'),
                         "status": "removed",
                         "message": f"{cart_items.get('name')} از سبد خرید به دلیل عدم تطبیق ادرس با انبار انتخاب شده حذف شد"
                     })
+            remove_products_from_cart(rpc, auth_header[0].get("user_id"), removed)
+            removed = []
             # check quantity
             if not products:
                 return {"success": False, "message": edited_result}
@@ -119,20 +113,7 @@ def check_price_qty(auth_header, cart, response):
                 rpc.response_len_setter(response_len=1)
                 # get product data
                 if checkout_data['quantity_checkout'] == 'system code not found':
-                    rpc.response_len_setter(response_len=1)
-                    result = rpc.publish(
-                        message={
-                            "cart": {
-                                "action": "remove_product_from_cart",
-                                "body": {
-                                    "user_id": auth_header[0].get("user_id"),
-                                    "system_code": checkout_data['systemCode'],
-                                    "storage_id": checkout_data['storage_id']
-                                }
-                            }
-                        },
-                        headers={'cart': True}
-                    )
+                    removed.append((checkout_data['systemCode'], checkout_data['storage_id']))
                     edited_result.append({
                         "name": checkout_data['name'],
                         "status": "removed",
@@ -150,20 +131,7 @@ def check_price_qty(auth_header, cart, response):
 
                         edit = add_and_edit_product(item=object_to_edit, response=response, auth_header=auth_header)
                         if edit.get("error") is not None:
-                            rpc.response_len_setter(response_len=1)
-                            rpc.publish(
-                                message={
-                                    "cart": {
-                                        "action": "remove_product_from_cart",
-                                        "body": {
-                                            "user_id": auth_header[0].get("user_id"),
-                                            "system_code": checkout_data['systemCode'],
-                                            "storage_id": checkout_data['storage_id']
-                                        }
-                                    }
-                                },
-                                headers={'cart': True}
-                            )
+                            removed.append((checkout_data['systemCode'], checkout_data['storage_id']))
                             edited_result.append({
                                 "name": checkout_data['name'],
                                 "status": "removed",
@@ -176,6 +144,7 @@ def check_price_qty(auth_header, cart, response):
                                 "status": "edited",
                                 "message": f"{checkout_data['name']} از سبد خرید به دلیل اتمام موجودی حذف شد",
                             })
+            remove_products_from_cart(rpc, auth_header[0].get("user_id"), removed)
         if cart_result.get('baskets'):
             if cart_result.get('baskets'):
                 rpc.response_len_setter(response_len=1)
@@ -69,8 +69,7 @@ def handle_order_bank_callback(result, response):
                         headers={"coupon": True}
                     ).get("coupon")
                 # send sms
-                rpc.response_len_setter(response_len=1)
-                rpc.publish(
+                rpc.notify(
                     message={
                         "order": {
                             "action": "send_place_order_sms",
@@ -88,7 +87,7 @@ def handle_order_bank_callback(result, response):
                     headers={'order': True}
                 )
 
-                rpc.response_len_setter(response_len=2)
+                rpc.response_len_setter(response_len=1)
                 car_order_result = rpc.publish(
                     message={
                         "order": {
@@ -96,16 +95,20 @@ def handle_order_bank_callback(result, response):
                             "body": {
                                 "payment_data": result
                             }
-                        },
+                        }
+                    },
+                    headers={'order': True}
+                )
+                rpc.notify(
+                    message={
                         "cart": {
                             "action": "delete_cart",
                             "body": {
                                 "user_id": result.get("customer_id")
                             }
                         }
-
                     },
-                    headers={'order': True, "cart": True}
+                    headers={"cart": True}
                 )
 
                 # response.status_code = 200
@@ -116,8 +119,7 @@ def handle_order_bank_callback(result, response):
                     return RedirectResponse(
                         f"https://rakiano.com/payment-result/order/{result.get('service_id')}")
             else:
-                rpc.response_len_setter(response_len=1)
-                rpc.publish(
+                rpc.notify(
                     message={
                         "order": {
                             "action": "send_cancel_order_sms",
@@ -159,8 +161,7 @@ def handle_order_bank_callback(result, response):
                     },
                     headers={"product": True}
                 ).get("product")
-                rpc.response_len_setter(response_len=1)
-                rpc.publish(
+                rpc.notify(
                     message={
                         "cart": {
                             "action": "remove_cart_bank_callback",
@@ -4,7 +4,6 @@ from fastapi.middleware.trustedhost import TrustedHostMiddleware
 from source.config import settings
 from source.routers.payment.controllers.bank_controller import router as bank_controller
 from source.routers.payment.controllers.kowsar_controller import router as kowsar_controller
-from starlette_prometheus import metrics, PrometheusMiddleware
 
 TAGS = [
     {
@@ -26,12 +25,10 @@ app = FastAPI(
 app.add_middleware(
     TrustedHostMiddleware, allowed_hosts=["*"]
 )
-app.add_middleware(PrometheusMiddleware)
-app.add_route('/metrics', metrics)
 
 @app.exception_handler(starletteHTTPException)
 def validation_exception_handler(request, exc):
-    return responses.JSONResponse(exc.detail, status_code=exc.status_code)
+    return responses.JSONResponse(exc.detail, status_code=exc.status_code, headers=getattr(exc, "headers", None))
 
 
 app.include_router(bank_controller)
@@ -1,5 +1,4 @@
 import json
-from starlette_prometheus import metrics, PrometheusMiddleware
 from fastapi import FastAPI, HTTPException, Response, responses, Depends, Query
 from source.config import settings
 from starlette.exceptions import HTTPException as starletteHTTPException
@@ -27,13 +26,10 @@ app = FastAPI(
 
 auth_handler = AuthHandler()
 
-app.add_middleware(PrometheusMiddleware)
-app.add_route('/metrics', metrics)
-
 
 @app.exception_handler(starletteHTTPException)
 def validation_exception_handler(request, exc):
-    return responses.JSONResponse(exc.detail, status_code=exc.status_code)
+    return responses.JSONResponse(exc.detail, status_code=exc.status_code, headers=getattr(exc, "headers", None))
 
 
 rpc = RabbitRPC(exchange_name='headers_exchange', timeout=5)
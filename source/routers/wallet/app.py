@@ -8,7 +8,6 @@ from starlette.exceptions import HTTPException as starletteHTTPException
 from source.config import settings
 from source.routers.wallet.controllers.other_controllers import router as other_router
 from source.routers.wallet.controllers.charge_wallet_controller import router as charge_router
-from starlette_prometheus import metrics, PrometheusMiddleware
 
 TAGS = [
     {
@@ -29,10 +28,8 @@ app = FastAPI(
 
 @app.exception_handler(starletteHTTPException)
 def validation_exception_handler(request, exc):
-    return responses.JSONResponse(exc.detail, status_code=exc.status_code)
+    return responses.JSONResponse(exc.detail, status_code=exc.status_code, headers=getattr(exc, "headers", None))
 
-app.add_middleware(PrometheusMiddleware)
-app.add_route('/metrics', metrics)
 
 app.include_router(charge_router)
 app.include_router(other_router)
@@ -0,0 +1,49 @@
+import os
+import sys
+import tempfile
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# settings are read on import: the RPC layer runs on the in-process broker, without RabbitMQ, InfluxDB and services
+os.environ.setdefault("RPC_TRANSPORT", "memory")
+os.environ.setdefault("INFLUXDB_ENABLED", "0")
+os.environ.setdefault("RABBITMQ_HOST", "localhost")
+os.environ.setdefault("RABBITMQ_PORT", "5672")
+os.environ.setdefault("RABBITMQ_USER", "guest")
+os.environ.setdefault("RABBITMQ_PASS", "guest")
+os.environ.setdefault("SECRET_KEY", "test-secret")
+os.environ.setdefault("DEBUG_MODE", "0")
+os.environ.setdefault("GALLERY_DIR", tempfile.mkdtemp(prefix="gallery-"))
+sys.path[:0] = [ROOT, os.path.join(ROOT, "source")]
+
+from source.message_broker import admission, circuit_breaker  # noqa: E402
+from source.message_broker.hedging import hedger  # noqa: E402
+from source.message_broker.memory_broker import FakeService, memory_broker  # noqa: E402
+
+
+@pytest.fixture(autouse=True)
+def fresh_rpc_state():
+    # breakers, limiters and latency trackers are per worker, every test starts from a fresh worker
+    circuit_breaker.breakers.clear()
+    admission.limiters.clear()
+    hedger.trackers.clear()
+    hedger.awaited.clear()
+    hedger.tokens = 1.0
+    yield
+
+
+@pytest.fixture
+def fake_service():
+    """bind FakeService objects to the in-process broker for the test: fake_service("cart", handlers=...)"""
+    added = list()
+
+    def add(name: str, **kwargs) -> FakeService:
+        service = memory_broker.add_service(FakeService(name, **kwargs))
+        added.append(service)
+        return service
+
+    yield add
+    for service in added:
+        memory_broker.remove_service(service.name)
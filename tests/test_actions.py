@@ -0,0 +1,26 @@
+from source.config import settings
+from source.message_broker.actions import COMMAND, QUERY, classify
+
+
+def message(service: str, action: str) -> dict:
+    return {service: {"action": action, "body": {}}}
+
+
+def test_registered_reads_are_queries():
+    assert classify(message("product", "get_product_by_system_code")) == QUERY
+
+
+def test_unregistered_get_actions_are_commands():
+    assert classify(message("uis", "get_link_request")) == COMMAND
+    assert classify(message("shipment", "get_some_new_action")) == COMMAND
+
+
+def test_commands_win_over_configured_queries(monkeypatch):
+    monkeypatch.setattr(settings, "RPC_QUERY_ACTIONS", ["get_referral_number", "get_new_read"])
+
+    assert classify(message("dealership", "get_referral_number")) == COMMAND
+    assert classify(message("dealership", "get_new_read")) == QUERY
+
+
+def test_a_message_with_one_command_is_a_command():
+    assert classify(dict(message("product", "get_stock"), **message("cart", "add_and_edit_product_in_cart"))) == COMMAND
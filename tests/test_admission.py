@@ -0,0 +1,31 @@
+from source.config import settings
+from source.message_broker.actions import BULK
+from source.message_broker.admission import admit, get_limiter
+from source.message_broker.reply_dispatcher import PendingReply
+
+
+def slow_reply(service: str) -> PendingReply:
+    pending = PendingReply("corr", 1)
+    pending.add(service, {"success": True, "status_code": 200})
+    pending.started = pending.arrived[service] - settings.RPC_ADMISSION_LATENCY_TARGET - 1
+    return pending
+
+
+def call(service: str, **kwargs):
+    with admit([service], **kwargs) as admission:
+        pending = slow_reply(service)
+        admission.record(pending, {service: pending.started + 60}, [])
+
+
+def test_slow_interactive_replies_shrink_the_limit():
+    call("catalog")
+
+    assert get_limiter("catalog").limit < settings.RPC_ADMISSION_INITIAL_LIMIT
+    assert get_limiter("catalog").in_flight == 0
+
+
+def test_slow_bulk_replies_leave_the_limit_alone():
+    call("catalog", lane_name=BULK)
+
+    assert get_limiter("catalog").limit == settings.RPC_ADMISSION_INITIAL_LIMIT
+    assert get_limiter("catalog").in_flight == 0
@@ -0,0 +1,79 @@
+import asyncio
+import json
+import time
+from types import SimpleNamespace
+
+import aio_pika
+import pytest
+from fastapi import HTTPException
+
+from source.message_broker.admission import limiters
+from source.message_broker.async_rpc import AsyncRabbitRPC
+from source.message_broker.circuit_breaker import CircuitBreaker, get_breaker
+
+
+class FakeExchange:
+    """answers each service of a published message after replies[service] = (seconds, reply)"""
+
+    def __init__(self, rpc: AsyncRabbitRPC, replies: dict, error: Exception = None):
+        self.rpc = rpc
+        self.replies = replies
+        self.error = error
+
+    async def publish(self, message: aio_pika.Message, routing_key: str):
+        if self.error is not None:
+            raise self.error
+        for service, (delay, reply) in self.replies.items():
+            incoming = SimpleNamespace(
+                correlation_id=message.correlation_id, body=json.dumps({service: reply}).encode(),
+                content_type=None, content_encoding=None
+            )
+            asyncio.get_running_loop().call_later(
+                delay, lambda reply_message=incoming: asyncio.ensure_future(self.rpc.on_response(reply_message))
+            )
+
+
+def rpc(replies: dict, error: Exception = None) -> AsyncRabbitRPC:
+    client = AsyncRabbitRPC(exchange_name="headers_exchange", timeout=1)
+    client.connection = SimpleNamespace(is_closed=False)
+    client.callback_queue = SimpleNamespace(name="replies")
+    client.exchange = FakeExchange(client, replies, error)
+    return client
+
+
+def publish(client: AsyncRabbitRPC, services, timeout: float = 0.1) -> dict:
+    message = {service: {"action": "get_something", "body": {}} for service in services}
+    return asyncio.run(client.publish(message, {service: True for service in services}, timeout=timeout))
+
+
+def test_service_missing_its_deadline_gets_a_timeout_error():
+    client = rpc({"cart": (0, {"success": True, "status_code": 200}), "product": (1, {"success": True})})
+
+    result = publish(client, ["cart", "product"])
+
+    assert result["cart"]["success"]
+    assert result["product"]["status_code"] == 504
+    assert result["product"]["timeout"] is True
+    # the admission slots are released with the outcome of each service
+    assert {service: limiter.in_flight for service, limiter in limiters.items()} == {"cart": 0, "product": 0}
+
+
+def test_unreachable_broker_gives_unavailable_errors():
+    client = rpc({}, error=aio_pika.exceptions.AMQPConnectionError("connection lost"))
+
+    result = publish(client, ["cart"])
+
+    assert result["cart"]["status_code"] == 503
+    assert result["cart"]["success"] is False
+
+
+def test_open_circuit_rejects_calls_with_503():
+    breaker = get_breaker("cart")
+    breaker.set_state(CircuitBreaker.OPEN)
+    breaker.opened_at = time.monotonic()
+    client = rpc({"cart": (0, {"success": True, "status_code": 200})})
+
+    with pytest.raises(HTTPException) as error:
+        publish(client, ["cart"])
+
+    assert error.value.status_code == 503
@@ -0,0 +1,51 @@
+from source.config import settings
+from source.message_broker.batch import BATCH_ACTION
+from source.message_broker.rabbit_server import RabbitRPC
+
+
+def price(body: dict) -> dict:
+    return {"success": True, "status_code": 200, "message": body["system_code"] * 10}
+
+
+def batch(service: str, system_codes) -> list:
+    requests = [{"action": "get_price", "body": {"system_code": code}} for code in system_codes]
+    return RabbitRPC(exchange_name="headers_exchange", timeout=1).batch(service, requests)
+
+
+def test_batch_reply_is_split_back_per_request(fake_service, monkeypatch):
+    monkeypatch.setattr(settings, "RPC_BATCH_SERVICES", ["pricing"])
+    service = fake_service("pricing", handlers={"get_price": price})
+
+    replies = batch("pricing", [1, 2, 3])
+
+    assert [reply["message"] for reply in replies] == [10, 20, 30]
+    assert service.calls == 1
+
+
+def test_envelopes_hold_at_most_batch_size_requests(fake_service, monkeypatch):
+    monkeypatch.setattr(settings, "RPC_BATCH_SERVICES", ["pricing"])
+    monkeypatch.setattr(settings, "RPC_BATCH_SIZE", 2)
+    service = fake_service("pricing", handlers={"get_price": price})
+
+    replies = batch("pricing", [1, 2, 3])
+
+    assert [reply["message"] for reply in replies] == [10, 20, 30]
+    assert service.calls == 2
+
+
+def test_services_without_envelopes_get_one_message_per_request(fake_service):
+    service = fake_service("pricing", handlers={"get_price": price})
+
+    replies = batch("pricing", [1, 2])
+
+    assert [reply["message"] for reply in replies] == [10, 20]
+    assert service.calls == 2
+
+
+def test_malformed_batch_reply_fails_every_request(fake_service, monkeypatch):
+    monkeypatch.setattr(settings, "RPC_BATCH_SERVICES", ["pricing"])
+    fake_service("pricing", handlers={BATCH_ACTION: {"success": True, "status_code": 200, "message": [1]}})
+
+    replies = batch("pricing", [1, 2])
+
+    assert [reply["status_code"] for reply in replies] == [502, 502]
@@ -0,0 +1,67 @@
+import pytest
+from fastapi.testclient import TestClient
+
+from source.config import settings
+from source.routers.cart.app import app, auth_handler
+
+SYSTEM_CODE = "1000010010001001001001001"
+USER = {"user_id": 1, "phone_number": "09123456789", "customer_type": ["B2C"]}
+PRODUCT = {
+    "success": True,
+    "status_code": 200,
+    "message": {
+        "system_code": SYSTEM_CODE,
+        "visible_in_site": True,
+        "step": 1,
+        "warehouse_details": {
+            "B2C": {"storages": {"1": {"quantity": 10, "reserved": 0, "min_qty": 1, "max_qty": 5}}}
+        }
+    }
+}
+CUSTOMER = {"success": True, "status_code": 200, "message": {"customerIsActive": True, "customerOfogh": True}}
+CART = {"success": True, "status_code": 200, "message": {"products": [], "credits": []}}
+
+
+@pytest.fixture
+def client():
+    app.dependency_overrides[auth_handler.check_current_user_tokens] = lambda: (USER, {})
+    yield TestClient(app)
+    app.dependency_overrides.clear()
+
+
+def services(fake_service, cart: dict, order: dict):
+    fake_service("product", handlers={"get_product_by_system_code": PRODUCT})
+    fake_service("customer", handlers={"check_is_registered": CUSTOMER})
+    fake_service("order", **order)
+    return fake_service("cart", **cart)
+
+
+def add(client: TestClient, count: int = 2):
+    return client.put("/cart/", json={"systemCode": SYSTEM_CODE, "storageId": "1", "count": count})
+
+
+def test_missing_cart_does_not_skip_the_quantity_check(fake_service, client, monkeypatch):
+    monkeypatch.setitem(settings.RPC_SERVICE_TIMEOUTS, "cart", 0.1)
+    cart = services(fake_service, cart=dict(drop_rate=1), order=dict(handlers={"customer_products_report": {
+        "success": True, "status_code": 200, "customer_detail": []
+    }}))
+
+    response = add(client)
+
+    assert response.status_code == 504
+    # only get_cart was sent, nothing was added
+    assert cart.calls == 1
+
+
+def test_missing_order_report_is_optional(fake_service, client, monkeypatch):
+    monkeypatch.setitem(settings.RPC_SERVICE_TIMEOUTS, "order", 0.1)
+    cart = services(fake_service, cart=dict(handlers={
+        "get_cart": CART,
+        "add_and_edit_product_in_cart": {"success": True, "status_code": 200, "message": {"added": True}}
+    }), order=dict(drop_rate=1))
+
+    response = add(client)
+
+    assert response.status_code == 200
+    assert response.json() == {"message": {"added": True}}
+    assert cart.calls == 2
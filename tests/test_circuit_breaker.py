@@ -0,0 +1,115 @@
+import time
+
+import pytest
+from fastapi import HTTPException
+
+from source.config import settings
+from source.message_broker.actions import BULK
+from source.message_broker.circuit_breaker import CircuitBreaker, get_breaker, record_replies
+from source.message_broker.rabbit_server import RabbitRPC
+from source.message_broker.reply_dispatcher import PendingReply
+
+
+def breaker(**kwargs) -> CircuitBreaker:
+    options = dict(window=4, min_calls=4, error_rate=0.5, slow_call=1, open_seconds=0.05, probes=1)
+    return CircuitBreaker("test", **dict(options, **kwargs))
+
+
+def trip(circuit: CircuitBreaker):
+    for _ in range(circuit.min_calls):
+        assert circuit.allow()
+        circuit.record(False, 0.01)
+
+
+def test_opens_when_the_failure_rate_is_reached():
+    circuit = breaker()
+    for success in (True, True, False):
+        circuit.allow()
+        circuit.record(success, 0.01)
+    assert circuit.state == CircuitBreaker.CLOSED
+
+    circuit.allow()
+    circuit.record(False, 0.01)
+
+    assert circuit.state == CircuitBreaker.OPEN
+    assert not circuit.allow()
+
+
+def test_slow_replies_count_as_failures():
+    circuit = breaker()
+    for _ in range(4):
+        circuit.allow()
+        circuit.record(True, 2)
+
+    assert circuit.state == CircuitBreaker.OPEN
+
+
+def slow_reply(service: str, latency: float) -> PendingReply:
+    pending = PendingReply("corr", 1)
+    pending.add(service, {"success": True, "status_code": 200})
+    pending.started = pending.arrived[service] - latency
+    return pending
+
+
+def test_slow_bulk_replies_do_not_count():
+    for _ in range(settings.CIRCUIT_BREAKER_MIN_CALLS):
+        pending = slow_reply("report", settings.CIRCUIT_BREAKER_SLOW_CALL + 1)
+        record_replies(pending, {"report": pending.started + 60}, [], BULK)
+
+    assert get_breaker("report").state == CircuitBreaker.CLOSED
+
+
+def test_replies_within_a_longer_service_timeout_are_not_slow(monkeypatch):
+    monkeypatch.setitem(settings.RPC_SERVICE_TIMEOUTS, "catalog", settings.CIRCUIT_BREAKER_SLOW_CALL + 5)
+    for _ in range(settings.CIRCUIT_BREAKER_MIN_CALLS):
+        pending = slow_reply("catalog", settings.CIRCUIT_BREAKER_SLOW_CALL + 1)
+        record_replies(pending, {"catalog": pending.started + 60}, [])
+
+    assert get_breaker("catalog").state == CircuitBreaker.CLOSED
+
+    for _ in range(settings.CIRCUIT_BREAKER_MIN_CALLS):
+        pending = slow_reply("search", settings.CIRCUIT_BREAKER_SLOW_CALL + 1)
+        record_replies(pending, {"search": pending.started + 60}, [])
+
+    assert get_breaker("search").state == CircuitBreaker.OPEN
+
+
+def test_half_open_probe_that_passes_closes_it():
+    circuit = breaker()
+    trip(circuit)
+    time.sleep(0.06)
+
+    assert circuit.allow()
+    assert circuit.state == CircuitBreaker.HALF_OPEN
+    # only the probe goes through until it reported back
+    assert not circuit.allow()
+
+    circuit.record(True, 0.01)
+
+    assert circuit.state == CircuitBreaker.CLOSED
+    assert circuit.allow()
+
+
+def test_half_open_probe_that_fails_opens_it_again():
+    circuit = breaker()
+    trip(circuit)
+    time.sleep(0.06)
+
+    assert circuit.allow()
+    circuit.record(False, 0.01)
+
+    assert circuit.state == CircuitBreaker.OPEN
+    assert not circuit.allow()
+
+
+def test_open_circuit_rejects_calls_with_503_without_publishing(fake_service):
+    service = fake_service("broken")
+    trip(get_breaker("broken"))
+    rpc = RabbitRPC(exchange_name="headers_exchange", timeout=1)
+    rpc.response_len_setter(response_len=1)
+
+    with pytest.raises(HTTPException) as error:
+        rpc.publish({"broken": {"action": "get_something", "body": {}}}, {"broken": True})
+
+    assert error.value.status_code == 503
+    assert service.calls == 0
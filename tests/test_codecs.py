@@ -0,0 +1,46 @@
+import json
+
+import pytest
+
+from source.config import settings
+from source.message_broker.codecs import MsgpackCodec, decode_reply, encode_message
+
+MESSAGE = {"product": {"action": "get_product_by_system_code", "body": {"system_code": "100001"}}}
+
+
+@pytest.fixture
+def msgpack_codec(monkeypatch):
+    monkeypatch.setattr(settings, "RPC_CODEC", "msgpack")
+
+
+def test_binary_codec_is_used_only_for_services_that_opted_in(msgpack_codec, monkeypatch):
+    body, content_type, _ = encode_message(MESSAGE)
+
+    assert content_type is None
+    assert json.loads(body) == MESSAGE
+
+    monkeypatch.setattr(settings, "RPC_CODEC_SERVICES", ["product"])
+    body, content_type, _ = encode_message(MESSAGE)
+
+    assert content_type == MsgpackCodec.content_type
+    assert decode_reply(body, content_type) == MESSAGE
+
+
+def test_a_message_is_binary_only_if_every_service_opted_in(msgpack_codec, monkeypatch):
+    monkeypatch.setattr(settings, "RPC_CODEC_SERVICES", ["product"])
+    message = dict(MESSAGE, cart={"action": "get_cart", "body": {"user_id": 1}})
+
+    body, content_type, _ = encode_message(message)
+
+    assert content_type is None
+    assert json.loads(body) == message
+
+
+def test_extra_data_never_replaces_the_binary_content_type(msgpack_codec, monkeypatch):
+    monkeypatch.setattr(settings, "RPC_CODEC_SERVICES", ["product"])
+
+    body, content_type, _ = encode_message(MESSAGE, extra_data="extra")
+
+    # the message falls back to JSON, so extra_data keeps its place in content_type
+    assert content_type == "extra"
+    assert json.loads(body) == MESSAGE
@@ -0,0 +1,31 @@
+from source.config import settings
+from source.message_broker.codecs import decode_reply, encode_message
+
+
+def big_message(service: str) -> dict:
+    return {service: {"action": "import_prices", "body": {"prices": ["1250000"] * settings.RPC_COMPRESSION_THRESHOLD}}}
+
+
+def test_big_requests_go_out_plain_by_default():
+    body, _, content_encoding = encode_message(big_message("product"))
+
+    assert content_encoding is None
+    assert decode_reply(body) == big_message("product")
+
+
+def test_big_requests_are_compressed_for_services_that_opted_in(monkeypatch):
+    monkeypatch.setattr(settings, "RPC_COMPRESSION_SERVICES", ["product"])
+
+    body, _, content_encoding = encode_message(big_message("product"))
+
+    assert content_encoding == "deflate"
+    assert decode_reply(body, None, content_encoding) == big_message("product")
+
+
+def test_a_message_is_compressed_only_if_every_service_opted_in(monkeypatch):
+    monkeypatch.setattr(settings, "RPC_COMPRESSION_SERVICES", ["product"])
+    message = dict(big_message("product"), **big_message("cart"))
+
+    _, _, content_encoding = encode_message(message)
+
+    assert content_encoding is None
@@ -0,0 +1,40 @@
+import json
+import time
+
+import pika
+
+from source.message_broker.memory_broker import constant
+from source.message_broker.rabbit_server import RabbitRPC
+from source.message_broker.reply_dispatcher import ReplyRouter
+
+
+def reply(router: ReplyRouter, corr_id: str, service: str, message: dict):
+    router.on_response(None, None, pika.BasicProperties(correlation_id=corr_id), json.dumps({service: message}).encode())
+
+
+def rpc(timeout: float = 1) -> RabbitRPC:
+    client = RabbitRPC(exchange_name="headers_exchange", timeout=timeout)
+    client.response_len_setter(response_len=1)
+    return client
+
+
+def test_wait_until_returns_the_services_past_their_deadline():
+    router = ReplyRouter()
+    pending = router.register("corr", 2)
+    reply(router, "corr", "cart", {"success": True})
+    now = time.monotonic()
+
+    assert pending.wait_until({"cart": now + 1, "product": now + 0.05}) == ["product"]
+    assert time.monotonic() - now < 0.5
+
+
+def test_service_missing_its_deadline_gets_a_timeout_error(fake_service):
+    fake_service("slow", latency=constant(1))
+
+    started = time.monotonic()
+    result = rpc().publish({"slow": {"action": "get_something", "body": {}}}, {"slow": True}, timeout=0.1)
+
+    assert time.monotonic() - started < 0.5
+    assert result["slow"]["status_code"] == 504
+    assert result["slow"]["timeout"] is True
+    assert result["slow"]["success"] is False
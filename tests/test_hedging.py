@@ -0,0 +1,51 @@
+import time
+
+from source.config import settings
+from source.message_broker.hedging import hedger
+from source.message_broker.rabbit_server import RabbitRPC
+
+ACTION = "get_product_by_system_code"
+KEY = ("hedged", ACTION)
+
+
+def call() -> dict:
+    rpc = RabbitRPC(exchange_name="headers_exchange", timeout=1)
+    rpc.response_len_setter(response_len=1)
+    return rpc.publish({"hedged": {"action": ACTION, "body": {}}}, {"hedged": True})
+
+
+def hedged_service(fake_service, *latencies: float):
+    # the n-th message published to the service is answered after latencies[n]
+    remaining = iter(latencies)
+    fake_service("hedged", latency=lambda: next(remaining))
+    for _ in range(settings.RPC_HEDGE_MIN_SAMPLES + 16):
+        hedger.observe(KEY, 0.02)
+    hedger.tokens = hedger.MAX_TOKENS
+
+
+def test_first_attempt_that_wins_is_recorded(fake_service):
+    hedged_service(fake_service, 0.05, 0.3)
+    observed = hedger.trackers[KEY].count
+
+    assert call()["hedged"]["success"]
+
+    assert hedger.trackers[KEY].count == observed + 1
+    assert 0.04 < hedger.trackers[KEY].latencies[-1] < 0.2
+    assert hedger.awaited == []
+
+
+def test_hedge_that_wins_waits_for_the_first_attempt(fake_service):
+    hedged_service(fake_service, 0.3, 0.05)
+    observed = hedger.trackers[KEY].count
+
+    started = time.monotonic()
+    assert call()["hedged"]["success"]
+
+    assert time.monotonic() - started < 0.2
+    # the hedge's latency is never recorded, the first attempt's once it replied
+    assert hedger.trackers[KEY].count == observed
+    assert hedger.collect() == []
+    time.sleep(0.3)
+    assert len(hedger.collect()) == 1
+    assert hedger.trackers[KEY].count == observed + 1
+    assert hedger.trackers[KEY].latencies[-1] >= 0.3
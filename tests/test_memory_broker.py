@@ -0,0 +1,13 @@
+from source.message_broker.rabbit_server import RabbitRPC
+
+
+def test_fanout_reaches_only_the_services_bound_to_the_exchange(fake_service):
+    notified = fake_service("notification", exchanges=("customer_updates",))
+    other = fake_service("report", exchanges=("order_updates",))
+    unbound = fake_service("cart")
+
+    RabbitRPC(exchange_name="headers_exchange", timeout=1).fanout_publish("customer_updates", {"customer_id": 1})
+
+    assert notified.fanout_messages == [{"customer_id": 1}]
+    assert other.fanout_messages == []
+    assert unbound.fanout_messages == []
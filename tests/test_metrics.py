@@ -0,0 +1,35 @@
+import os
+import subprocess
+import sys
+
+from conftest import ROOT
+
+
+def run(*lines: str) -> subprocess.CompletedProcess:
+    # prometheus_client picks its value class once per process, every case needs a fresh interpreter
+    return subprocess.run(
+        [sys.executable, "-c", "\n".join(("import os",) + lines)],
+        cwd=ROOT, env=dict(os.environ), capture_output=True, text=True
+    )
+
+
+def test_metrics_switch_prometheus_to_multiprocess_mode(tmp_path):
+    result = run(
+        f"os.environ['PROMETHEUS_MULTIPROC_DIR'] = {str(tmp_path)!r}",
+        "import source.helpers.metrics",
+        "from prometheus_client import values",
+        "assert values.ValueClass is not values.MutexValue",
+    )
+
+    assert result.returncode == 0, result.stderr
+
+
+def test_prometheus_imported_too_early_is_refused(tmp_path):
+    result = run(
+        "import prometheus_client",
+        f"os.environ['PROMETHEUS_MULTIPROC_DIR'] = {str(tmp_path)!r}",
+        "import source.helpers.metrics",
+    )
+
+    assert result.returncode != 0
+    assert "import source.helpers.metrics first" in result.stderr
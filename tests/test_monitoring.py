@@ -0,0 +1,53 @@
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from prometheus_client import REGISTRY
+
+from source.config import settings
+from source.helpers import monitoring
+from source.helpers.monitoring import Monitoring
+from source.helpers.request_context import RequestContextMiddleware
+
+
+@pytest.fixture
+def client(monkeypatch):
+    points = list()
+    monkeypatch.setattr(settings, "INFLUXDB_ENABLED", True)
+    monkeypatch.setattr(monitoring.influx_writer, "monitoring", lambda tags, fields: points.append(tags))
+    shop = FastAPI()
+
+    @shop.get("/items/{item_id}")
+    def item(item_id: int):
+        return {"item_id": item_id}
+
+    app = FastAPI()
+    app.mount("/shop/api/v1", shop)
+    app.add_middleware(Monitoring)
+    app.add_middleware(RequestContextMiddleware)
+    test_client = TestClient(app)
+    test_client.points = points
+    return test_client
+
+
+def requests(route: str, status: str) -> float:
+    labels = {"app": "shop", "method": "GET", "route": route, "status": status}
+    return REGISTRY.get_sample_value("gateway_http_requests_total", labels) or 0
+
+
+def test_requests_are_labelled_with_their_route_template(client):
+    before = requests("/shop/api/v1/items/{item_id}", "200")
+
+    client.get("/shop/api/v1/items/1")
+    client.get("/shop/api/v1/items/2")
+
+    assert requests("/shop/api/v1/items/{item_id}", "200") == before + 2
+    assert [point["url"] for point in client.points] == ["/shop/api/v1/items/{item_id}"] * 2
+
+
+def test_unmatched_paths_are_labelled_as_path_under_their_mount(client):
+    before = requests("/shop/api/v1/{path}", "404")
+
+    client.get("/shop/api/v1/no/such/page")
+
+    assert requests("/shop/api/v1/{path}", "404") == before + 1
+    assert client.points[-1]["url"] == "/shop/api/v1/{path}"
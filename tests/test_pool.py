@@ -0,0 +1,63 @@
+import pytest
+
+from source.message_broker import pool
+from source.message_broker.pool import ChannelPool
+
+
+class FakeConnection:
+    """what PooledChannel uses of a pika BlockingConnection and its channel"""
+
+    opened = 0
+
+    def __init__(self, parameters):
+        FakeConnection.opened += 1
+        self.is_open = True
+
+    def channel(self):
+        return self
+
+    def exchange_declare(self, exchange, exchange_type):
+        pass
+
+    def process_data_events(self, time_limit=None):
+        pass
+
+    def close(self):
+        self.is_open = False
+
+
+@pytest.fixture
+def channels(monkeypatch):
+    monkeypatch.setattr(pool.pika, "BlockingConnection", FakeConnection)
+    FakeConnection.opened = 0
+    return ChannelPool("headers_exchange", "localhost", 5672, "guest", "guest", max_size=2, lease_timeout=0.05)
+
+
+def test_channels_are_reused_across_leases(channels):
+    for _ in range(5):
+        with channels.lease() as pooled:
+            assert pooled.is_open()
+
+    assert FakeConnection.opened == 1
+
+
+def test_broken_channel_is_replaced_on_lease(channels):
+    with channels.lease() as pooled:
+        broken = pooled
+    broken.connection.is_open = False
+
+    with channels.lease() as pooled:
+        assert pooled is not broken
+
+    assert FakeConnection.opened == 2
+
+
+def test_exhausted_pool_raises_timeout_error(channels):
+    first, second = channels.acquire(), channels.acquire()
+
+    with pytest.raises(TimeoutError):
+        channels.acquire()
+
+    channels.release(first)
+    assert channels.acquire() is first
+    channels.release(second)
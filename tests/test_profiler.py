@@ -0,0 +1,57 @@
+import threading
+from collections import Counter, defaultdict
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from source.helpers.profiler import Profiler, ProfilerState, instrument, profiler
+from source.helpers.request_context import RequestContextMiddleware
+
+ready = threading.Event()
+release = threading.Event()
+
+
+def blocking_endpoint():
+    ready.set()
+    release.wait(1)
+    return {"success": True}
+
+
+@pytest.fixture
+def client(monkeypatch):
+    # the test samples by hand, the sampler thread must not run
+    monkeypatch.setattr(profiler, "thread", threading.current_thread())
+    monkeypatch.setattr(profiler, "state", ProfilerState(enabled=True, slow_threshold=0, sample_rate=0))
+    monkeypatch.setattr(profiler, "profiles", defaultdict(Counter))
+    ready.clear()
+    release.clear()
+    app = FastAPI()
+    app.get("/blocking")(blocking_endpoint)
+    app.add_middleware(Profiler)
+    app.add_middleware(RequestContextMiddleware)
+    instrument(app.routes)
+    return TestClient(app)
+
+
+def test_sync_endpoint_is_sampled_in_the_threadpool(client):
+    request = threading.Thread(target=client.get, args=("/blocking",))
+    request.start()
+    assert ready.wait(1)
+
+    profiler.sample()
+    release.set()
+    request.join()
+
+    stacks = profiler.profiles["GET /blocking"]
+    assert any("test_profiler:blocking_endpoint" in stack.split(";") for stack in stacks)
+    assert profiler.threads == {}
+
+
+def test_endpoints_are_wrapped_once(client):
+    route = next(route for route in client.app.routes if getattr(route, "path", None) == "/blocking")
+    wrapped = route.dependant.call
+    instrument(client.app.routes)
+
+    assert route.dependant.call is wrapped
+    assert wrapped.__wrapped__ is blocking_endpoint
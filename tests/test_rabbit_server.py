@@ -0,0 +1,70 @@
+import pika
+import pytest
+
+from source.message_broker.admission import limiters
+from source.message_broker.memory_broker import get_memory_transport
+from source.message_broker.rabbit_server import RabbitRPC
+
+
+def rpc() -> RabbitRPC:
+    client = RabbitRPC(exchange_name="headers_exchange", timeout=1)
+    client.response_len_setter(response_len=1)
+    return client
+
+
+def unreachable_broker(monkeypatch):
+    def send(*args, **kwargs):
+        raise pika.exceptions.AMQPConnectionError("connection refused")
+
+    monkeypatch.setattr(get_memory_transport(), "send", send)
+
+
+def test_unreachable_broker_gives_an_unavailable_reply(monkeypatch):
+    unreachable_broker(monkeypatch)
+
+    result = rpc().publish({"cart": {"action": "get_cart", "body": {}}}, {"cart": True})
+
+    assert result["cart"]["status_code"] == 503
+    assert result["cart"]["success"] is False
+
+
+def test_unexpected_errors_propagate(monkeypatch):
+    def send(*args, **kwargs):
+        raise ValueError("not serializable")
+
+    monkeypatch.setattr(get_memory_transport(), "send", send)
+
+    with pytest.raises(ValueError):
+        rpc().publish({"cart": {"action": "get_cart", "body": {}}}, {"cart": True})
+
+
+def test_unreachable_broker_gives_unavailable_scatter_replies(monkeypatch):
+    unreachable_broker(monkeypatch)
+    message = {service: {"action": "get_something", "body": {}} for service in ("cart", "order")}
+
+    replies = dict(rpc().scatter(message, {"cart": True, "order": True}, optional=("order",)))
+
+    assert replies["cart"]["status_code"] == 503
+    assert replies["order"]["status_code"] == 503 and replies["order"]["optional"]
+    assert {service: limiter.in_flight for service, limiter in limiters.items()} == {"cart": 0, "order": 0}
+
+
+def test_scatter_releases_its_admission_slots_when_no_consumer_gets_ready(monkeypatch):
+    def register(*args, **kwargs):
+        raise TimeoutError("reply consumer not ready")
+
+    monkeypatch.setattr(get_memory_transport(), "register", register)
+
+    replies = dict(rpc().scatter({"cart": {"action": "get_cart", "body": {}}}, {"cart": True}))
+
+    assert replies["cart"]["status_code"] == 503
+    assert limiters["cart"].in_flight == 0
+
+
+def test_unreachable_broker_gives_an_unavailable_reply_per_batch_request(monkeypatch):
+    unreachable_broker(monkeypatch)
+
+    replies = rpc().batch("cart", [{"action": "get_cart", "body": {"user_id": i}} for i in range(3)])
+
+    assert [reply["status_code"] for reply in replies] == [503, 503, 503]
+    assert limiters["cart"].in_flight == 0
@@ -0,0 +1,72 @@
+import json
+import threading
+
+import pika
+
+from source.message_broker.rabbit_server import RabbitRPC
+from source.message_broker.reply_dispatcher import ReplyRouter
+
+
+def reply(router: ReplyRouter, corr_id: str, service: str, message: dict):
+    router.on_response(None, None, pika.BasicProperties(correlation_id=corr_id), json.dumps({service: message}).encode())
+
+
+def rpc(timeout: float = 1) -> RabbitRPC:
+    client = RabbitRPC(exchange_name="headers_exchange", timeout=timeout)
+    client.response_len_setter(response_len=1)
+    return client
+
+
+def test_replies_are_routed_by_correlation_id():
+    router = ReplyRouter()
+    first = router.register("first", 2)
+    second = router.register("second", 1)
+
+    reply(router, "second", "cart", {"success": True, "message": "second"})
+    reply(router, "first", "cart", {"success": True, "message": "first"})
+    reply(router, "first", "product", {"success": True, "message": "first"})
+
+    assert first.wait(0) and second.wait(0)
+    assert first.result() == {
+        "cart": {"success": True, "message": "first"}, "product": {"success": True, "message": "first"}
+    }
+    assert second.result() == {"cart": {"success": True, "message": "second"}}
+
+
+def test_late_and_unknown_replies_are_dropped():
+    router = ReplyRouter()
+    pending = router.register("corr", 1)
+    router.discard("corr")
+
+    reply(router, "corr", "cart", {"success": True})
+    reply(router, "unknown", "cart", {"success": True})
+
+    assert pending.result() == {}
+
+
+def test_first_reply_of_a_service_wins_across_aliases():
+    router = ReplyRouter()
+    pending = router.register("primary", 1)
+    router.alias("hedge", pending)
+
+    reply(router, "hedge", "product", {"success": True, "message": "hedge"})
+    reply(router, "primary", "product", {"success": True, "message": "primary"})
+
+    assert pending.result() == {"product": {"success": True, "message": "hedge"}}
+
+
+def test_concurrent_calls_get_their_own_replies(fake_service):
+    fake_service("echo", handlers={"echo": lambda body: {"success": True, "message": body}},
+                 latency=lambda: 0.01)
+    results = dict()
+
+    def call(i: int):
+        results[i] = rpc().publish({"echo": {"action": "echo", "body": i}}, {"echo": True})
+
+    threads = [threading.Thread(target=call, args=(i,)) for i in range(20)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert {i: result["echo"]["message"] for i, result in results.items()} == {i: i for i in range(20)}
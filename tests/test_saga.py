@@ -0,0 +1,156 @@
+import pytest
+from fastapi import HTTPException
+
+from source.config import settings
+from source.helpers import saga_pattern
+from source.helpers.saga_pattern import journal
+from source.message_broker.rabbitmq import new_rpc
+
+
+class FakeSagaCollection:
+    """the saga collection as the journal writes it: documents by _id"""
+
+    def __init__(self):
+        self.documents = dict()
+        # called while the operations are being written, before they are applied
+        self.writing = None
+        self.error = None
+
+    def bulk_write(self, operations, ordered=True):
+        if self.writing is not None:
+            writing, self.writing = self.writing, None
+            writing()
+        if self.error is not None:
+            raise self.error
+        for operation in operations:
+            item_id = operation._filter["_id"]
+            if hasattr(operation, "_doc"):
+                self.documents[item_id] = operation._doc
+            else:
+                self.documents.pop(item_id, None)
+
+
+@pytest.fixture
+def saga_collection(monkeypatch):
+    collection = FakeSagaCollection()
+
+    class FakeMongoDb:
+        saga_collection = collection
+
+        def __enter__(self):
+            return self
+
+        def __exit__(self, exc_type, exc_val, exc_tb):
+            pass
+
+    monkeypatch.setattr(saga_pattern, "MongoDb", FakeMongoDb)
+    journal.flush()
+    journal.persisted.clear()
+    yield collection
+    journal.flush()
+
+
+def step(service: str, action: str) -> dict:
+    return {service: {"action": action, "body": {"order_id": 1}}}
+
+
+def actions(service) -> list:
+    return [action for action, _ in service.received]
+
+
+def recording_service(fake_service, name: str, **kwargs):
+    service = fake_service(name, **kwargs)
+    service.received = list()
+    handle = service.handle
+
+    def record(request):
+        service.received.append((request.get("action"), request.get("body")))
+        return handle(request)
+
+    service.handle = record
+    return service
+
+
+def test_committed_saga_leaves_nothing_to_compensate(fake_service, saga_collection):
+    recording_service(fake_service, "saga_wallet")
+    recording_service(fake_service, "saga_stock")
+
+    result = new_rpc.publish([step("saga_wallet", "reserve"), step("saga_stock", "reserve")], saga=True)
+
+    assert [reply["success"] for reply in result] == [True, True]
+    assert journal.pending == {}
+    journal.flush()
+    assert saga_collection.documents == {}
+
+
+def test_failed_saga_is_compensated_and_cleared(fake_service, saga_collection):
+    wallet = recording_service(fake_service, "saga_wallet")
+    recording_service(fake_service, "saga_stock", error_rate=1, error_status=409)
+
+    with pytest.raises(HTTPException) as error:
+        new_rpc.publish([step("saga_wallet", "reserve"), step("saga_stock", "reserve")], saga=True)
+
+    assert error.value.status_code == 409
+    assert actions(wallet) == ["reserve", "reserve_rollback"]
+    journal.flush()
+    assert saga_collection.documents == {}
+
+
+def test_timed_out_saga_is_compensated_and_cleared(fake_service, saga_collection, monkeypatch):
+    monkeypatch.setitem(settings.RPC_SERVICE_TIMEOUTS, "saga_stock", 0.1)
+    wallet = recording_service(fake_service, "saga_wallet")
+    stock = recording_service(fake_service, "saga_stock", drop_rate=1)
+
+    with pytest.raises(HTTPException) as error:
+        new_rpc.publish([step("saga_wallet", "reserve"), step("saga_stock", "reserve")], saga=True)
+
+    assert error.value.status_code == 500
+    assert actions(wallet) == ["reserve", "reserve_rollback"]
+    # the service that never answered is not compensated
+    assert actions(stock) == ["reserve"]
+    journal.flush()
+    assert saga_collection.documents == {}
+
+
+def test_committed_saga_already_written_is_deleted(saga_collection):
+    saga = saga_pattern.Saga()
+    saga.add(step("saga_wallet", "reserve"))
+    journal.flush()
+    assert list(saga_collection.documents) == [saga.item_id]
+    new_rpc.publish_response_handler(
+        step("saga_wallet", "reserve"), {"saga_wallet": {"success": True, "status_code": 200}}, saga
+    )
+    journal.flush()
+
+    assert saga_collection.documents == {}
+    assert journal.pending == {}
+
+
+
+def test_saga_committed_while_its_stack_is_written_is_deleted(saga_collection):
+    saga = saga_pattern.Saga()
+    saga.add(step("saga_wallet", "reserve"))
+    item_id = saga.item_id
+    saga_collection.writing = saga.finish
+
+    journal.flush()
+    assert list(saga_collection.documents) == [item_id]
+    journal.flush()
+
+    assert saga_collection.documents == {}
+
+
+def test_saga_committed_while_its_stack_fails_to_be_written_is_not_restored(saga_collection):
+    saga = saga_pattern.Saga()
+    saga.add(step("saga_wallet", "reserve"))
+    item_id = saga.item_id
+    saga_collection.writing = saga.finish
+    saga_collection.error = RuntimeError("write failed")
+
+    with pytest.raises(RuntimeError):
+        journal.flush()
+
+    assert journal.pending == {item_id: None}
+    saga_collection.error = None
+    journal.flush()
+    assert saga_collection.documents == {}
@@ -0,0 +1,74 @@
+import threading
+import time
+
+from source.message_broker.memory_broker import constant
+from source.message_broker.rabbit_server import RabbitRPC
+from source.message_broker.single_flight import SingleFlight
+
+MENU = {"success": True, "status_code": 200, "message": {"items": ["phones", "laptops"]}}
+
+
+def get_menu() -> dict:
+    rpc = RabbitRPC(exchange_name="headers_exchange", timeout=1)
+    rpc.response_len_setter(response_len=1)
+    return rpc.publish({"menu": {"action": "get_mega_menu", "body": {}}}, {"menu": True})
+
+
+def test_followers_get_the_leaders_reply(fake_service):
+    service = fake_service("menu", handlers={"get_mega_menu": MENU}, latency=constant(0.1))
+    results = list()
+
+    threads = [threading.Thread(target=lambda: results.append(get_menu())) for _ in range(5)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert service.calls == 1
+    assert [result["menu"] for result in results] == [MENU] * 5
+    # every caller gets a copy of its own
+    results[0]["menu"]["message"]["items"].append("tablets")
+    assert results[1]["menu"]["message"]["items"] == ["phones", "laptops"]
+
+
+def test_calls_after_the_flight_landed_publish_again(fake_service):
+    service = fake_service("menu", handlers={"get_mega_menu": MENU})
+
+    get_menu()
+    get_menu()
+
+    assert service.calls == 2
+
+
+def test_the_leaders_error_is_raised_in_its_followers():
+    flights = SingleFlight()
+    key = ("menu", "get_mega_menu", "{}")
+    started = threading.Event()
+    release = threading.Event()
+    errors = list()
+
+    def fail():
+        started.set()
+        release.wait(1)
+        raise ValueError("broken")
+
+    def call(function):
+        try:
+            flights.do(key, function, 1)
+        except ValueError as e:
+            errors.append(e)
+
+    leader = threading.Thread(target=call, args=(fail,))
+    leader.start()
+    assert started.wait(1)
+    follower = threading.Thread(target=call, args=(lambda: None,))
+    follower.start()
+    deadline = time.monotonic() + 1
+    while flights.flights[key].followers == 0 and time.monotonic() < deadline:
+        time.sleep(0.001)
+    release.set()
+    leader.join()
+    follower.join()
+
+    assert len(errors) == 2
+    assert errors[0] is errors[1]
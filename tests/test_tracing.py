@@ -0,0 +1,53 @@
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from source.config import settings
+from source.helpers import tracing
+from source.helpers.request_context import RequestContextMiddleware
+from source.helpers.tracing import CLIENT, SERVER, Tracing
+from source.message_broker.rabbit_server import RabbitRPC
+
+TRACE_ID = "4bf92f3577b34da6a3ce929d0e0e4736"
+PARENT_ID = "00f067aa0ba902b7"
+
+
+@pytest.fixture
+def client(monkeypatch, fake_service):
+    spans = list()
+    monkeypatch.setattr(settings, "TRACING_SERVER_TIMING", True)
+    monkeypatch.setattr(tracing.exporter, "export", spans.append)
+    fake_service("cart", handlers={"get_cart": {"success": True, "status_code": 200, "message": {"products": []}}})
+    app = FastAPI()
+
+    @app.get("/carts/{user_id}")
+    def cart(user_id: int):
+        rpc = RabbitRPC(exchange_name="headers_exchange", timeout=1)
+        rpc.response_len_setter(response_len=1)
+        return rpc.publish({"cart": {"action": "get_cart", "body": {"user_id": user_id}}}, {"cart": True})
+
+    app.add_middleware(Tracing)
+    app.add_middleware(RequestContextMiddleware)
+    test_client = TestClient(app)
+    test_client.spans = spans
+    return test_client
+
+
+def test_rpc_spans_are_children_of_the_request_span(client):
+    response = client.get("/carts/1", headers={"traceparent": f"00-{TRACE_ID}-{PARENT_ID}-01"})
+
+    assert response.status_code == 200
+    rpc, server = client.spans
+    assert (server.kind, server.name, server.parent_id) == (SERVER, "GET /carts/{user_id}", PARENT_ID)
+    assert (rpc.kind, rpc.name, rpc.outcome) == (CLIENT, "cart.get_cart", "ok")
+    assert rpc.trace_id == server.trace_id == TRACE_ID
+    assert rpc.parent_id == server.span_id
+
+
+def test_server_timing_lists_the_rpc_spans(client):
+    response = client.get("/carts/1", headers={"traceparent": f"00-{TRACE_ID}-{PARENT_ID}-01"})
+
+    header = response.headers["server-timing"]
+    assert header.startswith('cart.get_cart;dur=')
+    assert ', gateway;dur=' in header
+    assert header.endswith(f'trace;desc="{TRACE_ID}"')